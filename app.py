@@ -1,40 +1,167 @@
 import os
-import sqlite3
-from flask import Flask, request, redirect, url_for, render_template, send_from_directory, session, flash, abort
+from flask import Flask, Request, request, redirect, url_for, render_template, send_from_directory, send_file, session, flash, abort, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-import pillow_heif
-from PIL import ImageOps
+import math
+import mimetypes
+import hashlib
+import hmac
+import time
 from datetime import datetime
 from flask_wtf.csrf import CSRFProtect
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import zlib
+import db
+import export
+import jobs
+import metrics
+import resumable
+import static_assets
+import storage
+from db import get_db, transaction
+from imaging import (ALLOWED_EXTENSIONS, DERIVATIVE_ENCODERS, ImageTooLargeError, available_encoders, file_sha256,
+                     inspect_image, render_resized)
+from PIL import UnidentifiedImageError
+from resize_cache import ResizeCache
+from response_cache import ResponseCache
+from tile_cache import TileCache, TileUnavailable
+from flask_wtf.csrf import generate_csrf
+
+class UploadRequest(Request):
+    """Eigene Body-Grenzen für Batch-Upload und Teilstücke wiederaufnehmbarer Uploads."""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_batch':
+            return BATCH_MAX_CONTENT_LENGTH
+        if self.endpoint == 'upload_session':
+            return RESUMABLE_CHUNK_SIZE
+        return super().max_content_length
 
-pillow_heif.register_heif_opener()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 # Use an environment variable in production. Fallback to a random key for dev.
 app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
 
+# Persistent data: APP_DATA_DIR if set (e.g. benchmark datasets), else /data on Railway (with volume)
+DATA_DIR = os.environ.get('APP_DATA_DIR') or ('/data' if os.path.exists('/data') else None)
+
+
+def _data_path(name, dev_default):
+    """Pfad im Datenverzeichnis bzw. der lokale Dev-Pfad, wenn es keines gibt."""
+    return os.path.join(DATA_DIR, name) if DATA_DIR else dev_default
+
+
 # Database path: use /data on Railway (with volume), fallback to local for dev
-DB_PATH = '/data/database.db' if os.path.exists('/data') else 'database.db'
+DB_PATH = _data_path('database.db', 'database.db')
 
 # Upload folder: use /data/uploads on Railway (with volume), fallback to static/uploads for dev
-UPLOAD_FOLDER = '/data/uploads' if os.path.exists('/data') else 'static/uploads'
+UPLOAD_FOLDER = _data_path('uploads', 'static/uploads')
 
 # Thumbnail folder: use /data/thumbnails on Railway, fallback to static/thumbnails for dev
-THUMBNAIL_FOLDER = '/data/thumbnails' if os.path.exists('/data') else 'static/thumbnails'
+THUMBNAIL_FOLDER = _data_path('thumbnails', 'static/thumbnails')
+
+# Cache für On-Demand-Renditionen (/img/<id>/<breite>.<fmt>)
+RESIZE_CACHE_FOLDER = _data_path('resize_cache', 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = int(os.environ.get('RESIZE_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+# Versionierter Cache für Marker-JSON und Galerie-Zeilen (geteilt zwischen den Workern)
+RESPONSE_CACHE_PATH = _data_path('response_cache.db', 'response_cache.db')
+
+# Exporte (/export/spots.<fmt>): pro Datenversion und Filter einmal erzeugt, gzip-komprimiert abgelegt
+EXPORT_CACHE_FOLDER = _data_path('export_cache', 'export_cache')
+EXPORT_CACHE_MAX_FILES = 200   # je Ausschnitt/Filter eine Datei; die ältesten fliegen zuerst
+
+# Kartenkacheln über den eigenen Server (/tiles/<layer>/<z>/<x>/<y>) statt direkt vom Anbieter
+TILE_PROXY = os.environ.get('TILE_PROXY', '1') not in ('0', 'false', 'False')
+TILE_CACHE_PATH = _data_path('tile_cache.db', 'tile_cache.db')
+TILE_CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_MB', '1024')) * 1024 * 1024
+TILE_TTL = int(os.environ.get('TILE_TTL_DAYS', '30')) * 24 * 3600
+# Upstream je Layer, überschreibbar z.B. mit TILE_UPSTREAM_OSM=http://127.0.0.1:8081/{z}/{x}/{y}.png
+TILE_UPSTREAMS = {
+    'osm': os.environ.get('TILE_UPSTREAM_OSM', 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'),
+    'topo': os.environ.get('TILE_UPSTREAM_TOPO', 'https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png'),
+    'satellite': os.environ.get(
+        'TILE_UPSTREAM_SATELLITE',
+        'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'),
+}
+
+# Metriken aller Prozesse (/admin/metrics); METRICS_TOKEN erlaubt Scraping ohne Login
+METRICS_PATH = _data_path('metrics.db', 'metrics.db')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 # Enable CSRF protection
 csrf = CSRFProtect(app)
 
+app.config['DATABASE'] = DB_PATH
+app.config['METRICS_PATH'] = METRICS_PATH
+db.init_app(app)
+static_assets.init_app(app)
+metrics.init_app(app, image_endpoints=('uploaded_file', 'thumbnail_file', 'resized_image', 'tile'))
+
+resize_cache = ResizeCache(RESIZE_CACHE_FOLDER, RESIZE_CACHE_MAX_BYTES)
+response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+tile_cache = TileCache(TILE_CACHE_PATH, TILE_UPSTREAMS, TILE_CACHE_MAX_BYTES, TILE_TTL)
+
+# Ablage der Originale und Derivate (storage.py): Hash-Verzeichnisse unter UPLOAD_FOLDER/
+# THUMBNAIL_FOLDER oder S3 (ORIGINALS_STORAGE=s3, DERIVATIVES_STORAGE=s3)
+original_store = storage.from_env('ORIGINALS', UPLOAD_FOLDER)
+derivative_store = storage.from_env('DERIVATIVES', THUMBNAIL_FOLDER)
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['THUMBNAIL_FOLDER'] = THUMBNAIL_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max file size
 ALLOWED_CATEGORIES = ["Burg", "Fels", "Kirche", "Aussicht"]
 
+# Batch-Upload (/upload/batch): viele Fotos einer Tour in einem Request
+MAX_FILE_SIZE = app.config['MAX_CONTENT_LENGTH']   # gilt weiterhin pro Datei
+BATCH_MAX_FILES = 100
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_UPLOAD_MB', '512')) * 1024 * 1024
+BATCH_INSPECT_THREADS = min(8, os.cpu_count() or 1)
+
+# Wiederaufnehmbare Uploads (/upload/sessions): große Originale in Teilstücken
+UPLOAD_SPOOL_FOLDER = _data_path('upload_spool', 'upload_spool')
+RESUMABLE_MAX_SIZE = int(os.environ.get('RESUMABLE_MAX_UPLOAD_MB', '200')) * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = int(os.environ.get('RESUMABLE_CHUNK_MB', '4')) * 1024 * 1024
+RESUMABLE_GC_INTERVAL = 600   # Sekunden zwischen zwei Aufräumläufen pro Prozess
+
+# Server-seitiges Clustering für /api/markers
+CLUSTER_MAX_ZOOM = 14      # ab dieser Zoomstufe werden nur noch Einzelpunkte geliefert
+CLUSTER_CELL_PX = 80       # Kantenlänge einer Cluster-Zelle in Bildschirmpixeln
+MAX_MARKER_POINTS = 2000   # Obergrenze für Einzelpunkte pro Antwort
+
+# Erlaubte Breiten für /img/<id>/<breite>.<fmt> (Whitelist, damit der Cache nicht explodiert)
+RESIZE_WIDTHS = (160, 320, 400, 640, 800, 1200, 1600)
+# URL-Endung → Derivat-Format
+RESIZE_FORMATS = {'jpg': 'jpeg', 'webp': 'webp', 'avif': 'avif'}
+
+# Browser-Caching: Uploads und Thumbnails tragen eine UUID im Namen und ändern sich nie
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+RESIZED_MAX_AGE = 7 * 24 * 3600   # /img/... hängt an der Bild-ID, nicht am Inhalt
+
+# Galerie / Listen-API (Keyset-Pagination)
+GALLERY_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Volltextsuche (/api/search)
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_TERMS = 8
+
+# Kachel-Proxy: Browser dürfen Kacheln eine Woche behalten, der Server hält sie TILE_TTL
+TILE_MAX_AGE = 7 * 24 * 3600
+TILE_MAX_ZOOM = 19
+
+# Umkreissuche ("Spots in der Nähe")
+NEARBY_DEFAULT_LIMIT = 6
+NEARBY_MAX_LIMIT = 50
+NEARBY_START_RADIUS_KM = 2.0
+EARTH_RADIUS_KM = 6371.0
+
 # Cookie security flags (dev-safe defaults; enable Secure on prod)
 _secure_cookie = os.environ.get('SESSION_COOKIE_SECURE')
 is_secure = (_secure_cookie in ('1', 'true', 'True')) or (os.environ.get('FLASK_ENV') == 'production')
@@ -45,12 +172,20 @@ app.config.update(
 )
 
 
+def _tile_origins():
+    """Upstream-Hosts für img-src, nur nötig wenn der Browser Kacheln direkt lädt."""
+    if TILE_PROXY:
+        return ""
+    origins = sorted({'/'.join(url.replace('{s}', '*').split('/')[:3]) for url in TILE_UPSTREAMS.values()})
+    return " " + " ".join(origins)
+
+
 def _build_csp():
     return (
         "default-src 'self'; "
         "script-src 'self' https://cdn.jsdelivr.net https://unpkg.com; "
         "style-src 'self' https://cdn.jsdelivr.net https://unpkg.com; "
-        "img-src 'self' data: blob: https://*.tile.openstreetmap.org https://*.tile.opentopomap.org https://server.arcgisonline.com; "
+        f"img-src 'self' data: blob:{_tile_origins()}; "
         "font-src 'self' data:; "
         "connect-src 'self'; "
         "object-src 'none'; base-uri 'self'; frame-ancestors 'none'; form-action 'self'"
@@ -65,113 +200,87 @@ def set_security_headers(resp):
     resp.headers['Permissions-Policy'] = 'geolocation=(), camera=(), microphone=()'
     resp.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
     resp.headers['Cross-Origin-Resource-Policy'] = 'same-origin'
-    resp.headers['Content-Security-Policy'] = _build_csp()
+    resp.headers.setdefault('Content-Security-Policy', _build_csp())
     if is_secure:
         resp.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains; preload'
+    if 'Cache-Control' not in resp.headers:
+        # Dynamische Seiten (CSRF-Token, Session) nie ungeprüft aus einem Cache
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
     return resp
 
 
 
 
-# --- EXIF Hilfsfunktionen ---
-def get_exif_data(image):
-    exif_data = {}
-    info = image._getexif()
-    if info:
-        for tag, value in info.items():
-            decoded = TAGS.get(tag, tag)
-            if decoded == "GPSInfo":
-                gps_data = {}
-                for t in value:
-                    sub_decoded = GPSTAGS.get(t, t)
-                    gps_data[sub_decoded] = value[t]
-                exif_data[decoded] = gps_data
-            else:
-                exif_data[decoded] = value
-    return exif_data
-
-
-def convert_to_degrees(value):
-    """Konvertiert EXIF GPS Werte in Dezimalgrad (robust für alle Formate)"""
-    def to_float(x):
-        if isinstance(x, tuple):
-            return x[0] / x[1]
-        return float(x)
-
-    d = to_float(value[0])
-    m = to_float(value[1])
-    s = to_float(value[2])
-
-    return d + (m / 60.0) + (s / 3600.0)
-
-
-def get_lat_lon(exif_data):
-    """Liest GPS Koordinaten robust und korrekt aus"""
-    if "GPSInfo" not in exif_data:
-        return None, None
-
-    gps_info = exif_data["GPSInfo"]
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Großkreisentfernung zweier Punkte in Kilometern"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
 
-    try:
-        lat = convert_to_degrees(gps_info["GPSLatitude"])
-        lon = convert_to_degrees(gps_info["GPSLongitude"])
-
-        lat_ref = gps_info["GPSLatitudeRef"]
-        lon_ref = gps_info["GPSLongitudeRef"]
-
-        # Bytestrings in Strings umwandeln
-        if isinstance(lat_ref, bytes):
-            lat_ref = lat_ref.decode()
-        if isinstance(lon_ref, bytes):
-            lon_ref = lon_ref.decode()
-
-        lat_ref = lat_ref.upper()
-        lon_ref = lon_ref.upper()
-
-        # Süd und West sind negativ
-        if lat_ref == "S":
-            lat = -lat
-        if lon_ref == "W":
-            lon = -lon
 
-        return lat, lon
-
-    except Exception:
-        return None, None
+def find_nearby(conn, lat, lon, limit=NEARBY_DEFAULT_LIMIT, radius_km=None, exclude_id=None):
+    """
+    Sucht die `limit` nächsten Bilder um (lat, lon) über den R*Tree-Index.
 
+    Der Suchradius wird ausgehend von NEARBY_START_RADIUS_KM vervierfacht, bis
+    genug Treffer innerhalb des Radius liegen (oder radius_km erreicht ist).
+    Jeder Schritt fragt nur die Bounding-Box des aktuellen Radius ab.
 
-def create_thumbnail(source_path, thumbnail_path, size=(400, 400)):
-    """
-    Erstellt ein Thumbnail für ein Bild.
-    
-    Args:
-        source_path: Pfad zum Originalbild
-        thumbnail_path: Pfad wo das Thumbnail gespeichert werden soll
-        size: Maximale Größe als Tuple (Breite, Höhe)
-    
     Returns:
-        bool: True bei Erfolg, False bei Fehler
+        list: Dicts mit id, name, category, filepath, thumbnail_path,
+              latitude, longitude und distance_km, aufsteigend nach Entfernung
     """
-    try:
-        with Image.open(source_path) as img:
-            # Korrigiere Orientierung basierend auf EXIF
-            img = ImageOps.exif_transpose(img)
-            
-            # Erstelle Thumbnail (behält Seitenverhältnis bei)
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            
-            # Speichere als JPEG (auch wenn Original PNG/WebP war)
-            img.convert('RGB').save(thumbnail_path, 'JPEG', quality=85, optimize=True)
-            
-        return True
-    except Exception as e:
-        app.logger.error(f"Fehler beim Erstellen des Thumbnails für {source_path}: {e}")
-        return False
+    max_radius = radius_km if radius_km is not None else math.pi * EARTH_RADIUS_KM
+    radius = min(NEARBY_START_RADIUS_KM, max_radius)
+
+    while True:
+        dlat = math.degrees(radius / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(lat))
+        if abs(lat) + dlat >= 90 or cos_lat < 1e-6:
+            dlon = 180.0
+        else:
+            dlon = min(180.0, dlat / cos_lat)
+
+        rows = conn.execute("""
+            SELECT i.id, i.name, i.category, i.filepath, i.thumbnail_path, i.latitude, i.longitude
+            FROM images_rtree r JOIN images i ON i.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+              AND r.max_lon >= ? AND r.min_lon <= ?
+              AND i.id IS NOT ?
+        """, (lat - dlat, lat + dlat, lon - dlon, lon + dlon, exclude_id)).fetchall()
+
+        hits = []
+        for row in rows:
+            distance = haversine_km(lat, lon, row[5], row[6])
+            if distance <= radius:
+                hits.append((distance, row))
+
+        if len(hits) >= limit or radius >= max_radius:
+            break
+        radius = min(radius * 4, max_radius)
+
+    hits.sort(key=lambda h: h[0])
+    return [
+        {
+            'id': row[0],
+            'name': row[1],
+            'category': row[2],
+            'filepath': row[3],
+            'thumbnail_path': row[4],
+            'latitude': row[5],
+            'longitude': row[6],
+            'distance_km': round(distance, 3),
+        }
+        for distance, row in hits[:limit]
+    ]
 
 
 # --- Datenbank initialisieren (erzeugt oder migriert bei Bedarf) ---
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db.connect(DB_PATH)
     c = conn.cursor()
 
     # Erzeuge die Tabelle mit dem kanonischen Schema, falls sie nicht existiert
@@ -189,6 +298,17 @@ def init_db():
       upload_time TEXT,
       exif_date TEXT,
       exif_time TEXT,
+      status TEXT NOT NULL DEFAULT 'ready',
+      content_hash TEXT,
+      phash INTEGER,
+      near_duplicate_of INTEGER,
+      width INTEGER,
+      height INTEGER,
+      orientation INTEGER,
+      altitude REAL,
+      camera TEXT,
+      lens TEXT,
+      lqip TEXT,
       uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
@@ -213,6 +333,22 @@ def init_db():
         "upload_time": "TEXT",
         "exif_date": "TEXT",
         "exif_time": "TEXT",
+        # 'processing' bis der Worker fertig ist, dann 'ready' (oder 'failed')
+        "status": "TEXT NOT NULL DEFAULT 'ready'",
+        # SHA-256 der hochgeladenen Datei (Duplikaterkennung)
+        "content_hash": "TEXT",
+        # Perzeptueller Hash (dhash) und ggf. das ähnlichste ältere Bild
+        "phash": "INTEGER",
+        "near_duplicate_of": "INTEGER",
+        # Angezeigte Maße, Ausrichtung und EXIF-Eckdaten (vom Worker, Bestand: backfill_metadata.py)
+        "width": "INTEGER",
+        "height": "INTEGER",
+        "orientation": "INTEGER",
+        "altitude": "REAL",
+        "camera": "TEXT",
+        "lens": "TEXT",
+        # Winziger Platzhalter als data:-URI (LQIP), bis das Bild geladen ist
+        "lqip": "TEXT",
     }
 
     for col, coltype in needed.items():
@@ -223,24 +359,204 @@ def init_db():
                 # Best effort: falls ALTER TABLE fehlschlägt, fahren wir fort
                 pass
 
-    conn.close()
+    # Derivate (responsive Größen/Formate) je Bild, erzeugt vom Worker
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS derivatives (
+      image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+      format TEXT NOT NULL,
+      width INTEGER NOT NULL,
+      height INTEGER NOT NULL,
+      path TEXT NOT NULL,
+      bytes INTEGER,
+      PRIMARY KEY (image_id, format, width)
+    ) WITHOUT ROWID;
+    """)
+
+    # Indizes für die Keyset-Pagination (Galerie, /api/images)
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_images_category_id ON images(category, id);
+    DROP INDEX IF EXISTS idx_images_upload_date;
+    CREATE INDEX IF NOT EXISTS idx_images_upload_date_id ON images(upload_date, id);
+    CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images(content_hash);
+    """)
 
-init_db()
+    # Bänder des perzeptuellen Hashs (4 × 16 Bit) für die Ähnlichkeitssuche (siehe dedupe.py)
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_images_phash_b0 ON images((phash & 65535)) WHERE phash IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_images_phash_b1 ON images(((phash >> 16) & 65535)) WHERE phash IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_images_phash_b2 ON images(((phash >> 32) & 65535)) WHERE phash IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_images_phash_b3 ON images(((phash >> 48) & 65535)) WHERE phash IS NOT NULL;
+    """)
+
+    # Job-Queue für die Hintergrundverarbeitung (siehe jobs.py / worker.py)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS jobs (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      kind TEXT NOT NULL,
+      payload TEXT NOT NULL,
+      status TEXT NOT NULL DEFAULT 'queued',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      error TEXT,
+      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      started_at TIMESTAMP,
+      heartbeat_at TIMESTAMP,
+      finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+    """)
+    # Lebenszeichen des Workers pro laufendem Job (ältere Datenbanken haben die Spalte noch nicht)
+    if 'heartbeat_at' not in [row[1] for row in c.execute("PRAGMA table_info(jobs)").fetchall()]:
+        c.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at TIMESTAMP")
+
+    # Sitzungen wiederaufnehmbarer Uploads (siehe resumable.py)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+      id TEXT PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      filename TEXT NOT NULL,
+      size INTEGER NOT NULL,
+      received INTEGER NOT NULL DEFAULT 0,
+      name TEXT NOT NULL,
+      description TEXT,
+      category TEXT NOT NULL,
+      created REAL NOT NULL,
+      updated REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated);
+    """)
+
+    # Räumlicher Index (R*Tree) über latitude/longitude.
+    # Die Trigger halten ihn bei INSERT/UPDATE/DELETE auf images synchron.
+    conn.executescript("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS images_rtree USING rtree(
+      id, min_lat, max_lat, min_lon, max_lon
+    );
+
+    CREATE TRIGGER IF NOT EXISTS images_rtree_insert AFTER INSERT ON images
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+      INSERT OR REPLACE INTO images_rtree
+      VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS images_rtree_update AFTER UPDATE OF latitude, longitude ON images
+    BEGIN
+      DELETE FROM images_rtree WHERE id = old.id;
+      INSERT INTO images_rtree
+      SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+      WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS images_rtree_delete AFTER DELETE ON images
+    BEGIN
+      DELETE FROM images_rtree WHERE id = old.id;
+    END;
+    """)
+
+    # Datenversion für den Antwort-Cache: jede Änderung an images/derivatives zählt sie hoch,
+    # egal ob sie aus einer Route, dem Worker oder einem Skript kommt.
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS meta (
+      key TEXT PRIMARY KEY,
+      value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0);
+
+    CREATE TRIGGER IF NOT EXISTS images_version_insert AFTER INSERT ON images
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'data_version'; END;
+    CREATE TRIGGER IF NOT EXISTS images_version_update AFTER UPDATE ON images
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'data_version'; END;
+    CREATE TRIGGER IF NOT EXISTS images_version_delete AFTER DELETE ON images
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'data_version'; END;
+    CREATE TRIGGER IF NOT EXISTS derivatives_version_insert AFTER INSERT ON derivatives
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'data_version'; END;
+    CREATE TRIGGER IF NOT EXISTS derivatives_version_delete AFTER DELETE ON derivatives
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'data_version'; END;
+    """)
+
+    # Volltextsuche (FTS5) über name, description und category. Die Tabelle liest
+    # den Inhalt aus images (external content), die Trigger halten den Index synchron.
+    conn.executescript("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+      name, description, category,
+      content='images', content_rowid='id',
+      tokenize='unicode61 remove_diacritics 2',
+      prefix='2 3'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images
+    BEGIN
+      INSERT INTO images_fts (rowid, name, description, category)
+      VALUES (new.id, new.name, new.description, new.category);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE OF name, description, category ON images
+    BEGIN
+      INSERT INTO images_fts (images_fts, rowid, name, description, category)
+      VALUES ('delete', old.id, old.name, old.description, old.category);
+      INSERT INTO images_fts (rowid, name, description, category)
+      VALUES (new.id, new.name, new.description, new.category);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images
+    BEGIN
+      INSERT INTO images_fts (images_fts, rowid, name, description, category)
+      VALUES ('delete', old.id, old.name, old.description, old.category);
+    END;
+    """)
+    # Einmaliger Aufbau für Bestandsdaten (danach pflegen die Trigger den Index)
+    if not conn.execute("SELECT 1 FROM meta WHERE key = 'fts_built'").fetchone():
+        conn.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO meta (key, value) VALUES ('fts_built', 1)")
+
+    # Backfill für bestehende Datenbanken (idempotent)
+    conn.execute("""
+        INSERT INTO images_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM images
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+          AND id NOT IN (SELECT id FROM images_rtree)
+    """)
+    conn.commit()
+
+    conn.close()
 
 
 
 # --- Serve uploaded images from volume ---
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    """Serve uploaded images from UPLOAD_FOLDER (which may be in /data/uploads on Railway)"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded originals from original_store"""
+    return _send_immutable(original_store, filename)
 
 
 # --- Serve thumbnails ---
 @app.route('/thumbnails/<filename>')
 def thumbnail_file(filename):
-    """Serve thumbnail images from THUMBNAIL_FOLDER"""
-    return send_from_directory(app.config['THUMBNAIL_FOLDER'], filename)
+    """Serve thumbnails and derivatives from derivative_store"""
+    return _send_immutable(derivative_store, filename)
+
+
+def _send_immutable(store, filename):
+    """
+    Liefert eine unveränderliche Datei mit langem Browser-Cache aus.
+
+    Dateinamen enthalten eine UUID und werden nie überschrieben, daher
+    `immutable`. ETag/Last-Modified bleiben für If-None-Match → 304 erhalten.
+    Lokale Dateien gehen direkt von der Platte raus, entfernte werden gestreamt.
+    """
+    try:
+        path = store.local_file(filename)
+        stream = store.open(filename) if path is None else None
+    except (FileNotFoundError, ValueError):
+        abort(404)
+    if path is not None:
+        resp = send_file(path, max_age=IMMUTABLE_MAX_AGE)
+    else:
+        resp = send_file(stream, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         etag=filename, max_age=IMMUTABLE_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
 
 
 # --- Login-Logout Hilfsfunktionen ---
@@ -263,7 +579,273 @@ def role_required(*roles):
     return deco
 
 
+# --- On-Demand-Renditionen mit LRU-Cache ---
+@app.route('/img/<int:image_id>/<int:width>.<fmt>')
+def resized_image(image_id, width, fmt):
+    """
+    Liefert das Bild in einer der RESIZE_WIDTHS als JPEG/WebP/AVIF.
+
+    Beim ersten Aufruf wird aus dem Original gerendert, danach aus dem
+    größenbeschränkten Cache (resize_cache) bedient. Jedes Format, dessen
+    Encoder vorhanden ist, wird geliefert, auch wenn es nicht in
+    DERIVATIVE_FORMATS (den beim Upload erzeugten Stufen) steht.
+    """
+    derivative_format = RESIZE_FORMATS.get(fmt)
+    if width not in RESIZE_WIDTHS or derivative_format not in available_encoders():
+        abort(404)
+
+    mimetype = DERIVATIVE_ENCODERS[derivative_format][2]
+    key = f"{image_id}/{width}.{fmt}"
+    cached = resize_cache.lookup(key)
+    if cached:
+        return send_file(cached, mimetype=mimetype, max_age=RESIZED_MAX_AGE)
+
+    row = get_db().execute(
+        "SELECT filepath FROM images WHERE id = ? AND status = 'ready'", (image_id,)
+    ).fetchone()
+    if not row:
+        abort(404)
+    if not original_store.exists(row['filepath']):
+        abort(404)
+
+    os.makedirs(RESIZE_CACHE_FOLDER, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=RESIZE_CACHE_FOLDER, suffix='.' + fmt)
+    os.close(fd)
+    try:
+        with original_store.local_path(row['filepath']) as source:
+            render_resized(source, tmp_path, width, derivative_format)
+        path = resize_cache.store(key, image_id, tmp_path)
+    except Exception as e:
+        app.logger.error(f"Fehler beim Rendern von {key}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        abort(500)
+    return send_file(path, mimetype=mimetype, max_age=RESIZED_MAX_AGE)
+
+
+@app.route('/admin/metrics')
+def metrics_endpoint():
+    """Prometheus-Metriken; für Admins oder mit 'Authorization: Bearer <METRICS_TOKEN>'."""
+    token = request.headers.get('Authorization', '')
+    authorized = session.get('role') == 'admin' or (
+        METRICS_TOKEN and hmac.compare_digest(token.encode(), f"Bearer {METRICS_TOKEN}".encode()))
+    if not authorized:
+        abort(403)
+    resp = app.response_class(metrics.render(), mimetype='text/plain')
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return resp
+
+
+@app.route('/admin/resize-cache')
+@login_required
+@role_required('admin')
+def resize_cache_stats():
+    """Trefferquote und Füllstand des Renditions-Caches."""
+    return jsonify(resize_cache.stats())
+
+
+# --- Kartenkacheln ---
+def tile_url_templates():
+    """Leaflet-URL-Vorlagen je Layer: über den Proxy oder direkt beim Anbieter."""
+    if TILE_PROXY:
+        return {layer: f"{request.script_root}/tiles/{layer}/{{z}}/{{x}}/{{y}}" for layer in TILE_UPSTREAMS}
+    return dict(TILE_UPSTREAMS)
+
+
+@app.context_processor
+def inject_tile_urls():
+    return {'tile_urls': tile_url_templates()}
+
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>')
+def tile(layer, z, x, y):
+    """
+    Kartenkachel aus dem lokalen Cache (tile_cache), bei Bedarf vom Upstream geholt.
+
+    Ein Upstream-Ausfall trifft nur Kacheln, die noch nie geholt wurden.
+    """
+    if not TILE_PROXY or layer not in TILE_UPSTREAMS or z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        abort(404)
+    try:
+        cached = tile_cache.get(layer, z, x, y)
+    except TileUnavailable as e:
+        app.logger.warning(f"Kachel nicht verfügbar: {e}")
+        abort(502)
+
+    resp = _not_modified(cached['etag'])
+    if resp is None:
+        resp = app.response_class(cached['data'], mimetype=cached['content_type'])
+        resp.set_etag(cached['etag'])
+    resp.cache_control.public = True
+    resp.cache_control.max_age = TILE_MAX_AGE
+    return resp
+
+
+@app.route('/admin/tile-cache')
+@login_required
+@role_required('admin')
+def tile_cache_stats():
+    """Füllstand des Kachel-Caches."""
+    return jsonify(tile_cache.stats())
+
+
+# --- Offline-Karte: Service Worker und Web-Manifest ---
+# Von base.html eingebundene CDN-Dateien; der Service Worker legt sie mit der App-Hülle ab
+SHELL_CDN_ASSETS = [
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'https://unpkg.com/leaflet/dist/leaflet.css',
+    'https://unpkg.com/leaflet/dist/leaflet.js',
+]
+SHELL_STATIC_DIRS = ('css', 'js', 'img', 'icons')   # nicht static/uploads oder static/thumbnails (Dev)
+SW_THUMBNAIL_CACHE_MB = 30
+SW_TILE_CACHE_MB = 60
+SW_MARKER_CACHE_ENTRIES = 300
+
+
+def _shell_static_files():
+    """Relative Pfade aller Dateien der App-Hülle unter static/ (ohne .br/.gz-Varianten)."""
+    files = []
+    for folder in SHELL_STATIC_DIRS:
+        root = os.path.join(app.static_folder, folder)
+        for dirpath, _dirs, names in os.walk(root):
+            for name in names:
+                if name.startswith('.') or name.endswith(('.br', '.gz')):
+                    continue
+                files.append(os.path.relpath(os.path.join(dirpath, name), app.static_folder).replace(os.sep, '/'))
+    return sorted(files)
+
+
+@app.route('/sw.js')
+def service_worker():
+    """
+    Service Worker für die Offline-Karte (muss im Wurzelpfad liegen, um /map zu steuern).
+
+    Die Precache-Liste enthält die Static-URLs mit Fingerprint; ändert sich
+    eine Datei, ändern sich Liste und Skript, und der Browser installiert
+    den neuen Worker.
+    """
+    static_files = _shell_static_files()
+    precache = [url_for('static', filename=f) for f in static_files]
+    # map.js lädt die Marker-Symbole ohne Fingerprint
+    precache += [f"{app.static_url_path}/{f}" for f in static_files if f.startswith('icons/')]
+    precache += [url_for('map')] + SHELL_CDN_ASSETS
+    config = {
+        'version': hashlib.sha1('\n'.join(precache).encode('utf-8')).hexdigest()[:12],
+        'precache': precache,
+        'shellPages': [url_for('map'), request.script_root + '/'],
+        'markersUrl': url_for('api_markers'),
+        'thumbnailPrefixes': [request.script_root + '/thumbnails/', request.script_root + '/img/'],
+        'tileTemplates': list(tile_url_templates().values()),
+        'thumbnailCacheBytes': SW_THUMBNAIL_CACHE_MB * 1024 * 1024,
+        'tileCacheBytes': SW_TILE_CACHE_MB * 1024 * 1024,
+        'markerCacheEntries': SW_MARKER_CACHE_ENTRIES,
+    }
+    resp = app.response_class(render_template('sw.js', config=config), mimetype='text/javascript')
+    resp.cache_control.no_cache = True
+    # fetch() aus dem Worker unterliegt dessen eigener CSP: CDN-Dateien und ggf. Kachel-Upstreams erlauben
+    resp.headers['Content-Security-Policy'] = (
+        "default-src 'none'; "
+        f"connect-src 'self' https://cdn.jsdelivr.net https://unpkg.com{_tile_origins()}"
+    )
+    return resp
+
+
+@app.route('/manifest.webmanifest')
+def web_manifest():
+    """Web-App-Manifest (Installation als App, Startseite Karte)."""
+    resp = jsonify({
+        'name': 'MEN IN DRECK',
+        'short_name': 'MEN IN DRECK',
+        'description': 'Mountainbike-Abenteuer mit GPS-Fotos: Burgen, Felsen, Kirchen und Aussichten entdecken!',
+        'lang': 'de',
+        'start_url': url_for('map'),
+        'scope': request.script_root + '/',
+        'display': 'standalone',
+        'background_color': '#212529',
+        'theme_color': '#212529',
+        'icons': [
+            {'src': url_for('static', filename='img/men-in-dreck.svg'), 'sizes': 'any', 'type': 'image/svg+xml'},
+        ],
+    })
+    resp.mimetype = 'application/manifest+json'
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
 # --- Upload Route ---
+def _upload_filename(original_name):
+    """
+    Eindeutiger, sicherer Schlüssel in original_store für einen Originalnamen.
+
+    Returns:
+        str: Dateiname oder None bei nicht unterstütztem Format
+    """
+    original_name = original_name or ''
+    ext = original_name.rsplit('.', 1)[-1].lower() if '.' in original_name else ''
+    if ext not in ALLOWED_EXTENSIONS:
+        return None
+    secure_base = secure_filename(original_name.rsplit('.', 1)[0]) or "image"
+    return f"{uuid.uuid4().hex}_{secure_base}.{ext}"
+
+
+def _store_original(upload):
+    """
+    Legt eine hochgeladene Datei unter einem eindeutigen Namen in original_store ab.
+
+    Returns:
+        str: Dateiname oder None bei nicht unterstütztem Format
+    """
+    filename = _upload_filename(upload.filename)
+    if filename is None:
+        return None
+
+    # Original unverändert ablegen; Konvertierung, EXIF und Thumbnail
+    # übernimmt der Hintergrund-Worker (worker.py). Werkzeug hat den Body
+    # bereits auf die Platte gespoolt, hier wird nur in Blöcken kopiert;
+    # die Ablage macht niemandem eine halb geschriebene Datei sichtbar.
+    original_store.save(filename, upload.stream)
+    return filename
+
+
+def _register_upload(filename, name, description, category):
+    """
+    Hash, Duplikatprüfung, Zeile und Verarbeitungsjob für ein abgelegtes Original.
+
+    Returns:
+        tuple: (image_id, duplicate) – bei einem Duplikat wird die Datei gelöscht
+        und die ID des vorhandenen Bildes geliefert
+    """
+    with metrics.stage('hash'), original_store.local_path(filename) as path:
+        content_hash = file_sha256(path)
+
+    # --- Exakte Duplikate nicht noch einmal ablegen, sondern auf das vorhandene Bild verweisen ---
+    conn = get_db()
+    existing = conn.execute("SELECT id FROM images WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone()
+    if existing:
+        original_store.delete(filename)
+        return existing['id'], True
+
+    # --- Upload Datum/Zeit ---
+    upload_date, upload_time = _upload_timestamp()
+
+    # --- In DB speichern (nur Dateiname, nicht voller Pfad) und Job einreihen ---
+    with transaction(conn):
+        cur = conn.execute("""
+            INSERT INTO images 
+            (name, description, category, filepath, upload_date, upload_time, status, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, 'processing', ?)
+        """, (name, description, category, filename, upload_date, upload_time, content_hash))
+        jobs.enqueue(conn, 'process_image', {'image_id': cur.lastrowid, 'filepath': filename})
+    return cur.lastrowid, False
+
+
+def _upload_timestamp():
+    now = datetime.now()
+    return now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
+
+
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 @role_required('uploader','admin')
@@ -281,146 +863,955 @@ def upload():
         image = request.files['image']
 
         if image:
-            filename = secure_filename(image.filename)
-            ext = filename.rsplit('.', 1)[-1].lower()
+            # --- Validate file extension / save under secure unique filename ---
+            with metrics.stage('store'):
+                filename = _store_original(image)
+            if filename is None:
+                return "Nicht unterstütztes Bildformat. Erlaubt: JPG, PNG, GIF, HEIC, WebP", 400
+            image_id, duplicate = _register_upload(filename, name, description, category)
+            if duplicate:
+                return redirect(url_for('detail', image_id=image_id, duplicate=1))
 
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        return redirect(url_for('gallery'))
+
+    return render_template('upload.html', title="Bild hochladen", categories=ALLOWED_CATEGORIES)
 
-            # --- Validate file extension ---
-            if ext not in ["jpg", "jpeg", "png", "gif", "heic", "heif", "webp"]:
-                return "Nicht unterstütztes Bildformat. Erlaubt: JPG, PNG, GIF, HEIC, WebP", 400
 
-            # --- Generate secure unique filename ---
-            secure_base = secure_filename(image.filename.rsplit('.', 1)[0]) or "image"
-            filename = f"{uuid.uuid4().hex}_{secure_base}.{ext}"
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+def _inspect_stored(filename):
+    """Hash und Header-Prüfung einer abgelegten Datei (läuft im Thread-Pool)."""
+    with original_store.local_path(filename) as path:
+        try:
+            info = inspect_image(path)
+        except UnidentifiedImageError:
+            return {'error': "Keine lesbare Bilddatei"}
+        except ImageTooLargeError as e:
+            return {'error': str(e)}
+        info['content_hash'] = file_sha256(path)
+    return info
 
-            exif_data = {}
-            lat, lon = None, None
-            exif_date = None
-            exif_time = None
 
-            # --- HEIC / HEIF ---
-            if ext in ["heic", "heif"]:
-                heif_file = pillow_heif.read_heif(image.read())
+def _default_name(storage, info):
+    """Name ohne Eingabe: Aufnahmezeit aus EXIF, sonst der Dateiname ohne Endung."""
+    if info.get('exif_date'):
+        return f"{info['exif_date']} {info['exif_time'] or ''}".strip()
+    return (storage.filename or 'Bild').rsplit('.', 1)[0]
 
-                pil_img = Image.frombytes(
-                    heif_file.mode,
-                    heif_file.size,
-                    heif_file.data,
-                    "raw"
-                )
-                pil_img = ImageOps.exif_transpose(pil_img)
 
-                exif_bytes = heif_file.info.get("exif", None)
+@app.route('/upload/batch', methods=['POST'])
+@login_required
+@role_required('uploader','admin')
+def upload_batch():
+    """
+    Lädt viele Bilder in einem Request hoch.
 
-                filename = filename.rsplit('.', 1)[0] + ".jpg"
-                path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    Formularfelder: images (mehrfach), optional gemeinsam name, description,
+    category und pro Datei (in Reihenfolge der Dateien) names, descriptions,
+    categories. Ohne Namen wird die EXIF-Aufnahmezeit bzw. der Dateiname verwendet.
 
-                if exif_bytes:
-                    pil_img.save(path, "JPEG", quality=95, exif=exif_bytes)
-                else:
-                    pil_img.save(path, "JPEG", quality=95)
+    Die Dateien werden parallel gehasht und per Header geprüft, alle Zeilen und
+    Jobs in einer Transaktion angelegt; die Bildverarbeitung verteilt der Worker
+    auf seine Prozesse. Antwort (JSON oder Ergebnisliste im Upload-Formular):
+    pro Datei status 'ok', 'missing_gps' (gespeichert, Standort fehlt),
+    'duplicate', 'unsupported' oder 'error'.
+    """
+    files = [f for f in request.files.getlist('images') if f and f.filename]
+    if not files:
+        return _batch_response([], 400, "Keine Dateien ausgewählt.")
+    if len(files) > BATCH_MAX_FILES:
+        return _batch_response([], 400, f"Höchstens {BATCH_MAX_FILES} Dateien pro Upload.")
+
+    def per_file(field, index, default):
+        values = request.form.getlist(field)
+        value = values[index].strip() if index < len(values) else ''
+        return value or default
+
+    shared_name = request.form.get('name', '').strip()
+    shared_description = request.form.get('description', '').strip()
+    shared_category = request.form.get('category', '')
+
+    results = [{'index': i, 'filename': f.filename} for i, f in enumerate(files)]
+    stored = {}
+    for i, storage in enumerate(files):
+        category = per_file('categories', i, shared_category)
+        if category not in ALLOWED_CATEGORIES:
+            results[i].update(status='error', message="Ungültige Kategorie")
+            continue
+        storage.stream.seek(0, os.SEEK_END)
+        too_large = storage.stream.tell() > MAX_FILE_SIZE
+        storage.stream.seek(0)
+        if too_large:
+            results[i].update(status='error', message="Datei zu groß")
+            continue
+        with metrics.stage('store'):
+            filename = _store_original(storage)
+        if filename is None:
+            results[i].update(status='unsupported', message="Nicht unterstütztes Bildformat")
+            continue
+        stored[i] = filename
+        results[i]['category'] = category
+
+    with metrics.stage('batch_inspect'), ThreadPoolExecutor(max_workers=BATCH_INSPECT_THREADS) as pool:
+        inspected = dict(zip(stored, pool.map(_inspect_stored, stored.values())))
+
+    upload_date, upload_time = _upload_timestamp()
+    conn = get_db()
+    seen = {}   # content_hash → image_id innerhalb dieses Batches
+    discard = []
+    with transaction(conn):
+        for i, filename in stored.items():
+            info, result = inspected[i], results[i]
+            if 'error' in info:
+                result.update(status='unsupported', message=info['error'])
+                discard.append(filename)
+                continue
+
+            existing = seen.get(info['content_hash'])
+            if existing is None:
+                row = conn.execute("SELECT id FROM images WHERE content_hash = ? LIMIT 1",
+                                   (info['content_hash'],)).fetchone()
+                existing = row['id'] if row else None
+            if existing is not None:
+                result.update(status='duplicate', id=existing, message="Bild ist bereits vorhanden")
+                discard.append(filename)
+                continue
+
+            name = per_file('names', i, shared_name) or _default_name(files[i], info)
+            description = per_file('descriptions', i, shared_description)
+            cur = conn.execute("""
+                INSERT INTO images
+                (name, description, category, filepath, latitude, longitude, upload_date, upload_time,
+                 exif_date, exif_time, status, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'processing', ?)
+            """, (name, description, result['category'], filename, info['latitude'], info['longitude'],
+                  upload_date, upload_time, info['exif_date'], info['exif_time'], info['content_hash']))
+            jobs.enqueue(conn, 'process_image', {'image_id': cur.lastrowid, 'filepath': filename})
+            seen[info['content_hash']] = cur.lastrowid
+
+            missing_gps = info['latitude'] is None or info['longitude'] is None
+            result.update(status='missing_gps' if missing_gps else 'ok', id=cur.lastrowid, name=name,
+                          detail_url=url_for('detail', image_id=cur.lastrowid))
+
+    for filename in discard:
+        original_store.delete(filename)
+
+    return _batch_response(results)
+
+
+def _batch_response(results, status=200, error=None):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    if request.accept_mimetypes.best == 'application/json':
+        payload = {'results': results, 'counts': counts}
+        if error:
+            payload['error'] = error
+        return jsonify(payload), status
+    return render_template('upload.html', title="Bild hochladen", categories=ALLOWED_CATEGORIES,
+                           batch_results=results, batch_counts=counts, batch_error=error), status
+
+
+
+# --- Wiederaufnehmbare Uploads in Teilstücken (siehe resumable.py) ---
+_last_upload_gc = 0.0
+
+
+def _session_json(upload, status=200):
+    resp = jsonify({
+        'id': upload['id'],
+        'offset': upload['received'],
+        'size': upload['size'],
+        'chunk_size': RESUMABLE_CHUNK_SIZE,
+        'url': url_for('upload_session', session_id=upload['id']),
+        'finalize_url': url_for('upload_session_finalize', session_id=upload['id']),
+    })
+    resp.status_code = status
+    return _offset_headers(resp, upload['received'], upload['size'])
+
+
+def _offset_headers(resp, offset, size):
+    resp.headers['Upload-Offset'] = str(offset)
+    resp.headers['Upload-Length'] = str(size)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
-            else:
-                image.save(path)
 
-            # --- EXIF aus JPG auslesen ---
-            try:
-                # Verify it's a valid image
-                verify_img = Image.open(path)
-                verify_img.verify()
-
-                pil_img_for_exif = Image.open(path)
-                exif_data = get_exif_data(pil_img_for_exif)
-                lat, lon = get_lat_lon(exif_data)
-
-                # EXIF Datum/Zeit auslesen
-                if "DateTimeOriginal" in exif_data:
-                    dt = exif_data["DateTimeOriginal"]  # Format: "2023:08:15 14:32:10"
-                    try:
-                        exif_date, exif_time = dt.split(" ")
-                        exif_date = exif_date.replace(":", "-")  # schöneres Format
-                    except Exception as e:
-                        app.logger.warning(f"Fehler beim Parsen des EXIF-Datums: {e}")
-                        exif_date = None
-                        exif_time = None
+def _user_session_or_404(session_id):
+    upload = resumable.get(get_db(), session_id, session['user_id'])
+    if upload is None:
+        abort(404)
+    return upload
 
-            except Exception:
-                exif_data = {}
-                lat, lon = None, None
-
-            # Fallback Koordinaten
-            if lat is None:
-                lat = 51.1657
-            if lon is None:
-                lon = 10.4515
-
-            # --- Upload Datum/Zeit ---
-            now = datetime.now()
-            upload_date = now.strftime("%Y-%m-%d")
-            upload_time = now.strftime("%H:%M:%S")
-
-            # --- Thumbnail erstellen ---
-            os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
-            
-            # Thumbnail bekommt denselben Namen wie das Original (aber als .jpg)
-            thumb_filename = os.path.splitext(filename)[0] + '_thumb.jpg'
-            thumb_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumb_filename)
-            
-            # Erstelle Thumbnail
-            thumbnail_created = create_thumbnail(path, thumb_path)
-            
-            # Wenn Thumbnail-Erstellung fehlschlägt, setze None
-            if not thumbnail_created:
-                thumb_filename = None
-
-            # --- In DB speichern (nur Dateiname, nicht voller Pfad) ---
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("""
-                INSERT INTO images 
-                (name, description, category, filepath, thumbnail_path, latitude, longitude,
-                 upload_date, upload_time, exif_date, exif_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (name, description, category, filename, thumb_filename, lat, lon,
-                  upload_date, upload_time, exif_date, exif_time))
-            conn.commit()
-            conn.close()
 
-        return redirect(url_for('map'))
+@app.route('/upload/sessions', methods=['POST'])
+@login_required
+@role_required('uploader','admin')
+def upload_session_create():
+    """
+    Legt eine Upload-Sitzung an.
+
+    Felder (JSON oder Formular): filename, size, name, description, category.
+    Antwort 201 mit id, offset, chunk_size, url (HEAD/PATCH/DELETE) und finalize_url.
+    """
+    global _last_upload_gc
+    data = request.get_json(silent=True) or request.form
+    name = (data.get('name') or '').strip()
+    category = data.get('category')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = -1
+
+    if not name:
+        return jsonify({'error': "Bitte einen Namen eingeben."}), 400
+    if category not in ALLOWED_CATEGORIES:
+        return jsonify({'error': "Ungültige Kategorie"}), 400
+    if _upload_filename(data.get('filename')) is None:
+        return jsonify({'error': "Nicht unterstütztes Bildformat. Erlaubt: JPG, PNG, GIF, HEIC, WebP"}), 400
+    if size <= 0:
+        return jsonify({'error': "Ungültige Dateigröße"}), 400
+    if size > RESUMABLE_MAX_SIZE:
+        return jsonify({'error': f"Datei zu groß (höchstens {RESUMABLE_MAX_SIZE // (1024 * 1024)} MB)"}), 413
+
+    conn = get_db()
+    # Verlassene Sitzungen gelegentlich mit wegräumen, statt einen eigenen Dienst zu brauchen
+    if time.monotonic() - _last_upload_gc >= RESUMABLE_GC_INTERVAL:
+        _last_upload_gc = time.monotonic()
+        resumable.collect_garbage(conn, UPLOAD_SPOOL_FOLDER)
+
+    session_id = resumable.create(conn, UPLOAD_SPOOL_FOLDER, session['user_id'], data.get('filename'), size, {
+        'name': name, 'description': data.get('description') or '', 'category': category,
+    })
+    resp = _session_json(resumable.get(conn, session_id, session['user_id']), 201)
+    resp.headers['Location'] = url_for('upload_session', session_id=session_id)
+    return resp
+
+
+@app.route('/upload/sessions/<session_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+@role_required('uploader','admin')
+def upload_session(session_id):
+    """
+    GET/HEAD: aktueller Offset (Header Upload-Offset), zum Fortsetzen nach Abbruch.
+    PATCH: Teilstück anhängen; Header Upload-Offset muss dem Stand entsprechen
+    (sonst 409 mit dem richtigen Offset), Body als application/offset+octet-stream,
+    höchstens RESUMABLE_CHUNK_SIZE Bytes. DELETE: Upload abbrechen.
+    """
+    upload = _user_session_or_404(session_id)
+    conn = get_db()
+
+    if request.method == 'DELETE':
+        resumable.delete(conn, UPLOAD_SPOOL_FOLDER, session_id)
+        return '', 204
+
+    if request.method == 'PATCH':
+        if request.mimetype != 'application/offset+octet-stream':
+            return jsonify({'error': "Content-Type application/offset+octet-stream erwartet"}), 415
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return jsonify({'error': "Header Upload-Offset fehlt"}), 400
+        if request.content_length and offset + request.content_length > upload['size']:
+            return jsonify({'error': "Teilstück überschreitet die angemeldete Größe"}), 400
+        try:
+            with metrics.stage('chunk'):
+                received = resumable.append(conn, UPLOAD_SPOOL_FOLDER, upload, offset,
+                                            request.stream, request.content_length)
+        except resumable.OffsetMismatch as e:
+            resp = jsonify({'error': str(e), 'offset': e.expected})
+            resp.status_code = 409
+            return _offset_headers(resp, e.expected, upload['size'])
+        return _offset_headers(app.response_class(status=204), received, upload['size'])
+
+    return _session_json(upload)
+
+
+@app.route('/upload/sessions/<session_id>/finalize', methods=['POST'])
+@login_required
+@role_required('uploader','admin')
+def upload_session_finalize(session_id):
+    """
+    Übergibt die vollständige Datei an die normale Verarbeitung (Hash,
+    Duplikatprüfung, Zeile mit status='processing', Job für worker.py).
+
+    Antwort: id, status ('processing' oder 'duplicate') und url der Detailseite.
+    """
+    upload = _user_session_or_404(session_id)
+    if upload['received'] < upload['size']:
+        resp = jsonify({'error': "Upload unvollständig", 'offset': upload['received']})
+        resp.status_code = 409
+        return _offset_headers(resp, upload['received'], upload['size'])
 
-    return render_template('upload.html', title="Bild hochladen")
+    filename = _upload_filename(upload['filename'])
+    try:
+        # Spool und lokale Ablage liegen im selben Datenverzeichnis: Umbenennen statt Kopieren
+        with metrics.stage('store'):
+            original_store.put_file(filename, resumable.spool_path(UPLOAD_SPOOL_FOLDER, session_id), move=True)
+    except FileNotFoundError:
+        # Paralleler Abschluss derselben Sitzung
+        abort(404)
+    resumable.delete(get_db(), UPLOAD_SPOOL_FOLDER, session_id)
 
+    image_id, duplicate = _register_upload(filename, upload['name'], upload['description'], upload['category'])
+    return jsonify({
+        'id': image_id,
+        'status': 'duplicate' if duplicate else 'processing',
+        'url': url_for('detail', image_id=image_id, duplicate=1) if duplicate else url_for('detail', image_id=image_id),
+    }), 200 if duplicate else 201
 
 
 # --- Map Route ---
 @app.route('/')
 @app.route('/map')
 def map():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, description, category, filepath, thumbnail_path, latitude, longitude FROM images")
-    images = c.fetchall()
-    conn.close()
-    return render_template('map.html', images=images, title="Karte")
+    # Die Marker lädt map.js viewport-abhängig über /api/markers nach.
+    # Hier wird nur noch ein optionaler Fokus-Punkt (?focus=<id>) aufgelöst.
+    focus = None
+    focus_id = request.args.get('focus', type=int)
+    if focus_id is not None:
+        row = get_db().execute("SELECT id, latitude, longitude FROM images WHERE id = ?", (focus_id,)).fetchone()
+        if row and row['latitude'] is not None and row['longitude'] is not None:
+            focus = {'id': row['id'], 'lat': row['latitude'], 'lon': row['longitude']}
+    return render_template('map.html', focus=focus, title="Karte", cluster_cell_px=CLUSTER_CELL_PX)
+
+
+def _thumb_url(filepath, thumbnail_path):
+    """Thumbnail-URL eines Bildes, mit Fallback auf das Original."""
+    if thumbnail_path:
+        return url_for('thumbnail_file', filename=thumbnail_path)
+    return url_for('uploaded_file', filename=filepath)
+
+
+def load_derivatives(conn, image_ids):
+    """
+    Lädt die Derivate mehrerer Bilder.
+
+    Returns:
+        dict: image_id → Liste von sqlite3.Row (format, width, height, path), nach Breite sortiert
+    """
+    image_ids = list(image_ids)
+    result = {}
+    # In Blöcken abfragen, um unter dem Variablenlimit von SQLite zu bleiben
+    for start in range(0, len(image_ids), 500):
+        chunk = image_ids[start:start + 500]
+        rows = conn.execute(f"""
+            SELECT image_id, format, width, height, path FROM derivatives
+            WHERE image_id IN ({','.join('?' * len(chunk))})
+            ORDER BY image_id, width
+        """, chunk).fetchall()
+        for row in rows:
+            result.setdefault(row['image_id'], []).append(row)
+    return result
+
+
+def picture_data(derivatives, fallback_url, image=None):
+    """
+    Baut die Daten für ein <picture>-Element.
+
+    `image` (Zeile mit width, height, lqip) liefert den Platzhalter und die
+    Maße, wenn es (noch) keine Derivate gibt.
+
+    Returns:
+        dict: sources (Liste mit type/srcset, moderne Formate zuerst),
+              srcset (JPEG-Fallback für <img>), src, width, height, lqip
+    """
+    lqip = image['lqip'] if image is not None else None
+    if not derivatives:
+        return {'sources': [], 'srcset': '', 'src': fallback_url, 'lqip': lqip,
+                'width': image['width'] if image is not None else None,
+                'height': image['height'] if image is not None else None}
+
+    by_format = {}
+    for d in derivatives:
+        by_format.setdefault(d['format'], []).append(d)
+
+    def srcset(items):
+        return ', '.join(f"{url_for('thumbnail_file', filename=d['path'])} {d['width']}w" for d in items)
+
+    # Reihenfolge aus DERIVATIVE_ENCODERS: modernste Formate zuerst,
+    # der Browser nimmt die erste <source>, die er unterstützt
+    sources = [
+        {'type': encoder[2], 'srcset': srcset(by_format[fmt])}
+        for fmt, encoder in DERIVATIVE_ENCODERS.items()
+        if fmt != 'jpeg' and fmt in by_format
+    ]
+
+    jpegs = by_format.get('jpeg') or derivatives
+    smallest = jpegs[0]
+    return {
+        'sources': sources,
+        'srcset': srcset(jpegs),
+        'src': url_for('thumbnail_file', filename=smallest['path']),
+        'width': smallest['width'],
+        'height': smallest['height'],
+        'lqip': lqip,
+    }
+
+
+def data_version(conn):
+    """Aktuelle Datenversion (wird per Trigger bei jeder Änderung hochgezählt)."""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    return row[0] if row else 0
+
+
+def _version_etag(version, key, *extra):
+    """Starkes ETag aus Datenversion, Cache-Schlüssel und ggf. Sitzungsmerkmalen."""
+    raw = '|'.join(str(part) for part in (version, key) + extra)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]
+
+
+def _not_modified(etag):
+    """304-Antwort, falls der Browser diese Version schon hat, sonst None."""
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+    return None
+
+
+def _parse_bbox(value):
+    """Parst 'west,south,east,north' und begrenzt auf gültige Koordinaten."""
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    south, north = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360 or west > east:
+        # Karte über die Datumsgrenze hinaus gezoomt: ganze Welt abfragen
+        west, east = -180.0, 180.0
+    west, east = max(west, -180.0), min(east, 180.0)
+    if south > north:
+        return None
+    return west, south, east, north
+
+
+@app.route('/api/markers')
+def api_markers():
+    """
+    Liefert die Marker für einen Kartenausschnitt.
+
+    Query-Parameter: bbox=west,south,east,north, zoom, optional category.
+    Unterhalb von CLUSTER_MAX_ZOOM werden die Bilder in einem festen Raster
+    zusammengefasst (Anzahl, Schwerpunkt, repräsentatives Thumbnail);
+    Zellen mit nur einem Bild werden als Einzelpunkt geliefert.
+    """
+    bbox = _parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify(error="Ungültige bbox"), 400
+    zoom = request.args.get('zoom', type=int)
+    if zoom is None:
+        return jsonify(error="Ungültiger zoom"), 400
+    zoom = max(0, min(zoom, 22))
+    category = request.args.get('category') or None
+    if category is not None and category not in ALLOWED_CATEGORIES:
+        return jsonify(error="Ungültige Kategorie"), 400
+
+    # Zellgröße in Grad: Weltbreite (256px * 2^zoom) auf CLUSTER_CELL_PX heruntergebrochen.
+    # Das Raster ist an (-180, -90) verankert, damit Cluster beim Verschieben stabil bleiben.
+    # Die bbox wird nach außen auf dieses Raster gerundet: kleine Verschiebungen der Karte
+    # ergeben denselben Cache-Schlüssel, und Randzellen werden vollständig gezählt.
+    cell = 360.0 / (256 * 2 ** zoom) * CLUSTER_CELL_PX
+    west = max(-180.0, math.floor((bbox[0] + 180.0) / cell) * cell - 180.0)
+    east = min(180.0, math.ceil((bbox[2] + 180.0) / cell) * cell - 180.0)
+    south = max(-90.0, math.floor((bbox[1] + 90.0) / cell) * cell - 90.0)
+    north = min(90.0, math.ceil((bbox[3] + 90.0) / cell) * cell - 90.0)
+
+    conn = get_db()
+    version = data_version(conn)
+    key = f"markers:{zoom}:{category or ''}:{west:.6f},{south:.6f},{east:.6f},{north:.6f}"
+    etag = _version_etag(version, key)
+    resp = _not_modified(etag)
+    if resp is None:
+        cached = response_cache.get(key, version)
+        if cached:
+            body = cached[0]
+        else:
+            body = _render_markers(conn, zoom, category, west, south, east, north, cell).get_data()
+            response_cache.put(key, version, body)
+        resp = app.response_class(body, mimetype='application/json')
+        resp.set_etag(etag)
+    # Der Service Worker erkennt daran, ob seine Kopie veraltet ist (sw.js)
+    resp.headers['X-Data-Version'] = str(version)
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def _render_markers(conn, zoom, category, west, south, east, north, cell):
+    """Fragt Cluster bzw. Einzelpunkte für den (gerundeten) Ausschnitt ab und serialisiert sie."""
+    # Vorauswahl über den R*Tree, exakter Vergleich auf den Originalspalten
+    source = "images_rtree r JOIN images i ON i.id = r.id"
+    where = ("r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?"
+             " AND i.latitude BETWEEN ? AND ? AND i.longitude BETWEEN ? AND ?")
+    params = [south, north, west, east, south, north, west, east]
+    if category:
+        where += " AND i.category = ?"
+        params.append(category)
+
+    clusters, points = [], []
+
+    if zoom >= CLUSTER_MAX_ZOOM:
+        rows = conn.execute(f"""
+            SELECT 1, i.latitude, i.longitude, i.id, i.name, i.description, i.category,
+                   i.filepath, i.thumbnail_path, i.width, i.height, i.lqip
+            FROM {source} WHERE {where}
+            ORDER BY i.id DESC LIMIT ?
+        """, params + [MAX_MARKER_POINTS]).fetchall()
+    else:
+        # SQLite liefert die "nackten" Spalten aus der Zeile, die MAX(id) bestimmt:
+        # das neueste Bild einer Zelle dient als Repräsentant.
+        rows = conn.execute(f"""
+            SELECT COUNT(*), AVG(latitude), AVG(longitude), MAX(id), name, description, category,
+                   filepath, thumbnail_path, width, height, lqip, cx, cy
+            FROM (
+                SELECT i.*, CAST((i.longitude + 180.0) / ? AS INTEGER) AS cx,
+                            CAST((i.latitude + 90.0) / ? AS INTEGER) AS cy
+                FROM {source} WHERE {where}
+            )
+            GROUP BY cx, cy
+        """, [cell, cell] + params).fetchall()
+
+    derivatives = load_derivatives(conn, [row[3] for row in rows])
+
+    for row in rows:
+        count, lat, lon, image_id, name, description, cat, filepath, thumbnail_path = row[:9]
+        picture = picture_data(derivatives.get(image_id), _thumb_url(filepath, thumbnail_path), row)
+        if count == 1:
+            points.append({
+                'id': image_id,
+                'name': name,
+                'description': description,
+                'category': cat,
+                'lat': lat,
+                'lon': lon,
+                'width': row['width'],
+                'height': row['height'],
+                'thumbnail': picture['src'],
+                'picture': picture,
+            })
+        else:
+            clusters.append({
+                'key': f"{zoom}:{row['cx']}:{row['cy']}",
+                'count': count,
+                'lat': lat,
+                'lon': lon,
+                'thumbnail': picture['src'],
+            })
+
+    return jsonify(zoom=zoom, clusters=clusters, points=points)
+
+
+@app.route('/api/nearby')
+def api_nearby():
+    """
+    Nächstgelegene Spots als JSON.
+
+    Entweder ?id=<bild-id> (das Bild selbst wird ausgeschlossen) oder ?lat=&lon=.
+    Optional: limit (max. NEARBY_MAX_LIMIT) und radius_km.
+    """
+    limit = max(1, min(request.args.get('limit', NEARBY_DEFAULT_LIMIT, type=int), NEARBY_MAX_LIMIT))
+    radius_km = request.args.get('radius_km', type=float)
+    if radius_km is not None and radius_km <= 0:
+        return jsonify(error="Ungültiger Radius"), 400
+
+    conn = get_db()
+    image_id = request.args.get('id', type=int)
+    if image_id is not None:
+        row = conn.execute("SELECT latitude, longitude FROM images WHERE id = ?", (image_id,)).fetchone()
+        if not row or row['latitude'] is None or row['longitude'] is None:
+            return jsonify(error="Bild nicht gefunden"), 404
+        lat, lon = row['latitude'], row['longitude']
+    else:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify(error="Ungültige Koordinaten"), 400
+
+    nearby = find_nearby(conn, lat, lon, limit=limit, radius_km=radius_km, exclude_id=image_id)
+
+    return jsonify(results=[
+        {
+            'id': n['id'],
+            'name': n['name'],
+            'category': n['category'],
+            'lat': n['latitude'],
+            'lon': n['longitude'],
+            'distance_km': n['distance_km'],
+            'thumbnail': _thumb_url(n['filepath'], n['thumbnail_path']),
+        }
+        for n in nearby
+    ])
+
+def fts_query(text):
+    """
+    Baut aus einer Benutzereingabe eine sichere FTS5-Abfrage: jedes Wort als
+    Präfix in Anführungszeichen, alle Wörter müssen vorkommen. Sonderzeichen
+    der FTS5-Syntax (AND, NEAR, *, ^ …) werden so zu normalem Text.
+
+    Returns:
+        str oder None, wenn keine suchbaren Wörter übrig bleiben
+    """
+    terms = ''.join(ch if ch.isalnum() else ' ' for ch in text).split()[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+@app.route('/api/search')
+def api_search():
+    """
+    Volltextsuche über Name, Beschreibung und Kategorie.
+
+    Query-Parameter: q (Präfixsuche, alle Wörter müssen passen), optional
+    category und limit. Sortiert nach Relevanz (bm25, Treffer im Namen zählen mehr).
+    """
+    query = fts_query(request.args.get('q', ''))
+    limit = max(1, min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+    category = request.args.get('category') or None
+    if category is not None and category not in ALLOWED_CATEGORIES:
+        return jsonify(error="Ungültige Kategorie"), 400
+    if query is None:
+        return jsonify(results=[])
+
+    sql = """
+        SELECT i.id, i.name, i.category, i.latitude, i.longitude, i.filepath, i.thumbnail_path
+        FROM images_fts JOIN images i ON i.id = images_fts.rowid
+        WHERE images_fts MATCH ?
+    """
+    params = [query]
+    if category:
+        sql += " AND i.category = ?"
+        params.append(category)
+    sql += " ORDER BY bm25(images_fts, 10.0, 2.0, 1.0) LIMIT ?"
+    params.append(limit)
+
+    rows = get_db().execute(sql, params).fetchall()
+    return jsonify(results=[
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'category': row['category'],
+            'lat': row['latitude'],
+            'lon': row['longitude'],
+            'thumbnail': _thumb_url(row['filepath'], row['thumbnail_path']),
+        }
+        for row in rows
+    ])
+
+
+@app.route('/api/images/<int:image_id>/status')
+def api_image_status(image_id):
+    """Verarbeitungsstatus eines Bildes ('processing', 'ready' oder 'failed')."""
+    row = get_db().execute(
+        "SELECT id, status, filepath, thumbnail_path FROM images WHERE id = ?", (image_id,)
+    ).fetchone()
+    if not row:
+        return jsonify(error="Bild nicht gefunden"), 404
+    result = {'id': row['id'], 'status': row['status']}
+    if row['status'] == 'ready':
+        result['thumbnail'] = _thumb_url(row['filepath'], row['thumbnail_path'])
+    return jsonify(result)
+
+
+def list_images(conn, cursor=None, limit=GALLERY_PAGE_SIZE, category=None, date_from=None, date_to=None):
+    """
+    Eine Seite Bilder, neueste zuerst, per Keyset-Pagination.
+
+    Statt OFFSET wird ab der letzten gesehenen ID weitergelesen (id < cursor),
+    damit jede Seite unabhängig von der Tabellengröße gleich schnell ist.
+    Ein Datumsfilter (upload_date, YYYY-MM-DD) prüft upload_date direkt
+    (Index auf (upload_date, id)); IDs und Upload-Datum müssen nicht in
+    derselben Reihenfolge stehen (Restores, nachträglich geänderte Zeilen).
+
+    Returns:
+        tuple: (Liste von sqlite3.Row, next_cursor oder None)
+    """
+    if date_from and date_to and date_from > date_to:
+        return [], None
+
+    where, params = [], []
+    if cursor is not None:
+        where.append("id < ?")
+        params.append(cursor)
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if date_from:
+        where.append("upload_date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("upload_date <= ?")
+        params.append(date_to)
+
+    rows = conn.execute(f"""
+        SELECT id, name, description, category, filepath, thumbnail_path, latitude, longitude, status,
+               upload_date, width, height, altitude, camera, lens, lqip
+        FROM images
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY id DESC
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _listing_args():
+    """Liest und prüft die Filter für Galerie und /api/images (None bei ungültigen Werten)."""
+    category = request.args.get('category') or None
+    if category is not None and category not in ALLOWED_CATEGORIES:
+        return None
+    dates = {}
+    for key in ('date_from', 'date_to'):
+        value = request.args.get(key) or None
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return None
+        dates[key] = value
+    return {'cursor': request.args.get('cursor', type=int), 'category': category, **dates}
+
+
+@app.route('/api/images')
+def api_images():
+    """
+    JSON-Liste der Bilder mit Keyset-Pagination.
+
+    Query-Parameter: cursor (aus next_cursor der vorigen Seite), limit,
+    category, date_from/date_to (YYYY-MM-DD, Upload-Datum).
+    """
+    args = _listing_args()
+    if args is None:
+        return jsonify(error="Ungültiger Filter"), 400
+    limit = max(1, min(request.args.get('limit', GALLERY_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+
+    conn = get_db()
+    rows, next_cursor = list_images(conn, limit=limit, **args)
+    derivatives = load_derivatives(conn, [row['id'] for row in rows])
+
+    return jsonify(next_cursor=next_cursor, items=[
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'category': row['category'],
+            'lat': row['latitude'],
+            'lon': row['longitude'],
+            'status': row['status'],
+            'upload_date': row['upload_date'],
+            'width': row['width'],
+            'height': row['height'],
+            'altitude': row['altitude'],
+            'camera': row['camera'],
+            'lens': row['lens'],
+            'detail_url': url_for('detail', image_id=row['id']),
+            'picture': picture_data(derivatives.get(row['id']), _thumb_url(row['filepath'], row['thumbnail_path']),
+                                    row),
+        }
+        for row in rows
+    ])
+
+
+@app.route('/export/spots.<fmt>')
+def export_spots(fmt):
+    """
+    Alle Spots als GeoJSON, GPX-Wegpunkte oder KML (z.B. für Garmin/Komoot).
+
+    Query-Parameter: category, date_from/date_to (YYYY-MM-DD, Aufnahmedatum,
+    ersatzweise Upload-Datum), bbox=west,south,east,north. Der erste Abruf
+    einer Datenversion streamt direkt aus dem Cursor und legt die Datei dabei
+    gzip-komprimiert in EXPORT_CACHE_FOLDER ab; weitere Abrufe kommen von dort
+    bzw. als 304 per ETag.
+    """
+    if fmt not in export.FORMATS:
+        abort(404)
+    args = _listing_args()
+    if args is None:
+        return jsonify(error="Ungültiger Filter"), 400
+    bbox = None
+    if request.args.get('bbox'):
+        bbox = _parse_bbox(request.args['bbox'])
+        if bbox is None:
+            return jsonify(error="Ungültige bbox"), 400
+
+    conn = get_db()
+    version = data_version(conn)
+    base_url = request.url_root.rstrip('/')
+    bbox_key = ','.join(f"{v:.6f}" for v in bbox) if bbox else ''
+    key = f"export:{fmt}:{args['category'] or ''}:{args['date_from'] or ''}:{args['date_to'] or ''}:{bbox_key}:{base_url}"
+    use_gzip = 'gzip' in request.accept_encodings
+    etag = _version_etag(version, key, 'gzip' if use_gzip else '')
+    extension, mimetype = export.FORMATS[fmt]
+
+    resp = _not_modified(etag)
+    if resp is None:
+        cache_path = os.path.join(EXPORT_CACHE_FOLDER,
+                                  f"v{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]}.{extension}.gz")
+        try:
+            cached = open(cache_path, 'rb')
+        except FileNotFoundError:
+            cached = None
+        if cached is not None:
+            if use_gzip:
+                resp = send_file(cached, mimetype=mimetype, etag=False, conditional=False)
+            else:
+                resp = app.response_class(_gunzip_file(cached), mimetype=mimetype)
+        else:
+            rows = export.query(conn, args['category'], bbox, args['date_from'], args['date_to'])
+            chunks = _export_and_cache(export.generate(fmt, rows, base_url), cache_path, version, use_gzip)
+            resp = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+        if use_gzip:
+            resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Content-Disposition'] = f'attachment; filename="spots.{extension}"'
+        resp.set_etag(etag)
+    resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def _export_and_cache(chunks, cache_path, version, use_gzip):
+    """
+    Reicht den Export an den Client durch und schreibt ihn nebenbei komprimiert
+    in den Cache. Bricht der Client ab, wird die halbe Datei verworfen.
+    """
+    os.makedirs(EXPORT_CACHE_FOLDER, exist_ok=True)
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex[:8]}.part"
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    complete = False
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                packed = compressor.compress(chunk)
+                f.write(packed)
+                yield packed if use_gzip else chunk
+            packed = compressor.flush()
+            f.write(packed)
+            if use_gzip:
+                yield packed
+        os.replace(tmp_path, cache_path)
+        complete = True
+    finally:
+        if not complete and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # Exporte älterer Datenversionen werden nicht mehr ausgeliefert, von den aktuellen
+    # bleiben höchstens EXPORT_CACHE_MAX_FILES; .part-Dateien nur nach einem Absturz
+    stale, current = [], []
+    for entry in os.scandir(EXPORT_CACHE_FOLDER):
+        if entry.name.endswith('.part'):
+            if entry.stat().st_mtime < time.time() - 3600:
+                stale.append(entry.path)
+        elif entry.name.startswith(f"v{version}-"):
+            current.append((entry.stat().st_mtime, entry.path))
+        else:
+            stale.append(entry.path)
+    current.sort(reverse=True)
+    stale += [path for _, path in current[EXPORT_CACHE_MAX_FILES:]]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _gunzip_file(f):
+    """Liest eine gzip-Datei blockweise entpackt (für Clients ohne Accept-Encoding: gzip)."""
+    decompressor = zlib.decompressobj(31)
+    with f:
+        for block in iter(lambda: f.read(export.CHUNK_SIZE), b''):
+            data = decompressor.decompress(block)
+            if data:
+                yield data
+    yield decompressor.flush()
+
+
+# Platzhalter für das CSRF-Token in gecachten Galerie-Zeilen; wird pro Sitzung ersetzt
+_CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+
+
+def _gallery_rows_cached(conn, args):
+    """
+    Gerenderte Galerie-Zeilen einer Seite plus URL der nächsten Seite.
+
+    Das HTML wird pro Datenversion, Filter und Rolle (Bearbeiten/Löschen-Buttons)
+    im Antwort-Cache abgelegt; nur das CSRF-Token wird pro Sitzung eingesetzt.
+
+    Returns:
+        tuple: (rows_html, next_url, etag)
+    """
+    editor = session.get('role') in ('uploader', 'admin')
+    version = data_version(conn)
+    key = "gallery:{cursor}:{category}:{date_from}:{date_to}:".format(**args) + ('editor' if editor else 'viewer')
+    # ETag hängt zusätzlich an der Sitzung, weil Navigation und CSRF-Token personalisiert sind
+    etag = _version_etag(version, key, session.get('user_id', ''), generate_csrf() if editor else '')
+
+    cached = response_cache.get(key, version)
+    if cached:
+        rows_html, extra = cached[0].decode('utf-8'), cached[1]
+    else:
+        images, next_cursor = list_images(conn, **args)
+        derivatives = load_derivatives(conn, [img['id'] for img in images])
+        pictures = {
+            img['id']: picture_data(derivatives.get(img['id']), _thumb_url(img['filepath'], img['thumbnail_path']),
+                                    img)
+            for img in images
+        }
+        extra = {'next_url': None}
+        if next_cursor is not None:
+            extra['next_url'] = url_for('gallery_rows', cursor=next_cursor, category=args['category'],
+                                        date_from=args['date_from'], date_to=args['date_to'])
+        rows_html = render_template('_gallery_rows.html', images=images, pictures=pictures,
+                                    row_csrf_token=_CSRF_PLACEHOLDER)
+        response_cache.put(key, version, rows_html, extra)
+
+    if editor:
+        rows_html = rows_html.replace(_CSRF_PLACEHOLDER, generate_csrf())
+    return rows_html, extra['next_url'], etag
+
+
+def _private_revalidate(resp, etag):
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    resp.vary.add('Cookie')
+    return resp
+
 
 @app.route('/gallery')
 def gallery():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, description, category, filepath, thumbnail_path, latitude, longitude FROM images")
-    images = c.fetchall()
-    conn.close()
-    return render_template('gallery.html', images=images, title="Galerie")
+    args = _listing_args()
+    if args is None:
+        abort(400)
+    conn = get_db()
+    rows_html, next_url, etag = _gallery_rows_cached(conn, args)
+    # Ausstehende Flash-Meldungen gehören in genau diese Antwort: dann weder 304 noch ETag
+    has_flashes = '_flashes' in session
+    if not has_flashes:
+        resp = _not_modified(etag)
+        if resp is not None:
+            return _private_revalidate(resp, etag)
+    resp = app.make_response(render_template('gallery.html', rows_html=rows_html, next_url=next_url,
+                                             title="Galerie"))
+    return resp if has_flashes else _private_revalidate(resp, etag)
+
+
+@app.route('/gallery/rows')
+def gallery_rows():
+    """Weitere Tabellenzeilen für das Nachladen beim Scrollen (HTML-Fragment)."""
+    args = _listing_args()
+    if args is None:
+        abort(400)
+    rows_html, next_url, etag = _gallery_rows_cached(get_db(), args)
+    resp = _not_modified(etag) or app.make_response(rows_html)
+    if next_url:
+        resp.headers['X-Next-Url'] = next_url
+    return _private_revalidate(resp, etag)
 
 @app.route('/edit/<int:image_id>', methods=['GET', 'POST'])
 @login_required
 @role_required('uploader','admin')
 def edit(image_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    conn = get_db()
 
     if request.method == 'POST':
         name = request.form['name']
@@ -432,20 +1823,20 @@ def edit(image_id):
         lat = request.form['lat']
         lng = request.form['lng']
 
-        c.execute("""
-            UPDATE images
-            SET name = ?, description = ?, category = ?, latitude = ?, longitude = ?
-            WHERE id = ?
-        """, (name, description, category, lat, lng, image_id))
+        with transaction(conn):
+            conn.execute("""
+                UPDATE images
+                SET name = ?, description = ?, category = ?, latitude = ?, longitude = ?
+                WHERE id = ?
+            """, (name, description, category, lat, lng, image_id))
 
-        conn.commit()
-        conn.close()
         return redirect(url_for('map'))
 
     # GET → Daten laden
-    c.execute("SELECT id, name, description, category, filepath, latitude, longitude FROM images WHERE id = ?", (image_id,))
-    image = c.fetchone()
-    conn.close()
+    image = conn.execute(
+        "SELECT id, name, description, category, filepath, latitude, longitude FROM images WHERE id = ?",
+        (image_id,)
+    ).fetchone()
 
     return render_template('edit.html', image=image, title="Bild bearbeiten")
 
@@ -453,62 +1844,80 @@ def edit(image_id):
 @login_required
 @role_required('uploader','admin')
 def delete(image_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    remove_image(get_db(), image_id)
+    return redirect(url_for('gallery'))
+
+
+def remove_image(conn, image_id):
+    """
+    Löscht ein Bild samt Original, Thumbnail, Derivaten und gecachten Renditionen.
 
+    Returns:
+        bool: False, wenn es das Bild nicht gibt
+    """
     # Bilddaten laden (inkl. Thumbnail-Pfad)
-    c.execute("SELECT filepath, thumbnail_path FROM images WHERE id = ?", (image_id,))
-    row = c.fetchone()
+    row = conn.execute("SELECT filepath, thumbnail_path FROM images WHERE id = ?", (image_id,)).fetchone()
 
     if not row:
-        conn.close()
-        return redirect(url_for('gallery'))
+        return False
 
-    filepath = row[0]
-    thumbnail_path = row[1]
+    filepath = row['filepath']
+    thumbnail_path = row['thumbnail_path']
+    derivative_paths = [
+        d['path'] for d in conn.execute("SELECT path FROM derivatives WHERE image_id = ?", (image_id,))
+        if d['path'] != thumbnail_path
+    ]
 
     # Hauptdatei löschen, falls vorhanden
     if filepath:
-        full_path = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
-        if os.path.exists(full_path):
-            try:
-                os.remove(full_path)
-            except Exception as e:
-                app.logger.warning(f"Fehler beim Löschen der Datei {filepath}: {e}")
+        try:
+            original_store.delete(filepath)
+        except Exception as e:
+            app.logger.warning(f"Fehler beim Löschen der Datei {filepath}: {e}")
 
-    # Thumbnail löschen, falls vorhanden
-    if thumbnail_path:
-        thumb_full_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_path)
-        if os.path.exists(thumb_full_path):
-            try:
-                os.remove(thumb_full_path)
-            except Exception as e:
-                app.logger.warning(f"Fehler beim Löschen des Thumbnails {thumbnail_path}: {e}")
+    # Thumbnail und Derivate löschen
+    for derivative_path in ([thumbnail_path] if thumbnail_path else []) + derivative_paths:
+        try:
+            derivative_store.delete(derivative_path)
+        except Exception as e:
+            app.logger.warning(f"Fehler beim Löschen des Derivats {derivative_path}: {e}")
 
-    # DB-Eintrag löschen
-    c.execute("DELETE FROM images WHERE id = ?", (image_id,))
-    conn.commit()
-    conn.close()
+    # On-Demand-Renditionen verwerfen
+    resize_cache.purge_image(image_id)
 
-    return redirect(url_for('gallery'))
+    # DB-Eintrag löschen (Derivat-Zeilen per ON DELETE CASCADE); Verweise auf das Bild lösen
+    with transaction(conn):
+        conn.execute("UPDATE images SET near_duplicate_of = NULL WHERE near_duplicate_of = ?", (image_id,))
+        conn.execute("DELETE FROM images WHERE id = ?", (image_id,))
+
+    return True
 
 
 @app.route('/detail/<int:image_id>')
 def detail(image_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
+    conn = get_db()
+    img = conn.execute("""
         SELECT id, name, description, category, filepath, latitude, longitude,
-               upload_date, upload_time, exif_date, exif_time
+               upload_date, upload_time, exif_date, exif_time, status, near_duplicate_of,
+               width, height, altitude, camera, lens, lqip
         FROM images WHERE id = ?
-    """, (image_id,))
-    img = c.fetchone()
-    conn.close()
+    """, (image_id,)).fetchone()
 
     if not img:
         return redirect(url_for('gallery'))
 
-    return render_template('detail.html', img=img, title="Bilddetails")
+    picture = picture_data(
+        load_derivatives(conn, [img['id']]).get(img['id']),
+        url_for('uploaded_file', filename=img['filepath']),
+        img,
+    )
+
+    nearby = []
+    if img['latitude'] is not None and img['longitude'] is not None:
+        nearby = find_nearby(conn, img['latitude'], img['longitude'], exclude_id=img['id'])
+
+    return render_template('detail.html', img=img, pic=picture, nearby=nearby,
+                           duplicate=request.args.get('duplicate') == '1', title="Bilddetails")
 
 
 
@@ -549,10 +1958,9 @@ def reset_admin(token):
         abort(404)
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("DELETE FROM users WHERE username = ?", ('admin',))
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with transaction(conn):
+            conn.execute("DELETE FROM users WHERE username = ?", ('admin',))
         
         create_user('admin', 'admin123', 'admin')
         return "✅ Admin user reset! Username: admin, Password: admin123<br><br>Delete ADMIN_RESET_TOKEN env var now!"
@@ -570,48 +1978,20 @@ def logout():
     return resp
 
 def get_user_by_username(username):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.execute("SELECT id, username, password_hash, role FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row and {'id': row[0], 'username': row[1], 'password_hash': row[2], 'role': row[3]}
+    row = get_db().execute(
+        "SELECT id, username, password_hash, role FROM users WHERE username = ?", (username,)
+    ).fetchone()
+    return row and dict(row)
 
 def create_user(username, password, role='uploader'):
     pw = generate_password_hash(password)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?,?,?)", (username, pw, role))
-    conn.commit()
-    conn.close()
-
-# Ensure default admin user on import (after helpers are defined)
-try:
-    force_reset = os.environ.get('RESET_ADMIN_PASSWORD', 'false').lower() == 'true'
-    admin = get_user_by_username('admin')
-    
-    # Prüfe ob Admin mit korrektem Passwort existiert
-    admin_password_correct = False
-    if admin:
-        admin_password_correct = check_password_hash(admin['password_hash'], 'admin123')
-    
-    # Wenn kein Admin existiert oder Passwort falsch ist, neu erstellen
-    if force_reset or not admin or not admin_password_correct:
-        if admin:
-            # Delete existing (wrong password) admin
-            conn = sqlite3.connect(DB_PATH)
-            conn.execute("DELETE FROM users WHERE username = ?", ('admin',))
-            conn.commit()
-            conn.close()
-            if not admin_password_correct:
-                app.logger.warning("Admin-User hatte falsches Passwort, wird neu erstellt")
-            else:
-                app.logger.info("Existing admin user deleted for reset")
-        
-        create_user('admin', 'admin123', 'admin')
-        app.logger.info("✓ Default admin user created/reset: admin/admin123")
-except Exception as e:
-    app.logger.error(f"Error ensuring admin user: {e}")
+    conn = get_db()
+    with transaction(conn):
+        conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?,?,?)", (username, pw, role))
 
 if __name__ == '__main__':
+    import migrate
+    migrate.migrate()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1')
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Derivate (Thumbnails, responsive Größen) nachziehen und neu erzeugen.
+
+Findet Bilder ohne Thumbnail, mit fehlenden Dateien oder mit Derivaten, die
+nicht zur aktuellen Konfiguration (DERIVATIVE_WIDTHS/DERIVATIVE_FORMATS)
+passen, und erzeugt sie im Prozess-Pool neu. Mit --all wird alles neu
+gerechnet, z.B. nach einer Änderung der Qualitätseinstellungen.
+
+Neue Derivate bekommen neue Dateinamen, weil /thumbnails/ als immutable
+ausgeliefert wird; die alten Dateien werden nach dem Umschalten gelöscht.
+Ein zweiter Lauf findet nichts mehr zu tun (idempotent).
+
+Zusätzlich werden Dateien und Datenbank abgeglichen und Waisen in beide
+Richtungen gemeldet (mit --delete-orphans werden verwaiste Dateien gelöscht).
+
+Start:  python backfill_derivatives.py [--all] [--processes 1] [--rate 2] [--check]
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import db
+from app import DB_PATH, derivative_store, original_store
+from db import transaction
+from imaging import DERIVATIVE_WIDTHS, derive_stored, limit_memory, pick_thumbnail, supported_derivative_formats
+from worker import MEMORY_LIMIT_MB
+
+logger = logging.getLogger("backfill")
+
+DEFAULT_NICE = 10            # Pool-Prozesse niedriger priorisieren als gunicorn
+ORPHAN_MIN_AGE = 3600        # jüngere Dateien können zu einem laufenden Upload gehören
+
+
+# --- Bestandsaufnahme ---
+def find_stale(conn, regenerate_all=False):
+    """
+    Bilder, deren Derivate fehlen oder nicht zur Konfiguration passen.
+
+    Returns:
+        list: (image_id, filepath, Grund)
+    """
+    formats = set(supported_derivative_formats())
+    widths = set(DERIVATIVE_WIDTHS)
+    by_image = {}
+    for row in conn.execute("SELECT image_id, format, width, path FROM derivatives"):
+        by_image.setdefault(row['image_id'], []).append(row)
+
+    stale = []
+    for row in conn.execute("SELECT id, filepath, thumbnail_path FROM images WHERE status = 'ready' ORDER BY id"):
+        reason = _stale_reason(row, by_image.get(row['id'], []), formats, widths)
+        if reason is None and regenerate_all:
+            reason = "--all"
+        if reason:
+            stale.append((row['id'], row['filepath'], reason))
+    return stale
+
+
+def _stale_reason(image, derivatives, formats, widths):
+    if not derivatives:
+        return "keine Derivate"
+    if not image['thumbnail_path']:
+        return "kein Thumbnail"
+    for d in derivatives:
+        if not derivative_store.exists(d['path']):
+            return f"Datei fehlt: {d['path']}"
+
+    present = {(d['format'], d['width']) for d in derivatives}
+    stored_widths = {w for _, w in present}
+    largest = max(stored_widths)
+    if any((fmt, width) not in present for fmt in formats for width in stored_widths) \
+            or {fmt for fmt, _ in present} - formats:
+        return "Formate geändert"
+    # Ein kleines Original hat nur eine Stufe in Bildbreite (schmaler als die kleinste konfigurierte)
+    if stored_widths - widths and not (len(stored_widths) == 1 and largest < min(widths)):
+        return "Breiten geändert"
+    # Jede konfigurierte Stufe unterhalb der größten vorhandenen muss es geben
+    for width in widths:
+        if width < largest and width not in stored_widths:
+            return f"Stufe {width} fehlt"
+    return None
+
+
+def find_orphans(conn):
+    """
+    Abgleich Dateisystem ↔ Datenbank.
+
+    Returns:
+        dict: missing_originals (Zeilen ohne Original), orphan_uploads und
+              orphan_thumbnails (Dateien ohne Zeile, nur älter als ORPHAN_MIN_AGE)
+    """
+    originals = {row[0] for row in conn.execute("SELECT filepath FROM images")}
+    derived = {row[0] for row in conn.execute("SELECT path FROM derivatives")}
+    derived |= {row[0] for row in conn.execute("SELECT thumbnail_path FROM images WHERE thumbnail_path IS NOT NULL")}
+
+    missing_originals = [
+        (row['id'], row['filepath'])
+        for row in conn.execute("SELECT id, filepath FROM images WHERE status != 'processing'")
+        if not original_store.exists(row['filepath'])
+    ]
+    return {
+        'missing_originals': missing_originals,
+        'orphan_uploads': _unreferenced(original_store, originals),
+        'orphan_thumbnails': _unreferenced(derivative_store, derived),
+    }
+
+
+def _unreferenced(store, referenced):
+    cutoff = time.time() - ORPHAN_MIN_AGE
+    return sorted((name, size) for name, size, mtime in store.keys()
+                  if name not in referenced and mtime < cutoff)
+
+
+# --- Pool-Prozess ---
+def _init_pool(memory_limit_mb, nice):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if nice:
+        os.nice(nice)
+    limit_memory(memory_limit_mb)
+
+
+def regenerate(filepath):
+    """Läuft im Pool-Prozess; darf die Datenbank nicht anfassen."""
+    # Neuer Namensbestandteil, damit Browser-Caches (immutable) keine alten Dateien behalten
+    base_name = f"{os.path.splitext(filepath)[0]}_{uuid.uuid4().hex[:6]}"
+    return derive_stored(filepath, original_store, derivative_store, base_name)
+
+
+# --- Hauptprozess ---
+def apply_result(conn, image_id, derivatives):
+    """Schaltet ein Bild auf die neuen Derivate um und löscht danach die alten Dateien."""
+    with transaction(conn):
+        old = {row[0] for row in conn.execute("SELECT path FROM derivatives WHERE image_id = ?", (image_id,))}
+        row = conn.execute("SELECT thumbnail_path FROM images WHERE id = ?", (image_id,)).fetchone()
+        if row is None:
+            # Bild wurde inzwischen gelöscht
+            for d in derivatives:
+                derivative_store.delete(d['path'])
+            return
+        if row['thumbnail_path']:
+            old.add(row['thumbnail_path'])
+        conn.execute("DELETE FROM derivatives WHERE image_id = ?", (image_id,))
+        conn.executemany("""
+            INSERT INTO derivatives (image_id, format, width, height, path, bytes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(image_id, d['format'], d['width'], d['height'], d['path'], d['bytes']) for d in derivatives])
+        conn.execute("UPDATE images SET thumbnail_path = ? WHERE id = ?", (pick_thumbnail(derivatives), image_id))
+    for path in old - {d['path'] for d in derivatives}:
+        derivative_store.delete(path)
+
+
+class Progress:
+    """Einzeilige Fortschrittsanzeige auf stderr (bei Umleitung: gelegentliche Logzeilen)."""
+
+    WIDTH = 30
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._last_log = 0.0
+        self._tty = sys.stderr.isatty()
+
+    def step(self, failed=False):
+        self.done += 1
+        self.failed += failed
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        line = (f"{self.done}/{self.total} ({self.failed} Fehler) "
+                f"{rate:.1f} Bilder/s, noch {int(eta // 60)}:{int(eta % 60):02d}")
+        if self._tty:
+            filled = int(self.WIDTH * self.done / self.total) if self.total else self.WIDTH
+            sys.stderr.write(f"\r[{'#' * filled}{'-' * (self.WIDTH - filled)}] {line}")
+            if self.done == self.total:
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+        elif time.monotonic() - self._last_log >= 10 or self.done == self.total:
+            self._last_log = time.monotonic()
+            logger.info(line)
+
+
+def report_orphans(orphans, delete):
+    logger.info("Bilder ohne Original-Datei: %d", len(orphans['missing_originals']))
+    for image_id, filepath in orphans['missing_originals']:
+        logger.info("  #%s %s", image_id, filepath)
+    for key, store, label in (('orphan_uploads', original_store, "Originale"),
+                              ('orphan_thumbnails', derivative_store, "Thumbnails/Derivate")):
+        files = orphans[key]
+        size = sum(s for _, s in files)
+        logger.info("%s ohne Datenbankeintrag: %d (%.1f MB)%s", label, len(files), size / 1024 / 1024,
+                    ", gelöscht" if delete and files else "")
+        for name, _ in files[:20]:
+            logger.info("  %s", name)
+        if len(files) > 20:
+            logger.info("  … und %d weitere", len(files) - 20)
+        if delete:
+            for name, _ in files:
+                store.delete(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--all', action='store_true', help="alle Derivate neu erzeugen")
+    parser.add_argument('--check', action='store_true', help="nur berichten, nichts erzeugen oder löschen")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="parallele Prozesse (Standard 1, um die Web-Worker nicht auszubremsen)")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="höchstens so viele Bilder pro Sekunde (0 = unbegrenzt)")
+    parser.add_argument('--nice', type=int, default=DEFAULT_NICE, help="nice-Wert der Pool-Prozesse")
+    parser.add_argument('--memory-limit-mb', type=int, default=MEMORY_LIMIT_MB,
+                        help="Adressraum-Limit pro Verarbeitungsprozess (0 = aus)")
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help="verwaiste Dateien (älter als 1 h) löschen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [backfill] %(message)s")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    conn = db.connect(DB_PATH)
+    stale = find_stale(conn, args.all)
+    logger.info("%d Bilder brauchen neue Derivate", len(stale))
+    if args.check:
+        for image_id, filepath, reason in stale[:50]:
+            logger.info("  #%s %s: %s", image_id, filepath, reason)
+        if len(stale) > 50:
+            logger.info("  … und %d weitere", len(stale) - 50)
+        stale = []
+
+    progress = Progress(len(stale))
+    min_interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    last_submit = 0.0
+    todo = iter(stale)
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=args.processes, initializer=_init_pool,
+                             initargs=(args.memory_limit_mb, args.nice)) as pool:
+        while True:
+            while not stopping and len(in_flight) < args.processes:
+                wait_for = last_submit + min_interval - time.monotonic()
+                if wait_for > 0:
+                    if in_flight:
+                        break
+                    time.sleep(wait_for)
+                item = next(todo, None)
+                if item is None:
+                    break
+                image_id, filepath, _reason = item
+                in_flight[pool.submit(regenerate, filepath)] = (image_id, filepath)
+                last_submit = time.monotonic()
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=min_interval or None, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_id, filepath = in_flight.pop(future)
+                try:
+                    apply_result(conn, image_id, future.result())
+                except Exception as e:
+                    logger.warning("#%s %s: %s", image_id, filepath, e)
+                    progress.step(failed=True)
+                else:
+                    progress.step()
+
+    if stopping:
+        logger.info("Abgebrochen nach %d von %d Bildern", progress.done, progress.total)
+    report_orphans(find_orphans(conn), args.delete_orphans and not args.check)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
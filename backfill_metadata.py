@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Bildmaße, EXIF-Angaben und Platzhalter (LQIP) für den Bestand nachtragen.
+
+Neue Uploads bekommen width/height/orientation/altitude/camera/lens/lqip
+schon beim Verarbeiten (imaging.process_upload). Ältere Bilder haben dort
+NULL; dieses Skript liest die Originale im Prozess-Pool und schreibt die
+Werte in kleinen Transaktionen nach. Mit --all werden alle Bilder neu
+gelesen, z.B. nach einer Änderung an LQIP_SIZE.
+
+Ein zweiter Lauf findet nichts mehr zu tun (idempotent).
+
+Start:  python backfill_metadata.py [--all] [--processes 1] [--rate 5] [--check]
+"""
+import argparse
+import logging
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import db
+from app import DB_PATH, original_store
+from backfill_derivatives import DEFAULT_NICE, Progress, _init_pool
+from db import transaction
+from imaging import read_metadata
+from worker import MEMORY_LIMIT_MB
+
+logger = logging.getLogger("backfill_metadata")
+
+BATCH_SIZE = 50
+COLUMNS = ('width', 'height', 'orientation', 'altitude', 'camera', 'lens', 'lqip')
+
+
+def find_missing(conn, read_all=False):
+    """
+    Fertige Bilder ohne Maße oder Platzhalter.
+
+    Returns:
+        list: (image_id, filepath)
+    """
+    where = "status = 'ready'" if read_all else "status = 'ready' AND (width IS NULL OR lqip IS NULL)"
+    return [(row['id'], row['filepath'])
+            for row in conn.execute(f"SELECT id, filepath FROM images WHERE {where} ORDER BY id")]
+
+
+# --- Pool-Prozess ---
+def read(filepath):
+    """Läuft im Pool-Prozess; darf die Datenbank nicht anfassen."""
+    with original_store.local_path(filepath) as path:
+        return read_metadata(path)
+
+
+# --- Hauptprozess ---
+def apply_results(conn, results):
+    """Schreibt gesammelte Ergebnisse in einer Transaktion (gelöschte Bilder fallen einfach raus)."""
+    if not results:
+        return
+    with transaction(conn):
+        conn.executemany(
+            f"UPDATE images SET {', '.join(f'{c} = ?' for c in COLUMNS)} WHERE id = ?",
+            [tuple(meta[c] for c in COLUMNS) + (image_id,) for image_id, meta in results],
+        )
+    results.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--all', action='store_true', help="alle Bilder neu lesen")
+    parser.add_argument('--check', action='store_true', help="nur zählen, nichts schreiben")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="parallele Prozesse (Standard 1, um die Web-Worker nicht auszubremsen)")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="höchstens so viele Bilder pro Sekunde (0 = unbegrenzt)")
+    parser.add_argument('--nice', type=int, default=DEFAULT_NICE, help="nice-Wert der Pool-Prozesse")
+    parser.add_argument('--memory-limit-mb', type=int, default=MEMORY_LIMIT_MB,
+                        help="Adressraum-Limit pro Verarbeitungsprozess (0 = aus)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [backfill_metadata] %(message)s")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    conn = db.connect(DB_PATH)
+    missing = find_missing(conn, args.all)
+    logger.info("%d Bilder ohne Maße/Platzhalter", len(missing))
+    if args.check:
+        conn.close()
+        return
+
+    progress = Progress(len(missing))
+    min_interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    last_submit = 0.0
+    todo = iter(missing)
+    in_flight = {}
+    results = []
+    with ProcessPoolExecutor(max_workers=args.processes, initializer=_init_pool,
+                             initargs=(args.memory_limit_mb, args.nice)) as pool:
+        while True:
+            while not stopping and len(in_flight) < args.processes:
+                wait_for = last_submit + min_interval - time.monotonic()
+                if wait_for > 0:
+                    if in_flight:
+                        break
+                    time.sleep(wait_for)
+                item = next(todo, None)
+                if item is None:
+                    break
+                image_id, filepath = item
+                in_flight[pool.submit(read, filepath)] = (image_id, filepath)
+                last_submit = time.monotonic()
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=min_interval or None, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_id, filepath = in_flight.pop(future)
+                try:
+                    results.append((image_id, future.result()))
+                except Exception as e:
+                    logger.warning("#%s %s: %s", image_id, filepath, e)
+                    progress.step(failed=True)
+                else:
+                    progress.step()
+            if len(results) >= BATCH_SIZE:
+                apply_results(conn, results)
+    apply_results(conn, results)
+
+    if stopping:
+        logger.info("Abgebrochen nach %d von %d Bildern", progress.done, progress.total)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
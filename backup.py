@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+"""
+Online-Backup der Datenbank und der Bilder, mit passendem Restore.
+
+Die Datenbank wird mit der SQLite-Backup-API in kleinen Schritten
+(--step-pages Seiten, dazwischen --step-sleep Pause) kopiert, während die
+App weiterläuft: im WAL-Modus hält ein Schritt nur eine Lesesperre,
+Uploads und Bearbeitungen warten nicht. Ändert ein Schreiber die Datenbank
+mitten im Backup, beginnt SQLite von vorn; nach MAX_RESTARTS Neustarts wird
+in einem einzigen Lese-Snapshot kopiert, damit das Backup fertig wird.
+
+Bilder (Originale und Derivate, nur die von der gesicherten Datenbank
+referenzierten) landen inhaltsadressiert unter <ziel>/objects/ und werden
+nur kopiert, wenn sie im vorigen Snapshot noch nicht vorkamen. Jeder
+Snapshot hat ein manifest.json mit Schlüssel → SHA-256 und Größe; restore
+prüft alle Prüfsummen, bevor es etwas überschreibt.
+
+Jeder Lauf berichtet kopierte Bytes und wie lange ein Schreiber höchstens
+auf die Sperre hätte warten müssen (gemessen mit BEGIN IMMEDIATE/ROLLBACK
+aus einem eigenen Thread, ohne Daten zu ändern).
+
+  python backup.py snapshot [--dest backups] [--keep 7] [--every 86400]
+  python backup.py list [--dest backups]
+  python backup.py restore [SNAPSHOT] [--dest backups] [--verify-only] [--force]
+
+Restore nur bei gestoppter App (und gestopptem Worker) ausführen.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import db
+from app import DB_PATH, derivative_store, original_store
+
+logger = logging.getLogger("backup")
+
+DEFAULT_DEST = os.environ.get('BACKUP_DIR', 'backups')
+DEFAULT_KEEP = int(os.environ.get('BACKUP_KEEP', '7'))
+STEP_PAGES = 256          # Seiten pro Backup-Schritt (bei 4 KB-Seiten 1 MB)
+STEP_SLEEP = 0.05         # Sekunden Pause zwischen zwei Schritten
+MAX_RESTARTS = 5          # danach in einem Schritt kopieren
+PROBE_INTERVAL = 0.05     # Sekunden zwischen zwei Messungen der Schreibsperre
+BLOCK_SIZE = 1024 * 1024
+
+STORES = (('originals', original_store), ('derivatives', derivative_store))
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class WriterProbe(threading.Thread):
+    """
+    Misst laufend, wie lange ein Schreiber auf die Schreibsperre warten müsste.
+
+    BEGIN IMMEDIATE holt die Sperre wie transaction(), ROLLBACK gibt sie
+    sofort wieder frei; die Datenbank wird dabei nicht verändert (und das
+    Backup deshalb auch nicht neu gestartet).
+    """
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.max_wait = 0.0
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = db.connect(self.path)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    # busy_timeout abgelaufen: mindestens so lange blockiert
+                    pass
+                self.max_wait = max(self.max_wait, time.perf_counter() - start)
+                self.samples += 1
+                if self._stop_event.wait(PROBE_INTERVAL):
+                    break
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# --- Hilfen ---
+def _sha256_stream(f):
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def sha256_file(path):
+    with open(path, 'rb') as f:
+        return _sha256_stream(f)
+
+
+def _object_path(dest, sha):
+    return os.path.join(dest, 'objects', sha[:2], sha)
+
+
+def _snapshots_dir(dest):
+    return os.path.join(dest, 'snapshots')
+
+
+def list_snapshots(dest):
+    """Namen der vollständigen Snapshots, ältester zuerst."""
+    folder = _snapshots_dir(dest)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder)
+                  if not name.endswith('.partial') and os.path.exists(os.path.join(folder, name, 'manifest.json')))
+
+
+def load_manifest(dest, name):
+    with open(os.path.join(_snapshots_dir(dest), name, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- Snapshot ---
+def backup_database(source_path, target_path, step_pages=STEP_PAGES, step_sleep=STEP_SLEEP):
+    """
+    Kopiert die Datenbank schrittweise über die Backup-API.
+
+    Returns:
+        dict: steps, restarts, single_step (True, wenn zuletzt in einem Schritt kopiert wurde)
+    """
+    state = {'steps': 0, 'restarts': 0, 'single_step': False, 'remaining': None}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        if state['remaining'] is not None and remaining > state['remaining']:
+            # Ein Schreiber hat die Quelle geändert, SQLite kopiert von vorn
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS and not state['single_step']:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+        if remaining and not state['single_step']:
+            # Zwischen zwei Schritten hält das Backup keine Sperre; sqlite3 selbst
+            # schläft nur bei SQLITE_BUSY/LOCKED, die Pause kommt deshalb von hier
+            time.sleep(step_sleep)
+
+    source = db.connect(source_path)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=step_pages, progress=progress, sleep=step_sleep)
+            except _TooManyRestarts:
+                logger.info("Datenbank ändert sich zu oft, kopiere in einem Lese-Snapshot")
+                state['single_step'] = True
+                source.backup(target, pages=-1)
+            # Der Snapshot soll eine einzelne, in sich vollständige Datei sein
+            target.execute("PRAGMA journal_mode = DELETE")
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+            if check != 'ok':
+                raise RuntimeError(f"Datenbank-Kopie fehlerhaft: {check}")
+        finally:
+            target.close()
+    finally:
+        source.close()
+    del state['remaining']
+    return state
+
+
+def referenced_keys(snapshot_db):
+    """Von der gesicherten Datenbank referenzierte Dateien je Ablage."""
+    conn = sqlite3.connect(snapshot_db)
+    try:
+        originals = {row[0] for row in conn.execute("SELECT filepath FROM images WHERE filepath IS NOT NULL")}
+        derivatives = {row[0] for row in conn.execute("SELECT path FROM derivatives")}
+        derivatives |= {row[0] for row in conn.execute(
+            "SELECT thumbnail_path FROM images WHERE thumbnail_path IS NOT NULL")}
+    finally:
+        conn.close()
+    return {'originals': originals, 'derivatives': derivatives}
+
+
+def _store_object(dest, store, key):
+    """
+    Kopiert eine Datei aus der Ablage nach objects/ (SHA-256 beim Lesen).
+
+    Returns:
+        tuple: (sha256, bytes, neu geschrieben)
+    """
+    tmp_dir = os.path.join(dest, 'objects', '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out, store.open(key) as source:
+            for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+                out.write(block)
+                digest.update(block)
+                size += len(block)
+        sha = digest.hexdigest()
+        target = _object_path(dest, sha)
+        if os.path.exists(target):
+            # Gleicher Inhalt unter anderem Schlüssel schon gesichert
+            return sha, size, False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        return sha, size, True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def snapshot(dest, step_pages=STEP_PAGES, step_sleep=STEP_SLEEP, should_stop=lambda: False):
+    """
+    Legt einen vollständigen Snapshot an (Datenbank + neue Dateien).
+
+    Returns:
+        tuple: (Name des Snapshots, Bericht als dict)
+    """
+    started = time.monotonic()
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    if os.path.exists(os.path.join(_snapshots_dir(dest), name)):
+        name += f"-{int(time.time() * 1000) % 1000:03d}"
+    folder = os.path.join(_snapshots_dir(dest), name)
+    work = folder + '.partial'
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+
+    previous_names = list_snapshots(dest)
+    previous = load_manifest(dest, previous_names[-1])['files'] if previous_names else {}
+
+    probe = WriterProbe(DB_PATH)
+    probe.start()
+    try:
+        db_file = os.path.join(work, 'database.db')
+        db_stats = backup_database(DB_PATH, db_file, step_pages, step_sleep)
+    finally:
+        probe.stop()
+    db_bytes = os.path.getsize(db_file)
+    report = {
+        'db_bytes': db_bytes,
+        'db_steps': db_stats['steps'],
+        'db_restarts': db_stats['restarts'],
+        'db_single_step': db_stats['single_step'],
+        'writer_max_wait_ms': round(probe.max_wait * 1000, 1),
+        'writer_probes': probe.samples,
+        'files_copied': 0,
+        'bytes_copied': db_bytes,
+        'files_reused': 0,
+        'files_missing': 0,
+    }
+
+    files = {}
+    referenced = referenced_keys(db_file)
+    for kind, store in STORES:
+        wanted = referenced[kind]
+        sizes = {key: size for key, size, _mtime in store.keys() if key in wanted}
+        known = previous.get(kind, {})
+        entries = files[kind] = {}
+        for key in sorted(wanted):
+            if should_stop():
+                raise KeyboardInterrupt
+            entry = known.get(key)
+            if key not in sizes:
+                logger.warning("%s: %s fehlt in der Ablage", kind, key)
+                report['files_missing'] += 1
+                continue
+            if entry and entry[1] == sizes[key] and os.path.exists(_object_path(dest, entry[0])):
+                entries[key] = entry
+                report['files_reused'] += 1
+                continue
+            try:
+                sha, size, written = _store_object(dest, store, key)
+            except FileNotFoundError:
+                # zwischen Auflisten und Lesen gelöscht
+                report['files_missing'] += 1
+                continue
+            entries[key] = [sha, size]
+            if written:
+                report['files_copied'] += 1
+                report['bytes_copied'] += size
+            else:
+                report['files_reused'] += 1
+
+    report['seconds'] = round(time.monotonic() - started, 2)
+    manifest = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'database': {'file': 'database.db', 'sha256': sha256_file(db_file), 'bytes': db_bytes},
+        'files': files,
+        'report': report,
+    }
+    with open(os.path.join(work, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(work, folder)
+    return name, report
+
+
+def prune(dest, keep):
+    """
+    Behält die `keep` neuesten Snapshots und löscht Objekte, die keiner mehr braucht.
+
+    Returns:
+        tuple: (gelöschte Snapshots, gelöschte Objekte)
+    """
+    names = list_snapshots(dest)
+    removed = names[:-keep] if keep > 0 else []
+    for name in removed:
+        shutil.rmtree(os.path.join(_snapshots_dir(dest), name))
+    for name in os.listdir(_snapshots_dir(dest)):
+        if name.endswith('.partial'):
+            shutil.rmtree(os.path.join(_snapshots_dir(dest), name), ignore_errors=True)
+
+    used = set()
+    for name in list_snapshots(dest):
+        for entries in load_manifest(dest, name)['files'].values():
+            used.update(sha for sha, _size in entries.values())
+    deleted = 0
+    objects = os.path.join(dest, 'objects')
+    if not os.path.isdir(objects):
+        return removed, deleted
+    for shard in os.scandir(objects):
+        if not shard.is_dir() or shard.name == '.tmp':
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name not in used:
+                os.remove(entry.path)
+                deleted += 1
+    return removed, deleted
+
+
+# --- Restore ---
+def verify(dest, name):
+    """
+    Prüft Datenbank und alle Dateien eines Snapshots gegen das Manifest.
+
+    Returns:
+        list: Beschreibungen der Fehler (leer = alles in Ordnung)
+    """
+    manifest = load_manifest(dest, name)
+    errors = []
+    db_file = os.path.join(_snapshots_dir(dest), name, manifest['database']['file'])
+    if not os.path.exists(db_file) or sha256_file(db_file) != manifest['database']['sha256']:
+        errors.append("database.db: Prüfsumme stimmt nicht")
+    checked = {}   # sha → Fehler oder None; gleiche Inhalte nur einmal lesen
+    for kind, entries in manifest['files'].items():
+        for key, (sha, size) in entries.items():
+            if sha not in checked:
+                path = _object_path(dest, sha)
+                if not os.path.exists(path):
+                    checked[sha] = "Objekt fehlt"
+                elif os.path.getsize(path) != size or sha256_file(path) != sha:
+                    checked[sha] = "Prüfsumme stimmt nicht"
+                else:
+                    checked[sha] = None
+            if checked[sha]:
+                errors.append(f"{kind}/{key}: {checked[sha]}")
+    return errors
+
+
+def restore(dest, name):
+    """
+    Spielt einen (geprüften) Snapshot zurück: Datenbank ersetzen, fehlende
+    oder abweichende Dateien (Größe oder SHA-256) in die Ablagen kopieren.
+
+    Returns:
+        dict: restored_files, restored_bytes, skipped_files
+    """
+    manifest = load_manifest(dest, name)
+    db_file = os.path.join(_snapshots_dir(dest), name, manifest['database']['file'])
+    stats = {'restored_files': 0, 'restored_bytes': 0, 'skipped_files': 0}
+
+    stores = dict(STORES)
+    for kind, entries in manifest['files'].items():
+        store = stores[kind]
+        present = {key: size for key, size, _mtime in store.keys()}
+        for key, (sha, size) in entries.items():
+            if present.get(key) == size:
+                # Gleiche Größe heißt nicht gleicher Inhalt: erst die Prüfsumme entscheidet
+                with store.open(key) as live:
+                    if _sha256_stream(live) == sha:
+                        stats['skipped_files'] += 1
+                        continue
+            store.put_file(key, _object_path(dest, sha))
+            stats['restored_files'] += 1
+            stats['restored_bytes'] += size
+
+    # Zuletzt die Datenbank: erst daneben kopieren, dann atomar austauschen.
+    # Alte WAL-/SHM-Dateien gehören zur alten Datenbank und müssen weg.
+    os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+    tmp_path = DB_PATH + '.restore'
+    shutil.copyfile(db_file, tmp_path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    os.replace(tmp_path, DB_PATH)
+    return stats
+
+
+# --- Befehle ---
+def cmd_snapshot(args):
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while not stopping:
+        try:
+            name, report = snapshot(args.dest, args.step_pages, args.step_sleep, lambda: stopping)
+        except KeyboardInterrupt:
+            logger.info("Abgebrochen, unvollständiger Snapshot wird beim nächsten Lauf verworfen")
+            return 1
+        logger.info("Snapshot %s: Datenbank %.1f MB in %d Schritten (%d Neustarts%s), "
+                    "%d Dateien neu kopiert, %d übernommen, %d fehlen; %.1f MB kopiert in %.1f s; "
+                    "Schreiber max. %.1f ms blockiert (%d Messungen)",
+                    name, report['db_bytes'] / 1024 / 1024, report['db_steps'], report['db_restarts'],
+                    ", zuletzt in einem Schritt" if report['db_single_step'] else "",
+                    report['files_copied'], report['files_reused'], report['files_missing'],
+                    report['bytes_copied'] / 1024 / 1024, report['seconds'],
+                    report['writer_max_wait_ms'], report['writer_probes'])
+        removed, deleted = prune(args.dest, args.keep)
+        if removed or deleted:
+            logger.info("%d alte Snapshots und %d nicht mehr benötigte Dateien gelöscht", len(removed), deleted)
+        if not args.every:
+            break
+        deadline = time.monotonic() + args.every
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(1)
+    return 0
+
+
+def cmd_list(args):
+    for name in list_snapshots(args.dest):
+        manifest = load_manifest(args.dest, name)
+        report = manifest['report']
+        count = sum(len(entries) for entries in manifest['files'].values())
+        print(f"{name}  {count:6d} Dateien  DB {manifest['database']['bytes'] / 1024 / 1024:7.1f} MB  "
+              f"kopiert {report['bytes_copied'] / 1024 / 1024:7.1f} MB  "
+              f"Schreiber max. {report['writer_max_wait_ms']} ms")
+    return 0
+
+
+def cmd_restore(args):
+    names = list_snapshots(args.dest)
+    name = args.snapshot or (names[-1] if names else None)
+    if name not in names:
+        logger.error("Snapshot %s nicht gefunden", name or "(keiner vorhanden)")
+        return 1
+    logger.info("Prüfe Snapshot %s …", name)
+    errors = verify(args.dest, name)
+    for error in errors:
+        logger.error("  %s", error)
+    if errors:
+        logger.error("%d Fehler, es wird nichts zurückgespielt", len(errors))
+        return 1
+    logger.info("Alle Prüfsummen in Ordnung")
+    if args.verify_only:
+        return 0
+    if os.path.exists(DB_PATH) and not args.force:
+        logger.error("%s existiert bereits; mit --force überschreiben (App vorher stoppen)", DB_PATH)
+        return 1
+    stats = restore(args.dest, name)
+    logger.info("Snapshot %s zurückgespielt: Datenbank ersetzt, %d Dateien (%.1f MB) kopiert, %d schon vorhanden",
+                name, stats['restored_files'], stats['restored_bytes'] / 1024 / 1024, stats['skipped_files'])
+    return 0
+
+
+def main(argv=None):
+    # --dest gehört zu jedem Unterbefehl: python backup.py snapshot --dest …
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dest', default=DEFAULT_DEST, help="Backup-Verzeichnis (Standard: BACKUP_DIR bzw. backups)")
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    snap = sub.add_parser('snapshot', parents=[common], help="Datenbank und neue Dateien sichern")
+    snap.add_argument('--keep', type=int, default=DEFAULT_KEEP, help="so viele Snapshots behalten (0 = alle)")
+    snap.add_argument('--every', type=int, default=0, help="alle N Sekunden wiederholen (0 = einmal)")
+    snap.add_argument('--step-pages', type=int, default=STEP_PAGES, help="Datenbankseiten pro Backup-Schritt")
+    snap.add_argument('--step-sleep', type=float, default=STEP_SLEEP, help="Pause zwischen zwei Schritten (s)")
+    sub.add_parser('list', parents=[common], help="Snapshots auflisten")
+    rest = sub.add_parser('restore', parents=[common], help="Snapshot prüfen und zurückspielen")
+    rest.add_argument('snapshot', nargs='?', help="Name des Snapshots (Standard: der neueste)")
+    rest.add_argument('--verify-only', action='store_true', help="nur Prüfsummen prüfen")
+    rest.add_argument('--force', action='store_true', help="vorhandene Datenbank ersetzen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [backup] %(message)s")
+    commands = {'snapshot': cmd_snapshot, 'list': cmd_list, 'restore': cmd_restore}
+    return commands[args.command](args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,616 @@
+#!/usr/bin/env python
+"""
+Reproduzierbare Benchmarks mit synthetischem Datenbestand.
+
+seed legt in einem eigenen Datenverzeichnis (APP_DATA_DIR, Aufbau wie /data)
+N Bilder an: ein kleiner Vorrat echter JPEG/PNG/HEIC-Dateien mit EXIF (GPS,
+Aufnahmezeit, Kamera) wird einmal durch process_upload geschickt, danach
+werden Originale und Derivate per Hardlink vervielfacht und die Zeilen mit
+gestreuten Koordinaten, Daten und Kategorien in Batches eingefügt. Gleicher
+--seed ergibt denselben Bestand.
+
+run misst gegen das echte Flask-App-Objekt (Test-Client) oder einen lokal
+gestarteten gunicorn (bzw. --url) Durchsatz und p50/p95/p99 für /map,
+/api/markers, /gallery, /detail/<id>, die Bildrouten und /upload und
+schreibt das Ergebnis als JSON. Mit --compare wird gegen einen früheren
+Lauf verglichen (Exit-Code 1 bei Verschlechterung über --tolerance).
+
+startup misst in frischen Interpretern, wie lange der Import der App und
+der erste Request dauern (Exit-Code 1, wenn der Import das Budget reißt).
+
+Start:  python benchmark.py seed --images 10000 [--data-dir bench-data]
+        python benchmark.py run [--target client|gunicorn] [--output bench.json] [--compare alt.json]
+        python benchmark.py startup [--budget-ms 300]
+"""
+import argparse
+import hashlib
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(ROOT, 'bench-data')
+MANIFEST = 'bench-manifest.json'
+
+POOL_SIZE = 24                  # echte Bilddateien, aus denen der Bestand vervielfacht wird
+POOL_FORMATS = ('jpeg', 'png', 'heic')
+IMAGE_SIZE = (1600, 1200)
+INSERT_BATCH = 1000
+
+# Schwerpunkte für die Koordinaten (Mittelgebirge), damit Cluster entstehen wie im echten Bestand
+CENTERS = [(50.55, 9.95), (49.45, 11.45), (51.80, 10.60), (48.05, 8.10), (50.40, 7.90), (47.65, 10.70)]
+WORDS = ["Burg", "Ruine", "Felsen", "Aussicht", "Kapelle", "Trail", "Abfahrt", "Gipfel", "Wald", "Turm",
+         "Brücke", "Quelle", "Steinbruch", "Hütte", "Kreuz", "Tal", "Wurzelpfad", "Sprung", "Kehre", "Bach"]
+CAMERAS = [("Apple", "iPhone 13"), ("Samsung", "SM-G991B"), ("GoPro", "HERO9 Black"), ("SONY", "ILCE-7M3")]
+
+DEFAULT_USER = ('admin', 'admin123')   # wird von app.py in jeder neuen Datenbank angelegt
+
+
+def _load_app(data_dir):
+    """Importiert app.py mit dem Benchmark-Datenverzeichnis (muss vor dem ersten Import passieren)."""
+    os.environ['APP_DATA_DIR'] = os.path.abspath(data_dir)
+    os.makedirs(os.path.join(data_dir, 'uploads'), exist_ok=True)
+    os.makedirs(os.path.join(data_dir, 'thumbnails'), exist_ok=True)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app
+    if app.DATA_DIR != os.path.abspath(data_dir):
+        raise SystemExit("app.py wurde schon mit einem anderen Datenverzeichnis importiert")
+    return app
+
+
+# --- Synthetische Bilder ---
+def _dms(value):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return (float(degrees), float(minutes), seconds)
+
+
+def synthetic_exif(lat, lon, taken, camera):
+    """EXIF wie von einer Handykamera: Hersteller, Modell, Aufnahmezeit, GPS, Orientierung."""
+    exif = Image.Exif()
+    exif[0x010F], exif[0x0110] = camera
+    exif[0x0112] = 1
+    exif[0x0132] = taken.strftime('%Y:%m:%d %H:%M:%S')
+    exif[0x8769] = {0x9003: taken.strftime('%Y:%m:%d %H:%M:%S')}
+    exif[0x8825] = {
+        1: 'N' if lat >= 0 else 'S', 2: _dms(lat),
+        3: 'E' if lon >= 0 else 'W', 4: _dms(lon),
+        5: 0, 6: float(round(200 + abs(lat * 7) % 600)),
+    }
+    return exif
+
+
+def synthetic_image(rng, size=IMAGE_SIZE):
+    """Fotoähnliches Bild: Farbverlauf mit grobem Rauschen (Dateigröße ähnlich wie bei einem Foto)."""
+    w, h = size
+    # Pixelrauschen wäre unrealistisch teuer zu kodieren (v.a. HEIC), daher vergröbert
+    noise = Image.effect_noise((w // 4, h // 4), rng.uniform(30, 70)).resize((w, h), Image.BILINEAR)
+    gradient = Image.linear_gradient('L').resize((w, h)).rotate(rng.choice((0, 90, 180, 270)))
+    base = Image.new('L', (w, h), rng.randrange(40, 200))
+    return Image.merge('RGB', (noise, gradient, base))
+
+
+def encode_image(img, fmt, exif):
+    """Bytes und Dateiendung für JPEG/PNG/HEIC mit eingebettetem EXIF."""
+    buf = io.BytesIO()
+    if fmt == 'jpeg':
+        img.save(buf, 'JPEG', quality=90, exif=exif)
+        return buf.getvalue(), 'jpg'
+    if fmt == 'png':
+        img.save(buf, 'PNG', exif=exif)
+        return buf.getvalue(), 'png'
+    from imaging import register_codecs
+    register_codecs()
+    # Schnellstes x265-Preset: Dekodieren (das, was gemessen wird) ist davon unabhängig
+    img.save(buf, 'HEIF', quality=80, exif=exif, enc_params={'preset': 'ultrafast'})
+    return buf.getvalue(), 'heic'
+
+
+def random_spot(rng):
+    lat, lon = rng.choice(CENTERS)
+    return round(rng.gauss(lat, 0.35), 6), round(rng.gauss(lon, 0.5), 6)
+
+
+def random_time(rng):
+    return datetime(2022, 1, 1) + timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+
+
+# --- seed ---
+def _make_template(i, seed, originals, derivatives):
+    """Läuft im Pool-Prozess: eine Vorlage erzeugen und wie im Worker verarbeiten."""
+    from imaging import process_stored
+    rng = random.Random(seed)
+    fmt = POOL_FORMATS[i % len(POOL_FORMATS)]
+    lat, lon = random_spot(rng)
+    data, ext = encode_image(synthetic_image(rng), fmt, synthetic_exif(lat, lon, random_time(rng), rng.choice(CAMERAS)))
+    filename = f"pool_{i:03d}_{seed:016x}.{ext}"
+    originals.save(filename, io.BytesIO(data))
+    result = process_stored(filename, originals, derivatives)
+    result['format'] = fmt
+    return result
+
+
+def build_pool(app, rng, size):
+    """Erzeugt `size` echte Uploads (JPEG/PNG/HEIC) und verarbeitet sie wie der Worker."""
+    seeds = [rng.getrandbits(64) for _ in range(size)]
+    with ProcessPoolExecutor() as pool:
+        return list(pool.map(_make_template, range(size), seeds,
+                             [app.original_store] * size, [app.derivative_store] * size))
+
+
+def cmd_seed(args):
+    app = _load_app(args.data_dir)
+    import db
+    import migrate
+    from db import transaction
+    migrate.migrate()
+    rng = random.Random(args.seed)
+    conn = db.connect(app.DB_PATH)
+    start_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM images").fetchone()[0] + 1
+
+    started = time.monotonic()
+    pool = build_pool(app, rng, min(args.pool, args.images))
+    print(f"{len(pool)} Vorlagen verarbeitet ({time.monotonic() - started:.1f} s)")
+
+    image_rows, derivative_rows = [], []
+
+    def write_batch():
+        with transaction(conn):
+            conn.executemany("""
+                INSERT INTO images (id, name, description, category, filepath, thumbnail_path, latitude, longitude,
+                                    upload_date, upload_time, exif_date, exif_time, status, content_hash, phash,
+                                    width, height, orientation, altitude, camera, lens, lqip)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'ready', ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, image_rows)
+            conn.executemany("""
+                INSERT INTO derivatives (image_id, format, width, height, path, bytes) VALUES (?, ?, ?, ?, ?, ?)
+            """, derivative_rows)
+        image_rows.clear()
+        derivative_rows.clear()
+
+    for n in range(args.images):
+        image_id = start_id + n
+        template = pool[n % len(pool)]
+        prefix = f"b{image_id}_"
+        # Lokal als Hardlink, die Bytes liegen nur einmal auf der Platte
+        app.original_store.copy(template['filepath'], prefix + template['filepath'])
+        for d in template['derivatives']:
+            app.derivative_store.copy(d['path'], prefix + d['path'])
+            derivative_rows.append((image_id, d['format'], d['width'], d['height'], prefix + d['path'], d['bytes']))
+
+        lat, lon = random_spot(rng)
+        taken = random_time(rng)
+        uploaded = taken + timedelta(hours=rng.randrange(1, 240))
+        words = rng.sample(WORDS, 3)
+        image_rows.append((
+            image_id, f"{words[0]} {words[1]} {image_id}", f"{' '.join(rng.sample(WORDS, 6))} bei Kilometer {n % 80}",
+            rng.choice(app.ALLOWED_CATEGORIES), prefix + template['filepath'],
+            prefix + template['thumbnail_path'] if template['thumbnail_path'] else None, lat, lon,
+            uploaded.strftime('%Y-%m-%d'), uploaded.strftime('%H:%M:%S'),
+            taken.strftime('%Y-%m-%d'), taken.strftime('%H:%M:%S'),
+            hashlib.sha256(f"bench-{image_id}".encode()).hexdigest(), rng.getrandbits(64) - (1 << 63),
+            template['width'], template['height'], template['orientation'], template['altitude'],
+            template['camera'], template['lens'], template['lqip'],
+        ))
+        if len(image_rows) >= INSERT_BATCH:
+            write_batch()
+            print(f"\r{n + 1}/{args.images} Bilder", end='', file=sys.stderr)
+    if image_rows:
+        write_batch()
+    print(file=sys.stderr)
+    conn.execute("PRAGMA optimize")
+    total = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+    conn.close()
+
+    manifest = {'images': total, 'seed': args.seed, 'pool': len(pool),
+                'formats': sorted({p['format'] for p in pool}), 'created': datetime.now().isoformat(timespec='seconds')}
+    with open(os.path.join(args.data_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"{args.images} Bilder angelegt, {total} im Bestand ({time.monotonic() - started:.1f} s) → {args.data_dir}")
+
+
+# --- Treiber ---
+class ClientSession:
+    """Test-Client des echten App-Objekts (ohne Netzwerk und ohne WSGI-Server)."""
+
+    def __init__(self, app):
+        self.client = app.app.test_client()
+
+    def request(self, method, path, data=None, files=None):
+        if files:
+            data = dict(data or {}, **{k: (io.BytesIO(v), name) for k, (name, v) in files.items()})
+        resp = self.client.open(path, method=method, data=data)
+        body = resp.get_data()
+        resp.close()
+        return resp.status_code, body
+
+
+class HttpSession:
+    """HTTP gegen einen laufenden Server; Redirects werden nicht verfolgt."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect)
+
+    def request(self, method, path, data=None, files=None):
+        body, headers = None, {}
+        if files:
+            body, content_type = _multipart(data or {}, files)
+            headers['Content-Type'] = content_type
+        elif data:
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+_CSRF_RE = re.compile(rb'name="csrf_token" value="([^"]+)"')
+
+
+def _csrf_token(session, path):
+    status, body = session.request('GET', path)
+    match = _CSRF_RE.search(body)
+    if status != 200 or not match:
+        raise RuntimeError(f"Kein CSRF-Token auf {path} (HTTP {status})")
+    return match.group(1).decode()
+
+
+def login(session, username, password):
+    token = _csrf_token(session, '/login')
+    status, _ = session.request('POST', '/login', data={'csrf_token': token, 'username': username,
+                                                        'password': password})
+    if status not in (302, 303):
+        raise RuntimeError(f"Login als {username} fehlgeschlagen (HTTP {status})")
+    return session
+
+
+def start_gunicorn(data_dir, port, workers):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        raise SystemExit("gunicorn ist nicht installiert (pip install gunicorn) – oder --url verwenden")
+    env = dict(os.environ, APP_DATA_DIR=os.path.abspath(data_dir), IMAGE_WORKER='off')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-b', f'127.0.0.1:{port}', '-w', str(workers), 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn beendet: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=2).close()
+            return proc
+        except OSError:
+            time.sleep(0.3)
+    proc.terminate()
+    raise SystemExit("gunicorn antwortet nicht")
+
+
+# --- Szenarien ---
+def build_scenarios(app, rng):
+    """Liste (Name, Pfad-Generator) der GET-Szenarien."""
+    import db
+    conn = db.connect(app.DB_PATH)
+    rows = conn.execute("""
+        SELECT id, filepath, thumbnail_path FROM images
+        WHERE status = 'ready' AND thumbnail_path IS NOT NULL ORDER BY RANDOM() LIMIT 5000
+    """).fetchall()
+    conn.close()
+    if not rows:
+        raise SystemExit("Keine Bilder im Bestand – vorher 'python benchmark.py seed' ausführen")
+    from imaging import supported_derivative_formats
+    ext = 'webp' if 'webp' in supported_derivative_formats() else 'jpg'
+
+    def markers():
+        lat, lon = random_spot(rng)
+        zoom = rng.choice((6, 9, 12, 15))
+        half = 180.0 / 2 ** zoom * 2
+        return f"/api/markers?zoom={zoom}&bbox={lon - half:.4f},{lat - half / 2:.4f},{lon + half:.4f},{lat + half / 2:.4f}"
+
+    return [
+        ('map', lambda: '/map'),
+        ('api_markers', markers),
+        ('gallery', lambda: '/gallery'),
+        ('detail', lambda: f"/detail/{rng.choice(rows)[0]}"),
+        ('thumbnail', lambda: f"/thumbnails/{rng.choice(rows)[2]}"),
+        ('original', lambda: f"/uploads/{rng.choice(rows)[1]}"),
+        ('img_resized', lambda: f"/img/{rng.choice(rows)[0]}/{rng.choice(app.RESIZE_WIDTHS)}.{ext}"),
+    ]
+
+
+def _percentile(sorted_ms, q):
+    if len(sorted_ms) == 1:
+        return sorted_ms[0]
+    return statistics.quantiles(sorted_ms, n=100, method='inclusive')[q - 1]
+
+
+def measure(sessions, make_request, count, warmup):
+    """Führt `count` Requests verteilt auf die Sessions (je ein Thread) aus."""
+    for _ in range(warmup):
+        make_request(sessions[0])
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = iter(range(count))
+
+    def run(session):
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            ok, detail = make_request(session)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(detail)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(run, sessions))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(_percentile(latencies, 50), 2),
+        'p95_ms': round(_percentile(latencies, 95), 2),
+        'p99_ms': round(_percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+    if errors:
+        result['first_error'] = str(errors[0])
+    return result
+
+
+def _get_request(path_for):
+    def make_request(session):
+        status, _ = session.request('GET', path_for())
+        return status in (200, 304), status
+    return make_request
+
+
+def _upload_request(app, rng, count):
+    """POST /upload mit jeweils neuer Datei (sonst greift die Duplikaterkennung)."""
+    bodies = []
+    for i in range(count):
+        fmt = POOL_FORMATS[i % len(POOL_FORMATS)]
+        lat, lon = random_spot(rng)
+        bodies.append(encode_image(synthetic_image(rng, (1200, 900)), fmt,
+                                   synthetic_exif(lat, lon, random_time(rng), rng.choice(CAMERAS))))
+    bodies_iter = iter(bodies)
+    lock = threading.Lock()
+    tokens = {}
+
+    def make_request(session):
+        with lock:
+            data, ext = next(bodies_iter)
+        if session not in tokens:
+            tokens[session] = _csrf_token(session, '/upload')
+        status, _ = session.request('POST', '/upload', data={
+            'csrf_token': tokens[session], 'name': f"Benchmark {uuid.uuid4().hex[:6]}",
+            'description': "Benchmark-Upload", 'category': app.ALLOWED_CATEGORIES[0],
+        }, files={'image': (f"bench.{ext}", data)})
+        return status in (302, 303), status
+    return make_request
+
+
+def cmd_run(args):
+    app = _load_app(args.data_dir)
+    rng = random.Random(args.seed)
+    proc = None
+    if args.target == 'client':
+        base_url = None
+        new_session = lambda: ClientSession(app)
+    else:
+        base_url = args.url
+        if base_url is None:
+            proc = start_gunicorn(args.data_dir, args.port, args.workers)
+            base_url = f'http://127.0.0.1:{args.port}'
+        new_session = lambda: HttpSession(base_url)
+
+    try:
+        sessions = [login(new_session(), args.user, args.password) for _ in range(args.concurrency)]
+        results = {}
+        for name, path_for in build_scenarios(app, rng):
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(sessions, _get_request(path_for), args.requests, args.warmup)
+            _print_row(name, results[name])
+        if not args.only or 'upload' in args.only:
+            count = args.uploads
+            results['upload'] = measure(sessions, _upload_request(app, rng, count + args.warmup),
+                                        count, args.warmup)
+            _print_row('upload', results['upload'])
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    report = {'meta': _meta(app, args, base_url), 'scenarios': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"→ {args.output}")
+    if args.compare:
+        return compare(args.compare, report, args.tolerance)
+    return 0
+
+
+def _meta(app, args, base_url):
+    manifest_path = os.path.join(args.data_dir, MANIFEST)
+    dataset = json.load(open(manifest_path)) if os.path.exists(manifest_path) else None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'target': args.target,
+        'url': base_url,
+        'workers': args.workers if args.target == 'gunicorn' and not args.url else None,
+        'concurrency': args.concurrency,
+        'requests_per_scenario': args.requests,
+        'dataset': dataset,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _print_row(name, r):
+    print(f"{name:<12} {r['requests']:>5} req  {r['throughput_rps'] or 0:>8.1f}/s  "
+          f"p50 {r['p50_ms']:>8.2f}  p95 {r['p95_ms']:>8.2f}  p99 {r['p99_ms']:>8.2f} ms"
+          + (f"  {r['errors']} Fehler" if r['errors'] else ""))
+
+
+def compare(baseline_path, report, tolerance):
+    """Vergleicht p50/p95 mit einem früheren Lauf. Returns: 1 bei Verschlechterung über tolerance (%)."""
+    with open(baseline_path) as f:
+        old_report = json.load(f)
+    baseline = old_report['scenarios']
+    regressed = False
+    print(f"Vergleich mit {baseline_path}:")
+    for key in ('target', 'concurrency', 'workers', 'dataset'):
+        if old_report['meta'].get(key) != report['meta'].get(key):
+            print(f"  Achtung: {key} unterscheidet sich ({old_report['meta'].get(key)} → {report['meta'].get(key)})")
+    for name, current in report['scenarios'].items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms'):
+            delta = (current[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            flag = delta > tolerance
+            regressed |= flag
+            changes.append(f"{key[:3]} {old[key]:.2f} → {current[key]:.2f} ({delta:+.0f} %){' !' if flag else ''}")
+        print(f"  {name:<12} " + ", ".join(changes))
+    return 1 if regressed else 0
+
+
+# --- startup ---
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import wsgi
+t1 = time.perf_counter()
+wsgi.app.test_client().get('/login')
+t2 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_request_ms': (t2 - t1) * 1000}))
+"""
+
+
+def cmd_startup(args):
+    """Import der App und erster Request in frischen Interpretern (das, was ein Worker beim Start tut)."""
+    env = dict(os.environ, APP_DATA_DIR=os.path.abspath(args.data_dir))
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    results = {}
+    for key in ('import_ms', 'first_request_ms'):
+        values = sorted(s[key] for s in samples)
+        results[key] = {'p50': round(statistics.median(values), 1), 'max': round(values[-1], 1)}
+        print(f"{key:<17} p50 {results[key]['p50']:>7.1f} ms   max {results[key]['max']:>7.1f} ms")
+    over = results['import_ms']['p50'] > args.budget_ms
+    print(f"Budget {args.budget_ms:.0f} ms: {'überschritten' if over else 'eingehalten'}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'runs': args.runs,
+                                'budget_ms': args.budget_ms, 'python': platform.python_version()},
+                       'startup': results}, f, indent=2)
+    return 1 if over else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Datenverzeichnis des Benchmark-Bestands")
+    parser.add_argument('--seed', type=int, default=42, help="Zufalls-Seed (gleicher Seed, gleicher Bestand)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    seed = sub.add_parser('seed', help="synthetischen Bestand anlegen (ergänzt einen vorhandenen)")
+    seed.add_argument('--images', type=int, default=1000, help="Anzahl Bilder, z.B. 1000, 10000, 100000")
+    seed.add_argument('--pool', type=int, default=POOL_SIZE, help="Anzahl echter Vorlagen (JPEG/PNG/HEIC)")
+
+    run = sub.add_parser('run', help="Benchmark ausführen")
+    run.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    run.add_argument('--url', help="bereits laufenden Server messen statt gunicorn zu starten")
+    run.add_argument('--port', type=int, default=8765)
+    run.add_argument('--workers', type=int, default=2, help="gunicorn-Worker")
+    run.add_argument('--concurrency', type=int, default=1, help="parallele Clients")
+    run.add_argument('--requests', type=int, default=200, help="Requests pro Szenario")
+    run.add_argument('--uploads', type=int, default=20, help="Uploads im Szenario upload")
+    run.add_argument('--warmup', type=int, default=5, help="ungemessene Requests vorab")
+    run.add_argument('--only', nargs='+', help="nur diese Szenarien")
+    run.add_argument('--user', default=DEFAULT_USER[0])
+    run.add_argument('--password', default=DEFAULT_USER[1])
+    run.add_argument('--output', help="Ergebnis als JSON schreiben")
+    run.add_argument('--compare', help="früheres JSON-Ergebnis zum Vergleich")
+    run.add_argument('--tolerance', type=float, default=15.0, help="erlaubte Verschlechterung in Prozent")
+    startup = sub.add_parser('startup', help="Importzeit der App gegen ein Budget messen")
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--budget-ms', type=float, default=300.0, help="erlaubte Importzeit (Median)")
+    startup.add_argument('--output', help="Ergebnis als JSON schreiben")
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        return cmd_startup(args)
+    if args.command == 'seed':
+        cmd_seed(args)
+        return 0
+    if args.target == 'client' and args.url:
+        parser.error("--url gehört zu --target gunicorn")
+    return cmd_run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
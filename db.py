@@ -0,0 +1,172 @@
+"""
+Datenbankzugriff: gepoolte, getunte SQLite-Verbindungen.
+
+Jeder Request leiht sich über get_db() eine Verbindung aus dem Pool des
+Prozesses und gibt sie beim Teardown des App-Kontexts zurück. Verbindungen
+laufen im WAL-Modus (Leser blockieren Schreiber nicht), im Autocommit-Modus
+und liefern sqlite3.Row (Zugriff per Index und per Spaltenname).
+Schreibzugriffe laufen über transaction(), das die Schreibsperre sofort
+mit BEGIN IMMEDIATE holt und bei Konflikten busy_timeout lang wartet,
+statt mit "database is locked" abzubrechen.
+
+Dauer von Abfragen und Wartezeit auf die Schreibsperre werden an einen
+optionalen Beobachter gemeldet (set_observer, genutzt von metrics.py).
+"""
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+# Werden auf jede neue Verbindung angewendet
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),       # in WAL sicher, spart fsync pro Commit
+    ("busy_timeout", 5000),          # ms warten, bevor SQLITE_BUSY gemeldet wird
+    ("cache_size", -16000),          # 16 MB Page-Cache pro Verbindung
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "ON"),
+)
+
+POOL_SIZE = 4                 # freie Verbindungen, die pro Prozess vorgehalten werden
+STATEMENT_CACHE_SIZE = 256    # vorbereitete Statements pro Verbindung (sqlite3-Cache)
+
+
+# observer(kind, seconds) mit kind 'query' oder 'lock_wait'; None = nichts messen
+_observer = None
+
+
+def set_observer(observer):
+    global _observer
+    _observer = observer
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Meldet die Dauer von execute()/executemany() an den Beobachter.
+
+    Gemessen wird bis zur ersten Ergebniszeile; das Abholen weiterer Zeilen
+    (fetchall) zählt nicht mit.
+    """
+
+    def execute(self, sql, parameters=()):
+        if _observer is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observer('query', time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if _observer is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observer('query', time.perf_counter() - start)
+
+
+def connect(path):
+    """Öffnet eine neue, getunte Verbindung (auch für Skripte ohne App-Kontext)."""
+    conn = sqlite3.connect(
+        path,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        factory=TimedConnection,
+    )
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Einfacher LIFO-Pool pro Prozess.
+
+    Da die Verbindungen langlebig sind, bleibt auch der Statement-Cache von
+    sqlite3 über Requests hinweg warm. Nach einem fork() (gunicorn) wird der
+    geerbte Pool verworfen, weil SQLite-Verbindungen nicht prozessübergreifend
+    benutzt werden dürfen.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+
+
+def get_pool(path):
+    pool = _pools.get(path)
+    if pool is None:
+        pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def get_db():
+    """Verbindung des aktuellen Requests (wird beim Teardown zurückgegeben)."""
+    if 'db' not in g:
+        g.db = get_pool(current_app.config['DATABASE']).acquire()
+    return g.db
+
+
+def _release_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool(current_app.config['DATABASE']).release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(_release_db)
+
+
+@contextmanager
+def transaction(conn):
+    """Schreibtransaktion: holt die Sperre sofort, committet oder rollt zurück."""
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    if _observer is not None:
+        _observer('lock_wait', time.perf_counter() - start)
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Duplikate erkennen, berichten und aufräumen.
+
+Exakte Duplikate haben denselben content_hash (SHA-256 der hochgeladenen
+Datei) und werden beim Upload abgewiesen. Ähnliche Bilder (neu kodiert,
+skaliert) erkennt der perzeptuelle Hash (phash, dhash aus imaging.py); der
+Worker markiert sie mit near_duplicate_of, gelöscht wird dabei nichts.
+
+Für den Bestand:
+  python dedupe.py backfill           fehlende Hashes nachrechnen, Ähnlichkeiten neu bestimmen
+  python dedupe.py report             exakte und ähnliche Duplikate auflisten
+  python dedupe.py cleanup [--apply]  exakte Duplikate löschen (das älteste Bild bleibt)
+"""
+import argparse
+
+import db
+from app import DB_PATH, app, original_store, remove_image
+from db import transaction
+from imaging import dhash_file, file_sha256, hamming_distance
+
+# Bis zu diesem Abstand (Bits) gelten Bilder als ähnlich. Bei 4 Bändern à 16 Bit
+# stimmt bis Abstand 3 mindestens ein Band exakt überein (Schubfachprinzip),
+# die Suche über die Band-Indizes findet solche Paare also garantiert.
+PHASH_MAX_DISTANCE = 3
+PHASH_BANDS = (0, 16, 32, 48)
+
+
+def find_near_duplicates(conn, phash, exclude_id=None, max_distance=PHASH_MAX_DISTANCE):
+    """
+    Bilder mit ähnlichem perzeptuellem Hash.
+
+    Kandidaten kommen über die Band-Indizes (idx_images_phash_b0..b3),
+    der genaue Hamming-Abstand wird danach in Python geprüft.
+
+    Returns:
+        list: (abstand, image_id), nächstes zuerst
+    """
+    bands = " UNION ".join(
+        f"SELECT id, phash FROM images WHERE phash IS NOT NULL AND {_band_sql(shift)} = ?"
+        for shift in PHASH_BANDS
+    )
+    params = [(phash >> shift) & 0xFFFF for shift in PHASH_BANDS]
+    matches = []
+    for row in conn.execute(bands, params):
+        if row[0] == exclude_id:
+            continue
+        distance = hamming_distance(phash, row[1])
+        if distance <= max_distance:
+            matches.append((distance, row[0]))
+    return sorted(matches)
+
+
+def _band_sql(shift):
+    # Muss exakt den Index-Ausdrücken in init_db entsprechen, sonst greift der Index nicht
+    return "(phash & 65535)" if shift == 0 else f"((phash >> {shift}) & 65535)"
+
+
+def closest_older(conn, image_id, phash):
+    """ID des ähnlichsten älteren Bildes (für near_duplicate_of) oder None."""
+    older = [(distance, other) for distance, other in find_near_duplicates(conn, phash, exclude_id=image_id)
+             if other < image_id]
+    return older[0][1] if older else None
+
+
+# --- Kommandozeile ---
+def _file_size(store, name):
+    try:
+        return store.size(name) or 0
+    except (OSError, ValueError):
+        return 0
+
+
+def _image_bytes(conn, image_id, filepath):
+    derivative_bytes = conn.execute(
+        "SELECT COALESCE(SUM(bytes), 0) FROM derivatives WHERE image_id = ?", (image_id,)
+    ).fetchone()[0]
+    return _file_size(original_store, filepath) + derivative_bytes
+
+
+def exact_groups(conn):
+    """Gruppen mit gleichem content_hash: Liste von Listen (id, filepath), älteste zuerst."""
+    groups = {}
+    for row in conn.execute("""
+        SELECT id, filepath, content_hash FROM images
+        WHERE content_hash IN (
+            SELECT content_hash FROM images WHERE content_hash IS NOT NULL
+            GROUP BY content_hash HAVING COUNT(*) > 1
+        )
+        ORDER BY content_hash, id
+    """):
+        groups.setdefault(row['content_hash'], []).append((row['id'], row['filepath']))
+    return list(groups.values())
+
+
+def cmd_backfill(conn):
+    rows = conn.execute("""
+        SELECT id, filepath, content_hash, phash FROM images
+        WHERE status = 'ready' AND (content_hash IS NULL OR phash IS NULL)
+    """).fetchall()
+    hashed = failed = 0
+    for row in rows:
+        try:
+            with original_store.local_path(row['filepath']) as path:
+                content_hash = row['content_hash'] or file_sha256(path)
+                phash = row['phash'] if row['phash'] is not None else dhash_file(path)
+        except Exception as e:
+            print(f"  #{row['id']} {row['filepath']}: {e}")
+            failed += 1
+            continue
+        with transaction(conn):
+            conn.execute("UPDATE images SET content_hash = ?, phash = ? WHERE id = ?",
+                         (content_hash, phash, row['id']))
+        hashed += 1
+    print(f"{hashed} Bilder gehasht, {failed} nicht lesbar")
+
+    # Ähnlichkeiten für den ganzen Bestand neu bestimmen (jeweils auf das älteste ähnliche Bild)
+    linked = 0
+    with transaction(conn):
+        for row in conn.execute("SELECT id, phash FROM images WHERE phash IS NOT NULL ORDER BY id").fetchall():
+            other = closest_older(conn, row['id'], row['phash'])
+            conn.execute("UPDATE images SET near_duplicate_of = ? WHERE id = ? AND near_duplicate_of IS NOT ?",
+                         (other, row['id'], other))
+            linked += other is not None
+    print(f"{linked} Bilder als mögliches Duplikat markiert")
+
+
+def cmd_report(conn):
+    groups = exact_groups(conn)
+    redundant = 0
+    print(f"Exakte Duplikate: {len(groups)} Gruppen")
+    for group in groups:
+        keep, extra = group[0], group[1:]
+        size = sum(_image_bytes(conn, image_id, filepath) for image_id, filepath in extra)
+        redundant += size
+        print(f"  behalten #{keep[0]}, doppelt: {', '.join(f'#{i}' for i, _ in extra)} ({size / 1024 / 1024:.1f} MB)")
+    print(f"  zusammen {redundant / 1024 / 1024:.1f} MB überflüssig")
+
+    near = conn.execute("""
+        SELECT a.id, a.name, a.phash, b.id AS other, b.name AS other_name, b.phash AS other_phash
+        FROM images a JOIN images b ON b.id = a.near_duplicate_of
+        WHERE a.content_hash IS NOT b.content_hash
+        ORDER BY a.id
+    """).fetchall()
+    print(f"Ähnliche Bilder: {len(near)}")
+    for row in near:
+        print(f"  #{row['id']} {row['name']!r} ~ #{row['other']} {row['other_name']!r} "
+              f"(Abstand {hamming_distance(row['phash'], row['other_phash'])})")
+    missing = conn.execute(
+        "SELECT COUNT(*) FROM images WHERE status = 'ready' AND (content_hash IS NULL OR phash IS NULL)"
+    ).fetchone()[0]
+    if missing:
+        print(f"{missing} Bilder ohne Hash – vorher 'python dedupe.py backfill' ausführen")
+
+
+def cmd_cleanup(conn, apply):
+    removed = freed = 0
+    for group in exact_groups(conn):
+        keep_path = group[0][1]
+        for image_id, filepath in group[1:]:
+            if filepath == keep_path:
+                # Zeile zeigt auf dieselbe Datei wie das behaltene Bild: nicht automatisch löschen
+                print(f"  #{image_id} teilt die Datei mit #{group[0][0]}, übersprungen")
+                continue
+            size = _image_bytes(conn, image_id, filepath)
+            if apply:
+                with app.app_context():
+                    remove_image(conn, image_id)
+            removed += 1
+            freed += size
+    verb = "gelöscht" if apply else "würden gelöscht (Probelauf, --apply zum Ausführen)"
+    print(f"{removed} exakte Duplikate {verb}, {freed / 1024 / 1024:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill', help="fehlende Hashes nachrechnen und Ähnlichkeiten neu bestimmen")
+    sub.add_parser('report', help="Duplikate auflisten")
+    cleanup = sub.add_parser('cleanup', help="exakte Duplikate löschen")
+    cleanup.add_argument('--apply', action='store_true', help="wirklich löschen (sonst nur Probelauf)")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(DB_PATH)
+    try:
+        if args.command == 'backfill':
+            cmd_backfill(conn)
+        elif args.command == 'report':
+            cmd_report(conn)
+        else:
+            cmd_cleanup(conn, args.apply)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
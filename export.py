@@ -0,0 +1,171 @@
+"""
+Export der Spots als GeoJSON, GPX (Wegpunkte) und KML.
+
+Alles läuft als Generator direkt über den SQLite-Cursor: Zeilen werden
+einzeln serialisiert und in Blöcken von etwa CHUNK_SIZE Bytes ausgegeben,
+der Speicherbedarf hängt also nicht von der Anzahl der Bilder ab. Die
+Funktionen kennen Flask nicht; Links werden aus `base_url` und den festen
+Pfaden /detail/<id> bzw. /thumbnails/<datei> gebaut, damit auch
+export_spots.py ohne Request-Kontext vollständige Dateien schreiben kann.
+"""
+import json
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    # Format → (Dateiendung, Content-Type)
+    'geojson': ('geojson', 'application/geo+json'),
+    'gpx': ('gpx', 'application/gpx+xml'),
+    'kml': ('kml', 'application/vnd.google-earth.kml+xml'),
+}
+
+
+def query(conn, category=None, bbox=None, date_from=None, date_to=None):
+    """
+    Cursor über alle Bilder mit Koordinaten, die zu den Filtern passen.
+
+    Args:
+        bbox: (west, south, east, north) oder None
+        date_from, date_to: Aufnahmedatum YYYY-MM-DD (ersatzweise Upload-Datum)
+    """
+    if bbox:
+        # Vorauswahl über den R*Tree wie bei /api/markers
+        source = "images_rtree r JOIN images i ON i.id = r.id"
+        where = ["r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?",
+                 "i.latitude BETWEEN ? AND ? AND i.longitude BETWEEN ? AND ?"]
+        west, south, east, north = bbox
+        params = [south, north, west, east, south, north, west, east]
+    else:
+        source = "images i"
+        where = ["i.latitude IS NOT NULL AND i.longitude IS NOT NULL"]
+        params = []
+    if category:
+        where.append("i.category = ?")
+        params.append(category)
+    if date_from:
+        where.append("COALESCE(i.exif_date, i.upload_date) >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("COALESCE(i.exif_date, i.upload_date) <= ?")
+        params.append(date_to)
+    return conn.execute(f"""
+        SELECT i.id, i.name, i.description, i.category, i.latitude, i.longitude, i.altitude,
+               i.exif_date, i.exif_time, i.upload_date, i.filepath, i.thumbnail_path
+        FROM {source}
+        WHERE {' AND '.join(where)}
+        ORDER BY i.id
+    """, params)
+
+
+def _links(row, base_url):
+    thumbnail = row['thumbnail_path']
+    return (f"{base_url}/detail/{row['id']}",
+            f"{base_url}/thumbnails/{thumbnail}" if thumbnail else f"{base_url}/uploads/{row['filepath']}")
+
+
+def _timestamp(row):
+    """Aufnahmezeitpunkt als xsd:dateTime ohne Zeitzone (EXIF kennt keine)."""
+    if row['exif_date'] and row['exif_time']:
+        return f"{row['exif_date']}T{row['exif_time']}"
+    return None
+
+
+def _chunked(parts):
+    """Fasst viele kleine Strings zu Blöcken von etwa CHUNK_SIZE Bytes zusammen."""
+    buffer, size = [], 0
+    for part in parts:
+        data = part.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _geojson(rows, base_url):
+    yield '{"type":"FeatureCollection","features":['
+    for n, row in enumerate(rows):
+        detail, thumbnail = _links(row, base_url)
+        coordinates = [row['longitude'], row['latitude']]
+        if row['altitude'] is not None:
+            coordinates.append(row['altitude'])
+        feature = {
+            'type': 'Feature',
+            'id': row['id'],
+            'geometry': {'type': 'Point', 'coordinates': coordinates},
+            'properties': {
+                'name': row['name'],
+                'description': row['description'],
+                'category': row['category'],
+                'taken': _timestamp(row),
+                'uploaded': row['upload_date'],
+                'url': detail,
+                'thumbnail': thumbnail,
+            },
+        }
+        yield (',' if n else '') + json.dumps(feature, ensure_ascii=False, separators=(',', ':'))
+    yield ']}\n'
+
+
+def _gpx(rows, base_url):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="MEN IN DRECK" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for row in rows:
+        detail, _thumbnail = _links(row, base_url)
+        parts = [f'<wpt lat="{row["latitude"]}" lon="{row["longitude"]}">']
+        if row['altitude'] is not None:
+            parts.append(f"<ele>{row['altitude']}</ele>")
+        taken = _timestamp(row)
+        if taken:
+            parts.append(f"<time>{taken}</time>")
+        parts.append(f"<name>{escape(row['name'] or '')}</name>")
+        if row['description']:
+            parts.append(f"<desc>{escape(row['description'])}</desc>")
+        parts.append(f"<link href={quoteattr(detail)}><text>Details</text></link>")
+        parts.append(f"<type>{escape(row['category'] or '')}</type>")
+        yield ''.join(parts) + '</wpt>\n'
+    yield '</gpx>\n'
+
+
+def _kml(rows, base_url):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>MEN IN DRECK</name>\n')
+    for row in rows:
+        detail, thumbnail = _links(row, base_url)
+        description = (f'<img src="{escape(thumbnail)}" width="200"/><p>{escape(row["description"] or "")}</p>'
+                       f'<a href="{escape(detail)}">Details</a>')
+        coordinates = f"{row['longitude']},{row['latitude']}"
+        if row['altitude'] is not None:
+            coordinates += f",{row['altitude']}"
+        yield (f"<Placemark id=\"spot-{row['id']}\"><name>{escape(row['name'] or '')}</name>"
+               f"<description><![CDATA[{description.replace(']]>', ']]]]><![CDATA[>')}]]></description>"
+               f"<ExtendedData><Data name=\"category\"><value>{escape(row['category'] or '')}</value></Data>"
+               f"</ExtendedData><Point><coordinates>{coordinates}</coordinates></Point></Placemark>\n")
+    yield '</Document></kml>\n'
+
+
+_WRITERS = {'geojson': _geojson, 'gpx': _gpx, 'kml': _kml}
+
+
+def generate(fmt, rows, base_url=''):
+    """
+    Serialisiert die Zeilen (z.B. aus query()) im gewünschten Format.
+
+    Yields:
+        bytes: UTF-8-Blöcke von etwa CHUNK_SIZE Bytes
+    """
+    return _chunked(_WRITERS[fmt](rows, base_url))
+
+
+def gzipped(chunks, level=6):
+    """Komprimiert einen Byte-Strom blockweise zu einem gzip-Strom."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Spots als GeoJSON, GPX oder KML exportieren (ohne laufenden Server).
+
+Gleiche Ausgabe wie /export/spots.<format>: gestreamt aus dem Cursor,
+daher konstanter Speicherbedarf auch bei sehr vielen Bildern. Ohne
+--output geht die Datei nach stdout. Links in der Datei zeigen auf
+--base-url (Standard: PUBLIC_BASE_URL).
+
+Start:  python export_spots.py gpx [--category Burg] [--bbox 9,47,13,50] [--date-from 2024-01-01]
+                               [--date-to 2024-12-31] [--gzip] [--output spots.gpx]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import db
+import export
+from app import ALLOWED_CATEGORIES, DB_PATH, _parse_bbox
+
+
+def _date(value):
+    datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+def _bbox(value):
+    bbox = _parse_bbox(value)
+    if bbox is None:
+        raise ValueError(value)
+    return bbox
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('format', choices=sorted(export.FORMATS))
+    parser.add_argument('--category', choices=ALLOWED_CATEGORIES)
+    parser.add_argument('--bbox', type=_bbox, help="west,süd,ost,nord")
+    parser.add_argument('--date-from', type=_date, help="Aufnahmedatum ab (YYYY-MM-DD)")
+    parser.add_argument('--date-to', type=_date, help="Aufnahmedatum bis (YYYY-MM-DD)")
+    parser.add_argument('--gzip', action='store_true', help="gzip-komprimiert schreiben")
+    parser.add_argument('--base-url', default=os.environ.get('PUBLIC_BASE_URL', ''),
+                        help="Basis für Links auf Detailseiten und Thumbnails")
+    parser.add_argument('--output', '-o', help="Zieldatei (Standard: stdout)")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(DB_PATH)
+    rows = export.query(conn, args.category, args.bbox, args.date_from, args.date_to)
+    chunks = export.generate(args.format, rows, args.base_url.rstrip('/'))
+    if args.gzip:
+        chunks = export.gzipped(chunks)
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+gunicorn-Konfiguration (wird von gunicorn automatisch aus dem Arbeitsverzeichnis geladen).
+
+Migriert beim Start einmal im Master die Datenbank (migrate.py), erzeugt
+die vorkomprimierten Static-Varianten (static_assets.py) und startet den Bildverarbeitungs-Worker (worker.py) als Begleitprozess, damit
+Uploads auch auf Plattformen verarbeitet werden, die nur einen Web-Prozess
+mit Volume erlauben. Mit IMAGE_WORKER=off lässt sich das abschalten, wenn
+der Worker separat läuft.
+
+Die App wird im Master vorab geladen (preload_app): der Import von app.py
+hat keine Seiteneffekte, Worker entstehen per fork() mit fertig geladenem
+Code und teilen sich dessen Speicher. GUNICORN_PRELOAD=0 schaltet das ab
+(z.B. wenn HUP auch neuen Code laden soll).
+"""
+import os
+import subprocess
+import sys
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+_worker = None
+
+
+def on_starting(server):
+    global _worker
+    _migrate(server)
+    _precompress_static(server)
+    if os.environ.get('IMAGE_WORKER', 'embedded').lower() == 'off':
+        return
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+    _worker = subprocess.Popen([sys.executable, worker_script])
+    server.log.info("Bild-Worker gestartet (pid %s)", _worker.pid)
+
+
+def _migrate(server):
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, root)
+    import migrate
+    migrate.migrate()
+    server.log.info("Datenbank migriert")
+
+
+def _precompress_static(server):
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, root)
+    try:
+        import static_assets
+        written = static_assets.build(os.path.join(root, 'static'))
+    except OSError as e:
+        # z.B. schreibgeschütztes Dateisystem: dann eben unkomprimiert
+        server.log.warning("Static-Dateien nicht vorkomprimiert: %s", e)
+    else:
+        if written:
+            server.log.info("%d vorkomprimierte Static-Dateien geschrieben", written)
+
+
+def on_exit(server):
+    if _worker and _worker.poll() is None:
+        _worker.terminate()
+        try:
+            _worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            _worker.kill()
@@ -0,0 +1,682 @@
+"""
+Bildverarbeitung: EXIF/GPS auslesen, HEIC konvertieren, Thumbnails und Derivate erzeugen.
+
+Das Modul hängt nicht von Flask ab, damit der Hintergrund-Worker (worker.py)
+es in seinen Pool-Prozessen verwenden kann. pillow_heif wird erst beim ersten
+Öffnen eines Bildes geladen (register_codecs), nicht schon beim Import.
+"""
+import base64
+import functools
+import hashlib
+import io
+import logging
+import os
+import resource
+import time
+
+from PIL import Image, ImageOps
+from PIL.ExifTags import TAGS, GPSTAGS
+
+logger = logging.getLogger(__name__)
+
+_codecs_registered = False
+
+
+def register_codecs():
+    """Meldet HEIF/HEIC bei Pillow an (einmal pro Prozess, beim ersten Bedarf)."""
+    global _codecs_registered
+    if not _codecs_registered:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        _codecs_registered = True
+
+
+def _avif_available():
+    """AVIF über pillow-avif-plugin oder (veraltet) pillow_heif, sonst nicht verfügbar."""
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        import pillow_heif
+        if hasattr(pillow_heif, 'register_avif_opener'):
+            try:
+                pillow_heif.register_avif_opener()
+            except Exception:
+                pass
+    return 'AVIF' in Image.SAVE
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders():
+    """Formate aus DERIVATIVE_ENCODERS, die Pillow in diesem Prozess schreiben kann (einmal ermittelt)."""
+    Image.init()
+    formats = []
+    for fmt in DERIVATIVE_ENCODERS:
+        if fmt == 'avif' and not _avif_available():
+            continue
+        if fmt == 'webp' and 'WEBP' not in Image.SAVE:
+            continue
+        formats.append(fmt)
+    return tuple(formats)
+
+
+@functools.lru_cache(maxsize=None)
+def supported_derivative_formats():
+    """Konfigurierte Formate, die der Encoder tatsächlich kann (JPEG immer zuletzt, einmal ermittelt)."""
+    formats = []
+    for fmt in DERIVATIVE_FORMATS:
+        if fmt == 'jpeg' or fmt not in DERIVATIVE_ENCODERS:
+            continue
+        if fmt not in available_encoders():
+            logger.warning("%s-Encoder nicht verfügbar, Format wird übersprungen", fmt.upper())
+            continue
+        formats.append(fmt)
+    formats.append('jpeg')
+    return tuple(formats)
+
+ALLOWED_EXTENSIONS = ["jpg", "jpeg", "png", "gif", "heic", "heif", "webp"]
+HEIF_EXTENSIONS = ["heic", "heif"]
+
+# Fallback-Koordinaten (Mitte Deutschlands), wenn das Bild keine GPS-Daten hat
+DEFAULT_LAT = 51.1657
+DEFAULT_LON = 10.4515
+
+# --- Derivate (responsive Größen) ---
+# Breitenstufen und Formate lassen sich per Umgebungsvariable anpassen, z.B.
+# DERIVATIVE_WIDTHS="160,400,800,1600" DERIVATIVE_FORMATS="avif,webp,jpeg".
+# JPEG wird immer erzeugt, weil es als <img>-Fallback dient.
+DERIVATIVE_WIDTHS = tuple(sorted(
+    int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '160,400,800,1600').split(',') if w.strip()
+))
+DERIVATIVE_FORMATS = tuple(
+    f.strip().lower() for f in os.environ.get('DERIVATIVE_FORMATS', 'webp,jpeg').split(',') if f.strip()
+)
+THUMBNAIL_WIDTH = 400   # Derivat, das als thumbnail_path (Karte, Sidebar) eingetragen wird
+
+# Platzhalter (LQIP): so klein, dass er als data:-URI in jede JSON-Antwort passt (~100 Bytes)
+LQIP_SIZE = 16
+
+# Schutz vor Dekompressionsbomben: größere Bilder werden vor dem Dekodieren abgelehnt
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Format → (Pillow-Formatname, Dateiendung, MIME-Typ, Speicheroptionen)
+DERIVATIVE_ENCODERS = {
+    'avif': ('AVIF', 'avif', 'image/avif', {'quality': 55}),
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+# --- EXIF Hilfsfunktionen ---
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+
+def get_exif_data(image):
+    """
+    Liest EXIF inkl. Exif- und GPS-IFD aus dem Header eines geöffneten Bildes.
+
+    Funktioniert für alle Formate mit EXIF (JPEG, HEIC, WebP, PNG), ohne die
+    Pixeldaten zu dekodieren.
+    """
+    exif = image.getexif()
+    exif_data = {TAGS.get(tag, tag): value for tag, value in exif.items() if tag not in (EXIF_IFD, GPS_IFD)}
+    for tag, value in exif.get_ifd(EXIF_IFD).items():
+        exif_data[TAGS.get(tag, tag)] = value
+    gps_info = exif.get_ifd(GPS_IFD)
+    if gps_info:
+        exif_data["GPSInfo"] = {GPSTAGS.get(t, t): value for t, value in gps_info.items()}
+    return exif_data
+
+
+def convert_to_degrees(value):
+    """Konvertiert EXIF GPS Werte in Dezimalgrad (robust für alle Formate)"""
+    def to_float(x):
+        if isinstance(x, tuple):
+            return x[0] / x[1]
+        return float(x)
+
+    d = to_float(value[0])
+    m = to_float(value[1])
+    s = to_float(value[2])
+
+    return d + (m / 60.0) + (s / 3600.0)
+
+
+def get_lat_lon(exif_data):
+    """Liest GPS Koordinaten robust und korrekt aus"""
+    if "GPSInfo" not in exif_data:
+        return None, None
+
+    gps_info = exif_data["GPSInfo"]
+
+    try:
+        lat = convert_to_degrees(gps_info["GPSLatitude"])
+        lon = convert_to_degrees(gps_info["GPSLongitude"])
+
+        lat_ref = gps_info["GPSLatitudeRef"]
+        lon_ref = gps_info["GPSLongitudeRef"]
+
+        # Bytestrings in Strings umwandeln
+        if isinstance(lat_ref, bytes):
+            lat_ref = lat_ref.decode()
+        if isinstance(lon_ref, bytes):
+            lon_ref = lon_ref.decode()
+
+        lat_ref = lat_ref.upper()
+        lon_ref = lon_ref.upper()
+
+        # Süd und West sind negativ
+        if lat_ref == "S":
+            lat = -lat
+        if lon_ref == "W":
+            lon = -lon
+
+        return lat, lon
+
+    except Exception:
+        return None, None
+
+
+def create_thumbnail(source_path, thumbnail_path, size=(400, 400)):
+    """
+    Erstellt ein Thumbnail für ein Bild.
+    
+    Args:
+        source_path: Pfad zum Originalbild
+        thumbnail_path: Pfad wo das Thumbnail gespeichert werden soll
+        size: Maximale Größe als Tuple (Breite, Höhe)
+    
+    Returns:
+        bool: True bei Erfolg, False bei Fehler
+    """
+    register_codecs()
+    try:
+        with Image.open(source_path) as img:
+            # Korrigiere Orientierung basierend auf EXIF
+            img = ImageOps.exif_transpose(img)
+            
+            # Erstelle Thumbnail (behält Seitenverhältnis bei)
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            
+            # Speichere als JPEG (auch wenn Original PNG/WebP war)
+            img.convert('RGB').save(thumbnail_path, 'JPEG', quality=85, optimize=True)
+            
+        return True
+    except Exception as e:
+        logger.error(f"Fehler beim Erstellen des Thumbnails für {source_path}: {e}")
+        return False
+
+
+def _prepare_for_encoding(img):
+    """Bringt ein dekodiertes Bild in einen Modus, den alle Derivat-Encoder können."""
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    return img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+
+
+def derive_from_image(img, target_folder, base_name, widths=None, formats=None):
+    """
+    Erzeugt die Größenstufen aus einem bereits dekodierten (und gedrehten) Bild.
+
+    Jede Stufe wird aus der nächstgrößeren verkleinert. Stufen breiter als das
+    Bild entfallen, die kleinste wird immer erzeugt (notfalls in Bildbreite).
+
+    Returns:
+        list: Dicts mit width, height, format, path (Dateiname) und bytes
+    """
+    widths = sorted(widths or DERIVATIVE_WIDTHS, reverse=True)
+    formats = formats or supported_derivative_formats()
+    os.makedirs(target_folder, exist_ok=True)
+
+    derivatives = []
+    current = _prepare_for_encoding(img)
+    targets = [w for w in widths if w < img.width] or [min(widths[-1], img.width)]
+    for width in targets:
+        height = max(1, round(current.height * width / current.width))
+        if width != current.width:
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+
+        for fmt in formats:
+            pil_format, ext, _mime, options = DERIVATIVE_ENCODERS[fmt]
+            out = current.convert('RGB') if pil_format == 'JPEG' and current.mode != 'RGB' else current
+            filename = f"{base_name}_{width}.{ext}"
+            path = os.path.join(target_folder, filename)
+            out.save(path, pil_format, **options)
+            derivatives.append({
+                'width': width,
+                'height': current.height,
+                'format': fmt,
+                'path': filename,
+                'bytes': os.path.getsize(path),
+            })
+    return derivatives
+
+
+def create_derivatives(source_path, target_folder, base_name, widths=None, formats=None):
+    """
+    Erzeugt die Größenstufen einer Bilddatei in allen konfigurierten Formaten.
+
+    Das Original wird nur einmal dekodiert, bei JPEG per draft() bereits
+    verkleinert auf die größte benötigte Stufe (siehe derive_from_image).
+    """
+    widths = widths or DERIVATIVE_WIDTHS
+    with open_checked(source_path) as img:
+        _draft_for_width(img, max(widths))
+        return derive_from_image(ImageOps.exif_transpose(img), target_folder, base_name, widths, formats)
+
+
+def pick_thumbnail(derivatives, width=THUMBNAIL_WIDTH):
+    """JPEG-Derivat, das am besten als Thumbnail passt (kleinste Stufe >= width)."""
+    jpegs = sorted((d for d in derivatives if d['format'] == 'jpeg'), key=lambda d: d['width'])
+    if not jpegs:
+        return None
+    for d in jpegs:
+        if d['width'] >= width:
+            return d['path']
+    return jpegs[-1]['path']
+
+
+# --- Dekodieren mit Größenbegrenzung ---
+class ImageTooLargeError(ValueError):
+    """Das Bild überschreitet MAX_IMAGE_PIXELS (Schutz vor Dekompressionsbomben)."""
+
+
+def open_checked(path):
+    """
+    Öffnet ein Bild (liest nur den Header) und prüft die Pixelzahl, bevor
+    irgendetwas dekodiert wird.
+    """
+    register_codecs()
+    img = Image.open(path)
+    if img.width * img.height > MAX_IMAGE_PIXELS:
+        size = img.size
+        img.close()
+        raise ImageTooLargeError(f"Bild zu groß: {size[0]}×{size[1]} Pixel (max. {MAX_IMAGE_PIXELS})")
+    return img
+
+
+# EXIF-Orientierungen, bei denen Breite und Höhe vertauscht sind
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def _draft_for_width(img, width):
+    """
+    Reduce-on-load für JPEG: dekodiert per DCT-Skalierung direkt in 1/2, 1/4
+    oder 1/8 der Größe, solange das Ergebnis mindestens `width` breit bleibt
+    (Breite nach EXIF-Drehung). Andere Formate bleiben unverändert.
+
+    Returns:
+        tuple: (Breite, Höhe) des gedrehten Originals
+    """
+    orientation = img.getexif().get(0x0112, 1)
+    raw_w, raw_h = img.size
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        raw_w, raw_h = raw_h, raw_w
+    if img.format == 'JPEG' and width < raw_w:
+        height = max(1, round(raw_h * width / raw_w))
+        # draft() erwartet die Zielgröße in der Orientierung der Rohdaten
+        draft_size = (height, width) if orientation in _TRANSPOSED_ORIENTATIONS else (width, height)
+        img.draft('RGB', draft_size)
+    return raw_w, raw_h
+
+
+def render_resized(source_path, dest_path, width, fmt):
+    """
+    Rendert eine einzelne Größe eines Originals (für den On-Demand-Endpunkt).
+
+    Bei JPEG wird per Image.draft() bereits beim Dekodieren um 1/2, 1/4 oder 1/8
+    verkleinert, große Originale werden also nie voll dekodiert. Hochskaliert
+    wird nicht: ist das Original schmaler, wird es in Originalbreite geliefert.
+
+    Returns:
+        tuple: (Breite, Höhe) der erzeugten Datei
+    """
+    pil_format, _ext, _mime, options = DERIVATIVE_ENCODERS[fmt]
+    with open_checked(source_path) as img:
+        raw_w, raw_h = _draft_for_width(img, width)
+        width = min(width, raw_w)
+        height = max(1, round(raw_h * width / raw_w))
+
+        img = ImageOps.exif_transpose(img)
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+        img = _prepare_for_encoding(img)
+        if pil_format == 'JPEG' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(dest_path, pil_format, **options)
+    return width, height
+
+
+# --- Speicherverbrauch messen ---
+def reset_peak_rss():
+    """Setzt den Spitzenwert des RSS dieses Prozesses zurück (Linux, sonst No-op)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    """Spitzen-RSS des Prozesses seit dem letzten reset_peak_rss() in KB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def limit_memory(limit_mb):
+    """
+    Begrenzt den Adressraum des aktuellen Prozesses (für Pool-Prozesse).
+    Ein ausuferndes Dekodieren endet dann mit MemoryError statt mit dem OOM-Killer.
+    """
+    if limit_mb:
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _parse_exif_datetime(exif_data):
+    """DateTimeOriginal ("2023:08:15 14:32:10") → ("2023-08-15", "14:32:10")"""
+    dt = exif_data.get("DateTimeOriginal")
+    if not dt:
+        return None, None
+    try:
+        exif_date, exif_time = dt.split(" ")
+        return exif_date.replace(":", "-"), exif_time  # schöneres Format
+    except Exception as e:
+        logger.warning(f"Fehler beim Parsen des EXIF-Datums: {e}")
+        return None, None
+
+
+def _exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return str(value).strip('\x00 ').strip() if value is not None else ''
+
+
+def image_metadata(img, exif_data):
+    """
+    Abmessungen und wichtige EXIF-Felder aus dem Header eines geöffneten Bildes.
+
+    width/height sind die angezeigten Maße, also bei EXIF-Ausrichtung 5–8
+    (hochkant gespeichert) vertauscht.
+
+    Returns:
+        dict: width, height, orientation, altitude (Meter, None ohne GPS-Höhe),
+              camera, lens (None, wenn unbekannt)
+    """
+    orientation = exif_data.get('Orientation')
+    if not isinstance(orientation, int) or not 1 <= orientation <= 8:
+        orientation = 1
+    width, height = img.size
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+
+    altitude = None
+    gps_info = exif_data.get('GPSInfo') or {}
+    if 'GPSAltitude' in gps_info:
+        try:
+            altitude = round(float(gps_info['GPSAltitude']), 1)
+            ref = gps_info.get('GPSAltitudeRef', 0)
+            if ref in (1, b'\x01'):
+                altitude = -altitude
+        except (TypeError, ValueError, ZeroDivisionError):
+            altitude = None
+
+    make, model = _exif_text(exif_data.get('Make')), _exif_text(exif_data.get('Model'))
+    camera = model if model.lower().startswith(make.lower()) else f"{make} {model}".strip()
+    lens = _exif_text(exif_data.get('LensModel'))
+    lens_make = _exif_text(exif_data.get('LensMake'))
+    if lens and lens_make and not lens.lower().startswith(lens_make.lower()):
+        lens = f"{lens_make} {lens}"
+
+    return {
+        'width': width,
+        'height': height,
+        'orientation': orientation,
+        'altitude': altitude,
+        'camera': camera or None,
+        'lens': lens or None,
+    }
+
+
+def lqip(img, size=LQIP_SIZE):
+    """Winziges Vorschaubild als data:-URI, das der Browser bis zum Laden des echten Bildes zeigt."""
+    small = img.copy()
+    small.thumbnail((size, size), Image.Resampling.BOX, reducing_gap=2.0)
+    if small.mode != 'RGB':
+        small = small.convert('RGB')
+    buf = io.BytesIO()
+    small.save(buf, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def dhash(img, size=8):
+    """
+    Perzeptueller Differenz-Hash (64 Bit): Helligkeitsgefälle benachbarter Pixel
+    eines auf 9×8 verkleinerten Graustufenbildes. Neu kodierte oder skalierte
+    Kopien desselben Fotos unterscheiden sich nur in wenigen Bits.
+
+    Returns:
+        int: Hash als vorzeichenbehaftete 64-Bit-Zahl (passt in eine SQLite-INTEGER-Spalte)
+    """
+    small = img.convert('L').resize((size + 1, size), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming_distance(a, b):
+    """Anzahl unterschiedlicher Bits zweier dhash-Werte."""
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def dhash_file(path):
+    """dhash einer Bilddatei; JPEGs werden dafür nur stark verkleinert dekodiert."""
+    with open_checked(path) as img:
+        _draft_for_width(img, 64)
+        return dhash(ImageOps.exif_transpose(img))
+
+
+def file_sha256(path):
+    """SHA-256 einer Datei als Hex-String (blockweise gelesen)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def inspect_image(path):
+    """
+    Schnelle Vorprüfung eines gespeicherten Originals, ohne Pixel zu dekodieren:
+    Format erkennbar, Pixelgrenze eingehalten, GPS und Aufnahmezeit aus dem Header.
+
+    Returns:
+        dict: latitude, longitude (None ohne GPS), exif_date, exif_time
+
+    Raises:
+        PIL.UnidentifiedImageError: kein lesbares Bild
+        ImageTooLargeError: mehr als MAX_IMAGE_PIXELS
+    """
+    with open_checked(path) as img:
+        try:
+            exif_data = get_exif_data(img)
+        except Exception as e:
+            logger.warning(f"EXIF von {path} nicht lesbar: {e}")
+            exif_data = {}
+    lat, lon = get_lat_lon(exif_data)
+    exif_date, exif_time = _parse_exif_datetime(exif_data)
+    return {'latitude': lat, 'longitude': lon, 'exif_date': exif_date, 'exif_time': exif_time}
+
+
+def read_metadata(path):
+    """
+    image_metadata und lqip für ein gespeichertes Original (Nachtragen im Bestand).
+
+    JPEGs werden für den Platzhalter nur stark verkleinert dekodiert.
+    """
+    with open_checked(path) as img:
+        try:
+            exif_data = get_exif_data(img)
+        except Exception as e:
+            logger.warning(f"EXIF von {path} nicht lesbar: {e}")
+            exif_data = {}
+        meta = image_metadata(img, exif_data)
+        _draft_for_width(img, 64)
+        meta['lqip'] = lqip(ImageOps.exif_transpose(img))
+    return meta
+
+
+def process_upload(filename, upload_folder, thumbnail_folder):
+    """
+    Verarbeitet ein gespeichertes Original in einem Durchgang.
+
+    EXIF/GPS kommen direkt aus dem Header, die Pixel werden genau einmal
+    dekodiert (JPEG per draft() nur so groß wie die größte Derivat-Stufe)
+    und alle Ausgaben aus diesem einen Dekodat erzeugt. HEIC/HEIF wird dabei
+    als JPEG-Original abgelegt.
+
+    Args:
+        filename: Dateiname des Originals in upload_folder
+        upload_folder: Verzeichnis der Originale
+        thumbnail_folder: Zielverzeichnis für Thumbnails
+
+    Returns:
+        dict: filepath, thumbnail_path, derivatives, latitude, longitude,
+              exif_date, exif_time, phash, die Felder aus image_metadata, lqip,
+              peak_rss_kb und timings
+              (Sekunden je Schritt: exif, heic_decode bzw. decode, phash, lqip, derivatives)
+    """
+    reset_peak_rss()
+    timings = {}
+    started = time.perf_counter()
+    path = os.path.join(upload_folder, filename)
+    ext = filename.rsplit('.', 1)[-1].lower()
+    base_name = os.path.splitext(filename)[0]
+
+    with open_checked(path) as img:
+        # --- EXIF aus dem Header (ohne zu dekodieren) ---
+        try:
+            exif_data = get_exif_data(img)
+        except Exception as e:
+            logger.warning(f"EXIF von {filename} nicht lesbar: {e}")
+            exif_data = {}
+        lat, lon = get_lat_lon(exif_data)
+        exif_date, exif_time = _parse_exif_datetime(exif_data)
+        meta = image_metadata(img, exif_data)
+        started = _lap(timings, 'exif', started)
+
+        # --- Einmal dekodieren ---
+        if ext in HEIF_EXTENSIONS:
+            # HEIC/HEIF wird in voller Größe gebraucht, weil es als JPEG-Original abgelegt wird
+            exif_bytes = img.info.get("exif")
+            decoded = ImageOps.exif_transpose(img).convert('RGB')
+
+            jpg_filename = base_name + ".jpg"
+            jpg_path = os.path.join(upload_folder, jpg_filename)
+            if exif_bytes:
+                decoded.save(jpg_path, "JPEG", quality=95, exif=exif_bytes)
+            else:
+                decoded.save(jpg_path, "JPEG", quality=95)
+            started = _lap(timings, 'heic_decode', started)
+        else:
+            _draft_for_width(img, max(DERIVATIVE_WIDTHS))
+            decoded = ImageOps.exif_transpose(img)
+            decoded.load()
+            started = _lap(timings, 'decode', started)
+
+    if ext in HEIF_EXTENSIONS:
+        # Das rohe HEIC wird nach erfolgreicher Konvertierung nicht mehr gebraucht
+        os.remove(path)
+        filename = jpg_filename
+
+    # Fallback Koordinaten
+    if lat is None:
+        lat = DEFAULT_LAT
+    if lon is None:
+        lon = DEFAULT_LON
+
+    try:
+        phash = dhash(decoded)
+    except Exception as e:
+        logger.warning(f"Perzeptueller Hash für {filename} fehlgeschlagen: {e}")
+        phash = None
+    started = _lap(timings, 'phash', started)
+
+    try:
+        meta['lqip'] = lqip(decoded)
+    except Exception as e:
+        logger.warning(f"Platzhalter für {filename} fehlgeschlagen: {e}")
+        meta['lqip'] = None
+    started = _lap(timings, 'lqip', started)
+
+    # --- Derivate aus dem Dekodat (Thumbnail = JPEG-Stufe um THUMBNAIL_WIDTH) ---
+    try:
+        derivatives = derive_from_image(decoded, thumbnail_folder, base_name)
+    except Exception as e:
+        logger.error(f"Fehler beim Erstellen der Derivate für {filename}: {e}")
+        derivatives = []
+    _lap(timings, 'derivatives', started)
+
+    return {
+        'filepath': filename,
+        'thumbnail_path': pick_thumbnail(derivatives),
+        'derivatives': derivatives,
+        'latitude': lat,
+        'longitude': lon,
+        'exif_date': exif_date,
+        'exif_time': exif_time,
+        'phash': phash,
+        **meta,
+        'peak_rss_kb': peak_rss_kb(),
+        'timings': timings,
+    }
+
+
+def process_stored(filename, originals, derivatives):
+    """
+    process_upload für ein Original in einer Ablage (storage.py).
+
+    Gerechnet wird in einem Arbeitsverzeichnis der Derivat-Ablage, das
+    Original wird dorthin verlinkt bzw. heruntergeladen. Danach werden die
+    Derivate und ein aus HEIC erzeugtes JPEG-Original in die Ablagen übernommen
+    (lokal per rename) und das rohe HEIC entfernt.
+    """
+    with derivatives.tempdir() as work:
+        originals.fetch(filename, os.path.join(work, filename))
+        result = process_upload(filename, work, work)
+        _publish(derivatives, work, result['derivatives'])
+        if result['filepath'] != filename:
+            originals.put_file(result['filepath'], os.path.join(work, result['filepath']), move=True)
+            originals.delete(filename)
+    return result
+
+
+def derive_stored(filename, originals, derivatives, base_name):
+    """create_derivatives für ein Original in einer Ablage; Ergebnis wie create_derivatives."""
+    with originals.local_path(filename) as source, derivatives.tempdir() as work:
+        result = create_derivatives(source, work, base_name)
+        _publish(derivatives, work, result)
+    return result
+
+
+def _publish(store, work, derivatives):
+    for d in derivatives:
+        store.put_file(d['path'], os.path.join(work, d['path']), move=True)
+
+
+def _lap(timings, stage, started):
+    """Trägt die Zeit seit `started` für `stage` ein und gibt den neuen Startpunkt zurück."""
+    now = time.perf_counter()
+    timings[stage] = now - started
+    return now
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+Massenimport vorhandener Fotoverzeichnisse.
+
+Durchsucht ein Verzeichnis rekursiv nach Bildern, verarbeitet sie parallel
+im Prozess-Pool (gleiche Pipeline wie der Upload: EXIF/GPS, HEIC-Konvertierung,
+Derivate) und schreibt die Zeilen gebündelt in die Datenbank.
+
+Der Fortschritt steht in einer Manifest-Datei (SQLite). Ein abgebrochener
+Import setzt beim nächsten Aufruf dort fort, wo er aufgehört hat; Dateien,
+deren Inhalt schon in der Datenbank liegt (content_hash), werden übersprungen.
+
+Start:  python import_photos.py <verzeichnis> --category Fels [--processes N]
+"""
+import argparse
+import logging
+import os
+import signal
+import sqlite3
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from PIL import UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+import db
+import metrics
+from app import ALLOWED_CATEGORIES, DB_PATH, METRICS_PATH, derivative_store, original_store
+from db import transaction
+from dedupe import find_near_duplicates
+from imaging import (ALLOWED_EXTENSIONS, ImageTooLargeError, file_sha256, inspect_image, limit_memory,
+                     process_stored)
+from worker import DEFAULT_PROCESSES, MEMORY_LIMIT_MB
+
+logger = logging.getLogger("import")
+
+DEFAULT_BATCH_SIZE = 200        # Zeilen pro Transaktion
+DEFAULT_MANIFEST = 'import-manifest.db'
+REPORT_INTERVAL = 10.0          # Sekunden zwischen zwei Fortschrittsmeldungen
+IN_FLIGHT_PER_PROCESS = 4       # so viele Aufträge pro Prozess gleichzeitig einreichen
+
+# Im Pool-Prozess: Hashes, die beim Start schon in der Datenbank lagen
+_known_hashes = frozenset()
+
+
+# --- Manifest (Checkpoint) ---
+def open_manifest(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS files (
+      path TEXT PRIMARY KEY,
+      size INTEGER NOT NULL,
+      mtime REAL NOT NULL,
+      status TEXT NOT NULL,
+      image_id INTEGER,
+      message TEXT
+    )
+    """)
+    return conn
+
+
+def pending_files(root, manifest, require_gps=False):
+    """Bilddateien unter root, die laut Manifest noch nicht (unverändert) erledigt sind."""
+    # Fehlgeschlagene Dateien werden beim nächsten Lauf erneut versucht, wegen fehlendem
+    # GPS übersprungene, sobald ohne --require-gps importiert wird
+    retry = ('error',) if require_gps else ('error', 'skipped')
+    done = {row[0]: (row[1], row[2])
+            for row in manifest.execute(f"SELECT path, size, mtime FROM files "
+                                        f"WHERE status NOT IN ({', '.join('?' * len(retry))})", retry)}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.rsplit('.', 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            stat = os.stat(path)
+            if done.get(rel) == (stat.st_size, stat.st_mtime):
+                continue
+            yield rel, path, stat.st_size, stat.st_mtime
+
+
+# --- Pool-Prozess ---
+def _init_pool(memory_limit_mb, known_hashes):
+    global _known_hashes
+    # Strg+C geht an die ganze Prozessgruppe; abbrechen entscheidet nur der Hauptprozess
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    limit_memory(memory_limit_mb)
+    _known_hashes = known_hashes
+
+
+def import_one(source, require_gps):
+    """
+    Läuft im Pool-Prozess; darf die Datenbank nicht anfassen.
+
+    Returns:
+        dict mit status ('ok', 'missing_gps', 'duplicate', 'skipped', 'error') und
+        bei Erfolg dem Ergebnis von process_upload plus content_hash
+    """
+    content_hash = file_sha256(source)
+    if content_hash in _known_hashes:
+        return {'status': 'duplicate', 'content_hash': content_hash}
+    try:
+        info = inspect_image(source)
+    except (UnidentifiedImageError, ImageTooLargeError) as e:
+        return {'status': 'error', 'message': str(e)}
+    missing_gps = info['latitude'] is None or info['longitude'] is None
+    if missing_gps and require_gps:
+        return {'status': 'skipped', 'message': "kein GPS"}
+
+    name, ext = os.path.splitext(os.path.basename(source))
+    filename = f"{uuid.uuid4().hex}_{secure_filename(name) or 'image'}{ext.lower()}"
+    original_store.put_file(filename, source)
+    try:
+        result = process_stored(filename, original_store, derivative_store)
+    except Exception:
+        original_store.delete(filename)
+        raise
+    result.update(status='missing_gps' if missing_gps else 'ok', content_hash=content_hash, name=name)
+    return result
+
+
+def _discard_outputs(result):
+    original_store.delete(result['filepath'])
+    for d in result['derivatives']:
+        derivative_store.delete(d['path'])
+
+
+# --- Hauptprozess ---
+class Importer:
+    """Sammelt Ergebnisse und schreibt sie in Bündeln in Datenbank und Manifest."""
+
+    def __init__(self, conn, manifest, category, batch_size):
+        self.conn = conn
+        self.manifest = manifest
+        self.category = category
+        self.batch_size = batch_size
+        self.batch = []
+        self.counts = {}
+        self.seen_hashes = set()
+
+    def add(self, rel, size, mtime, result):
+        self.batch.append((rel, size, mtime, result))
+        for stage, seconds in result.get('timings', {}).items():
+            metrics.record_stage(stage, seconds)
+        self.counts[result['status']] = self.counts.get(result['status'], 0) + 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        now = datetime.now()
+        upload_date, upload_time = now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
+        entries = []
+        with transaction(self.conn):
+            for rel, size, mtime, result in self.batch:
+                image_id = None
+                if result['status'] in ('ok', 'missing_gps'):
+                    image_id = self._insert(result, upload_date, upload_time)
+                    if image_id is None:
+                        # gleicher Inhalt in diesem Lauf schon importiert
+                        self.counts[result['status']] -= 1
+                        self.counts['duplicate'] = self.counts.get('duplicate', 0) + 1
+                        result = {'status': 'duplicate'}
+                entries.append((rel, size, mtime, result['status'], image_id, result.get('message')))
+        # Manifest erst nach dem Commit: bricht der Import dazwischen ab, erkennt der
+        # nächste Lauf die Dateien über content_hash als bereits importiert
+        self.manifest.execute("BEGIN")
+        self.manifest.executemany(
+            "INSERT OR REPLACE INTO files (path, size, mtime, status, image_id, message) VALUES (?, ?, ?, ?, ?, ?)",
+            entries,
+        )
+        self.manifest.execute("COMMIT")
+        self.batch = []
+
+    def _insert(self, result, upload_date, upload_time):
+        if result['content_hash'] in self.seen_hashes or self.conn.execute(
+                "SELECT 1 FROM images WHERE content_hash = ?", (result['content_hash'],)).fetchone():
+            _discard_outputs(result)
+            return None
+        self.seen_hashes.add(result['content_hash'])
+        near = find_near_duplicates(self.conn, result['phash']) if result['phash'] is not None else []
+        cur = self.conn.execute("""
+            INSERT INTO images
+            (name, description, category, filepath, thumbnail_path, latitude, longitude,
+             upload_date, upload_time, exif_date, exif_time, status, content_hash, phash, near_duplicate_of,
+             width, height, orientation, altitude, camera, lens, lqip)
+            VALUES (?, '', ?, ?, ?, ?, ?, ?, ?, ?, ?, 'ready', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (result['name'], self.category, result['filepath'], result['thumbnail_path'],
+              result['latitude'], result['longitude'], upload_date, upload_time,
+              result['exif_date'], result['exif_time'], result['content_hash'], result['phash'],
+              near[0][1] if near else None, result['width'], result['height'], result['orientation'],
+              result['altitude'], result['camera'], result['lens'], result['lqip']))
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO derivatives (image_id, format, width, height, path, bytes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(cur.lastrowid, d['format'], d['width'], d['height'], d['path'], d['bytes'])
+              for d in result['derivatives']])
+        return cur.lastrowid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory', help="Verzeichnis mit Fotos (wird rekursiv durchsucht)")
+    parser.add_argument('--category', required=True, choices=ALLOWED_CATEGORIES,
+                        help="Kategorie für alle importierten Bilder")
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES,
+                        help="Anzahl paralleler Verarbeitungsprozesse")
+    parser.add_argument('--memory-limit-mb', type=int, default=MEMORY_LIMIT_MB,
+                        help="Adressraum-Limit pro Verarbeitungsprozess (0 = aus)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Zeilen pro Datenbank-Transaktion")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help="Checkpoint-Datei für die Wiederaufnahme")
+    parser.add_argument('--require-gps', action='store_true',
+                        help="Bilder ohne GPS-Koordinaten überspringen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [import] %(message)s")
+    root = os.path.abspath(args.directory)
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            logger.info("Abbruch angefordert, laufende Bilder werden noch fertig verarbeitet …")
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    metrics.install(METRICS_PATH, 'import')
+    conn = db.connect(DB_PATH)
+    manifest = open_manifest(args.manifest)
+    known_hashes = frozenset(
+        row[0] for row in conn.execute("SELECT content_hash FROM images WHERE content_hash IS NOT NULL")
+    )
+    importer = Importer(conn, manifest, args.category, args.batch_size)
+
+    todo = pending_files(root, manifest, args.require_gps)
+    in_flight = {}
+    processed = 0
+    started = last_report = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=args.processes, initializer=_init_pool,
+                             initargs=(args.memory_limit_mb, known_hashes)) as pool:
+        logger.info("Import aus %s gestartet (%d Prozesse)", root, args.processes)
+        while True:
+            while not stopping and len(in_flight) < args.processes * IN_FLIGHT_PER_PROCESS:
+                item = next(todo, None)
+                if item is None:
+                    break
+                rel, path, size, mtime = item
+                in_flight[pool.submit(import_one, path, args.require_gps)] = (rel, size, mtime)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel, size, mtime = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning("%s: %s", rel, e)
+                    result = {'status': 'error', 'message': str(e)[:2000]}
+                importer.add(rel, size, mtime, result)
+                processed += 1
+
+            now = time.monotonic()
+            if now - last_report >= REPORT_INTERVAL:
+                last_report = now
+                logger.info("%d Dateien, %.1f Bilder/s, %s", processed, processed / (now - started),
+                            _format_counts(importer.counts))
+
+    importer.flush()
+    elapsed = time.monotonic() - started
+    conn.close()
+    manifest.close()
+    logger.info("%s: %d Dateien in %.1f s (%.1f Bilder/s), %s",
+                "Abgebrochen" if stopping else "Fertig", processed, elapsed,
+                processed / elapsed if elapsed else 0.0, _format_counts(importer.counts))
+
+
+def _format_counts(counts):
+    return ", ".join(f"{status} {n}" for status, n in sorted(counts.items()) if n) or "noch nichts"
+
+
+if __name__ == '__main__':
+    main()
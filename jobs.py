@@ -0,0 +1,100 @@
+"""
+SQLite-basierte Job-Queue für die Hintergrundverarbeitung.
+
+Jobs liegen in der Tabelle `jobs` (angelegt von init_db) und überleben damit
+Neustarts. Der Web-Prozess legt Jobs mit enqueue() innerhalb seiner eigenen
+Transaktion an; worker.py holt sie mit claim() ab und meldet das Ergebnis
+mit complete() bzw. fail() zurück.
+"""
+import json
+
+from db import transaction
+
+MAX_ATTEMPTS = 3            # danach bleibt ein Job auf 'failed'
+HEARTBEAT_SECONDS = 30      # so oft meldet der Worker seine laufenden Jobs als lebendig
+STALE_AFTER_SECONDS = 120   # 'running'-Jobs ohne Lebenszeichen gelten danach als verwaist
+
+
+def enqueue(conn, kind, payload):
+    """Legt einen Job an (ohne eigene Transaktion) und gibt seine ID zurück."""
+    cur = conn.execute(
+        "INSERT INTO jobs (kind, payload) VALUES (?, ?)",
+        (kind, json.dumps(payload)),
+    )
+    return cur.lastrowid
+
+
+def claim(conn):
+    """
+    Reserviert den ältesten wartenden Job.
+
+    Returns:
+        dict mit id, kind, payload, attempts oder None, wenn nichts ansteht
+    """
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                            started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP, error = NULL
+            WHERE id = ?
+        """, (row['id'],))
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'payload': json.loads(row['payload']),
+        'attempts': row['attempts'] + 1,
+    }
+
+
+def complete(conn, job_id):
+    """Markiert einen Job als erledigt (ohne eigene Transaktion)."""
+    conn.execute(
+        "UPDATE jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (job_id,),
+    )
+
+
+def fail(conn, job_id, error, retry=True):
+    """
+    Meldet einen Fehlschlag (ohne eigene Transaktion).
+    Mit retry=False (dauerhafter Fehler) wird nicht erneut versucht.
+
+    Returns:
+        bool: True, wenn der Job endgültig gescheitert ist (keine Wiederholung mehr)
+    """
+    row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    final = not retry or row is None or row['attempts'] >= MAX_ATTEMPTS
+    conn.execute("""
+        UPDATE jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, ('failed' if final else 'queued', str(error)[:2000], job_id))
+    return final
+
+
+def heartbeat(conn, job_ids):
+    """Meldet laufende Jobs als lebendig, damit requeue_stale() sie nicht einem anderen Worker gibt."""
+    if not job_ids:
+        return
+    with transaction(conn):
+        conn.executemany("UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+                         [(job_id,) for job_id in job_ids])
+
+
+def requeue_stale(conn, older_than=STALE_AFTER_SECONDS):
+    """
+    Gibt Jobs frei, deren Worker abgestürzt ist: laufende Jobs ohne
+    Lebenszeichen seit `older_than` Sekunden. Jobs eines anderen, noch
+    lebenden Workers bleiben unberührt. Returns: Anzahl.
+    """
+    with transaction(conn):
+        cur = conn.execute("""
+            UPDATE jobs SET status = 'queued'
+            WHERE status = 'running'
+              AND COALESCE(heartbeat_at, started_at) < datetime('now', ?)
+        """, (f"-{int(older_than)} seconds",))
+    return cur.rowcount
+
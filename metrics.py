@@ -0,0 +1,268 @@
+"""
+Metriken im Prometheus-Textformat (/admin/metrics).
+
+Erfasst werden Latenz-Histogramme pro Route, die Zeiten der einzelnen
+Upload-/Verarbeitungsschritte (ingest_stage_seconds), Anzahl und Dauer der
+DB-Abfragen pro Request, die Wartezeit auf die SQLite-Schreibsperre und die
+ausgelieferten Bild-Bytes.
+
+Jeder Prozess (gunicorn-Worker, worker.py) zählt zunächst im Speicher und
+addiert seine Zuwächse alle FLUSH_INTERVAL Sekunden in eine gemeinsame
+SQLite-Datei; /admin/metrics liest die Summe über alle Prozesse. Werte
+anderer Prozesse sind dadurch bis zu FLUSH_INTERVAL alt.
+
+Mit SLOW_REQUEST_MS=<ms> werden langsamere Requests samt Aufschlüsselung
+(DB-Abfragen, Sperr-Wartezeit, Schritte) ins Log geschrieben.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+
+import db
+from db import transaction
+
+logger = logging.getLogger("metrics")
+
+FLUSH_INTERVAL = 10.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOCK_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# name → (Typ, Hilfetext, Buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Antwortzeit pro Route", LATENCY_BUCKETS),
+    'db_queries_per_request': ('histogram', "SQLite-Abfragen pro Request", QUERY_COUNT_BUCKETS),
+    'db_query_seconds_per_request': ('histogram', "Summe der Abfragedauer pro Request", LATENCY_BUCKETS),
+    'sqlite_lock_wait_seconds': ('histogram', "Wartezeit auf die Schreibsperre (BEGIN IMMEDIATE)", LOCK_BUCKETS),
+    'ingest_stage_seconds': ('histogram', "Dauer einzelner Upload-/Verarbeitungsschritte", STAGE_BUCKETS),
+    'ingest_jobs_total': ('counter', "Verarbeitete Bild-Jobs nach Ergebnis", None),
+    'ingest_pool_restarts_total': ('counter', "Neu aufgebaute Verarbeitungs-Pools (abgestürzter Prozess)", None),
+    'image_bytes_served_total': ('counter', "Ausgelieferte Bild-Bytes pro Route", None),
+}
+
+
+class _Request(threading.local):
+    active = False
+    muted = False
+
+
+_state = _Request()
+_lock = threading.Lock()
+_values = {}          # (name, labels, le) → Zuwachs seit dem letzten flush
+_path = None
+_role = None
+_schema_ready = False
+_last_flush = 0.0
+_slow_ms = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _add(name, labels, le, value):
+    key = (name, labels, le)
+    with _lock:
+        _values[key] = _values.get(key, 0.0) + value
+
+
+# --- Erfassen ---
+def observe(name, value, **labels):
+    """Trägt einen Messwert in das Histogramm `name` ein."""
+    if _path is None:
+        return
+    label_str = _labels(labels)
+    for bound in METRICS[name][2]:
+        if value <= bound:
+            _add(name + '_bucket', label_str, repr(float(bound)), 1)
+    _add(name + '_bucket', label_str, '+Inf', 1)
+    _add(name + '_sum', label_str, '', value)
+    _add(name + '_count', label_str, '', 1)
+
+
+def inc(name, value=1, **labels):
+    """Erhöht den Zähler `name`."""
+    if _path is None:
+        return
+    _add(name, _labels(labels), '', value)
+
+
+@contextmanager
+def stage(name):
+    """Misst einen Verarbeitungsschritt (Histogramm und Aufschlüsselung des laufenden Requests)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    observe('ingest_stage_seconds', seconds, stage=name)
+    if _state.active:
+        _state.stages.append((name, seconds))
+
+
+def _db_observer(kind, seconds):
+    if _state.muted:
+        return
+    if kind == 'lock_wait':
+        observe('sqlite_lock_wait_seconds', seconds, role=_role)
+        if _state.active:
+            _state.lock_wait += seconds
+    elif _state.active:
+        _state.queries += 1
+        _state.query_seconds += seconds
+
+
+# --- Einrichten ---
+def install(path, role):
+    """Aktiviert die Erfassung in diesem Prozess (role: 'web', 'worker', …)."""
+    global _path, _role
+    if _path is None:
+        atexit.register(flush)
+    _path = os.path.abspath(path)
+    _role = role
+    db.set_observer(_db_observer)
+
+
+def init_app(app, image_endpoints=()):
+    """Request-Hooks: Latenz, DB-Abfragen, Bild-Bytes und das Slow-Request-Log."""
+    global _slow_ms
+    install(app.config['METRICS_PATH'], 'web')
+    slow = os.environ.get('SLOW_REQUEST_MS')
+    _slow_ms = float(slow) if slow else None
+    image_endpoints = frozenset(image_endpoints)
+
+    @app.before_request
+    def _start_request():
+        _state.active = True
+        _state.start = time.perf_counter()
+        _state.queries = 0
+        _state.query_seconds = 0.0
+        _state.lock_wait = 0.0
+        _state.stages = []
+
+    @app.after_request
+    def _finish_request(resp):
+        if not _state.active:
+            return resp
+        _state.active = False
+        elapsed = time.perf_counter() - _state.start
+        endpoint = request.endpoint or 'unmatched'
+        observe('http_request_duration_seconds', elapsed,
+                endpoint=endpoint, method=request.method, status=resp.status_code)
+        observe('db_queries_per_request', _state.queries, endpoint=endpoint)
+        observe('db_query_seconds_per_request', _state.query_seconds, endpoint=endpoint)
+        if endpoint in image_endpoints and resp.content_length:
+            inc('image_bytes_served_total', resp.content_length, endpoint=endpoint)
+        if _slow_ms is not None and elapsed * 1000 >= _slow_ms:
+            stages = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in _state.stages)
+            app.logger.warning(
+                f"Langsamer Request {request.method} {request.path} → {resp.status_code}: "
+                f"{elapsed * 1000:.0f} ms, {_state.queries} DB-Abfragen {_state.query_seconds * 1000:.0f} ms, "
+                f"Sperre {_state.lock_wait * 1000:.0f} ms" + (f", Schritte: {stages}" if stages else "")
+            )
+        maybe_flush()
+        return resp
+
+
+# --- Gemeinsame Ablage ---
+def _conn():
+    global _schema_ready
+    conn = db.get_pool(_path).acquire()
+    if not _schema_ready:
+        conn.executescript("""
+        CREATE TABLE IF NOT EXISTS samples (
+          name TEXT NOT NULL,
+          labels TEXT NOT NULL,
+          le TEXT NOT NULL,
+          value REAL NOT NULL,
+          PRIMARY KEY (name, labels, le)
+        );
+        """)
+        _schema_ready = True
+    return conn
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Addiert die Zuwächse dieses Prozesses in die gemeinsame Datei."""
+    global _values, _last_flush
+    if _path is None:
+        return
+    with _lock:
+        pending, _values = _values, {}
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    _state.muted = True
+    conn = _conn()
+    try:
+        with transaction(conn):
+            conn.executemany("""
+                INSERT INTO samples (name, labels, le, value) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value
+            """, [(name, labels, le, value) for (name, labels, le), value in pending.items()])
+    except Exception as e:
+        # Metriken dürfen nie einen Request scheitern lassen; Zuwächse gehen dann verloren
+        logger.warning(f"Metriken nicht gespeichert: {e}")
+    finally:
+        db.get_pool(_path).release(conn)
+        _state.muted = False
+
+
+def render():
+    """Alle Metriken (Summe über alle Prozesse) im Prometheus-Textformat."""
+    flush()
+    _state.muted = True
+    conn = _conn()
+    try:
+        rows = conn.execute("SELECT name, labels, le, value FROM samples").fetchall()
+    finally:
+        db.get_pool(_path).release(conn)
+        _state.muted = False
+
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row['name'], []).append((row['labels'], row['le'], row['value']))
+
+    lines = []
+    for name, (kind, help_text, _buckets) in METRICS.items():
+        series = [(suffix, sample) for suffix in ('', '_bucket', '_sum', '_count')
+                  for sample in by_name.get(name + suffix, [])]
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        # Pro Label-Kombination: Buckets aufsteigend, dann _sum und _count
+        order = {'_bucket': 0, '_sum': 1, '_count': 2, '': 0}
+        series.sort(key=lambda s: (s[1][0], order[s[0]], _le_key(s[1][1])))
+        for suffix, (labels, le, value) in series:
+            all_labels = ','.join(part for part in (labels, f'le="{le}"' if le else '') if part)
+            lines.append(f"{name}{suffix}{{{all_labels}}} {_format(value)}" if all_labels
+                         else f"{name}{suffix} {_format(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _le_key(le):
+    return float('inf') if le in ('', '+Inf') else float(le)
+
+
+def _format(value):
+    return str(int(value)) if value == int(value) else repr(value)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Einmalige Einrichtung: Datenbankschema anlegen/migrieren und Admin-Benutzer sicherstellen.
+
+Läuft nicht mehr beim Import von app.py, damit gunicorn-Worker ohne
+Datenbankarbeit und ohne Passwort-Hashing starten und sich mehrere Worker
+nicht gegenseitig bei der Migration in die Quere kommen. Unter gunicorn
+ruft gunicorn.conf.py migrate() einmal im Master auf, bevor Worker
+gestartet werden; `python app.py` tut es ebenfalls selbst.
+
+Der Admin wird nur angelegt, wenn es ihn nicht gibt. Das Passwort wird nur
+mit --reset-admin-password bzw. RESET_ADMIN_PASSWORD=true zurückgesetzt.
+
+Start:  python migrate.py [--reset-admin-password]
+"""
+import argparse
+import logging
+import os
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import app, create_user, get_db, get_user_by_username, init_db
+from db import transaction
+
+logger = logging.getLogger("migrate")
+
+DEFAULT_ADMIN = ('admin', 'admin123')
+
+
+def ensure_admin(reset_password=False):
+    """
+    Legt den Standard-Admin an, falls er fehlt.
+
+    Returns:
+        str: 'created', 'reset' oder None (nichts zu tun)
+    """
+    username, password = DEFAULT_ADMIN
+    with app.app_context():
+        admin = get_user_by_username(username)
+        if admin is None:
+            create_user(username, password, 'admin')
+            return 'created'
+        if reset_password:
+            conn = get_db()
+            with transaction(conn):
+                conn.execute("UPDATE users SET password_hash = ?, role = 'admin' WHERE id = ?",
+                             (generate_password_hash(password), admin['id']))
+            return 'reset'
+    return None
+
+
+def migrate(reset_admin_password=None):
+    """Schema und Admin; idempotent, mehrfacher Aufruf schadet nicht."""
+    if reset_admin_password is None:
+        reset_admin_password = os.environ.get('RESET_ADMIN_PASSWORD', 'false').lower() == 'true'
+    started = time.perf_counter()
+    init_db()
+    admin = ensure_admin(reset_admin_password)
+    if admin:
+        app.logger.warning(f"Admin-Benutzer {'angelegt' if admin == 'created' else 'zurückgesetzt'}: "
+                           f"{DEFAULT_ADMIN[0]}/{DEFAULT_ADMIN[1]} – Passwort ändern!")
+    logger.info("Migration fertig (%.0f ms)", (time.perf_counter() - started) * 1000)
+    return admin
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reset-admin-password', action='store_true',
+                        help=f"Passwort des Admins auf {DEFAULT_ADMIN[1]!r} zurücksetzen")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [migrate] %(message)s")
+    migrate(args.reset_admin_password or None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Vorhandene Originale und Derivate in die aktuelle Ablage umziehen.
+
+Liest alles, was noch in der alten Ablage liegt (flaches Verzeichnis bzw.
+lokale Platte, wenn ORIGINALS_STORAGE/DERIVATIVES_STORAGE=s3 gesetzt ist),
+und verschiebt es in die neue (Hash-Verzeichnisse bzw. Bucket). Die
+Schlüssel in der Datenbank bleiben gleich.
+
+Die Anwendung läuft währenddessen weiter: storage.FallbackStorage liest aus
+beiden Ablagen, lokal wird per rename verschoben, nach S3 wird erst
+hochgeladen, die Größe geprüft und dann lokal gelöscht. Ein Abbruch schadet
+nicht, der nächste Lauf macht beim Rest weiter.
+
+Start:  python migrate_storage.py [--check] [--only originals|derivatives] [--rate 50]
+"""
+import argparse
+import logging
+import signal
+import time
+
+from app import derivative_store, original_store
+
+logger = logging.getLogger("migrate_storage")
+
+REPORT_INTERVAL = 10.0
+
+
+def migrate_store(label, store, rate=None, should_stop=lambda: False):
+    """
+    Zieht alle Dateien aus store.legacy nach store.primary um.
+
+    Returns:
+        tuple: (verschoben, Bytes, Fehler)
+    """
+    moved = moved_bytes = failed = 0
+    last_report = time.monotonic()
+    for key, size in list(store.pending()):
+        if should_stop():
+            break
+        started = time.monotonic()
+        try:
+            store.migrate(key)
+        except FileNotFoundError:
+            # inzwischen gelöscht oder von einem parallelen Lauf umgezogen
+            continue
+        except OSError as e:
+            logger.warning("%s: %s nicht umgezogen: %s", label, key, e)
+            failed += 1
+            continue
+        moved += 1
+        moved_bytes += size
+        if time.monotonic() - last_report >= REPORT_INTERVAL:
+            last_report = time.monotonic()
+            logger.info("%s: %d Dateien (%.1f MB) umgezogen …", label, moved, moved_bytes / 1024 / 1024)
+        if rate:
+            time.sleep(max(0.0, 1.0 / rate - (time.monotonic() - started)))
+    return moved, moved_bytes, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true', help="nur zählen, was noch umzuziehen ist")
+    parser.add_argument('--only', choices=('originals', 'derivatives'), help="nur eine der beiden Ablagen")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="höchstens so viele Dateien pro Sekunde (schont Platte bzw. Bandbreite)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [migrate_storage] %(message)s")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    stores = [('originals', original_store), ('derivatives', derivative_store)]
+    failed_total = 0
+    for label, store in stores:
+        if args.only and args.only != label:
+            continue
+        logger.info("%s: %s", label, store.describe())
+        if args.check:
+            pending = list(store.pending())
+            logger.info("%s: %d Dateien (%.1f MB) liegen noch in der alten Ablage",
+                        label, len(pending), sum(size for _, size in pending) / 1024 / 1024)
+            continue
+        moved, moved_bytes, failed = migrate_store(label, store, args.rate, lambda: stopping)
+        failed_total += failed
+        logger.info("%s: %d Dateien (%.1f MB) umgezogen%s%s", label, moved, moved_bytes / 1024 / 1024,
+                    f", {failed} Fehler" if failed else "", " (abgebrochen)" if stopping else "")
+    return 1 if failed_total else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Kachel-Cache rund um die Spots vorwärmen.
+
+Holt für jede Bildkoordinate die Kacheln der gewählten Zoomstufen (plus
+--radius Kacheln in jede Richtung) über den Kachel-Proxy in den Cache
+(tile_cache.db), damit die ersten Kartenaufrufe nicht auf den Upstream
+warten. Schon gecachte, nicht abgelaufene Kacheln kosten keinen Abruf.
+
+Die öffentlichen OSM-Server erlauben kein massenhaftes Vorladen; --rate
+ist deshalb vorsichtig eingestellt. Für große Mengen einen eigenen
+Upstream (TILE_UPSTREAM_OSM usw.) verwenden.
+
+Start:  python prewarm_tiles.py [--layer osm] [--zooms 10-15] [--radius 1] [--rate 2]
+"""
+import argparse
+import logging
+import math
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import db
+from app import DB_PATH, TILE_MAX_ZOOM, TILE_UPSTREAMS, tile_cache
+from tile_cache import TileUnavailable
+
+logger = logging.getLogger("prewarm")
+
+
+def tile_xy(lat, lon, z):
+    """Kachelkoordinaten (Web Mercator) eines Punktes auf Zoomstufe z."""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_around(points, zooms, radius):
+    """Menge aller (z, x, y) um die Punkte, sortiert nach Zoomstufe."""
+    tiles = set()
+    for z in zooms:
+        n = 2 ** z
+        for lat, lon in points:
+            cx, cy = tile_xy(lat, lon, z)
+            for x in range(cx - radius, cx + radius + 1):
+                for y in range(max(cy - radius, 0), min(cy + radius, n - 1) + 1):
+                    tiles.add((z, x % n, y))
+    return sorted(tiles)
+
+
+def _parse_zooms(value):
+    low, _, high = value.partition('-')
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high <= TILE_MAX_ZOOM:
+        raise argparse.ArgumentTypeError(f"Zoomstufen zwischen 0 und {TILE_MAX_ZOOM}, z.B. 10-15")
+    return range(low, high + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--layer', choices=sorted(TILE_UPSTREAMS), default='osm', help="Kartenlage (Standard osm)")
+    parser.add_argument('--zooms', type=_parse_zooms, default=_parse_zooms('10-15'),
+                        help="Zoomstufen als von-bis (Standard 10-15)")
+    parser.add_argument('--radius', type=int, default=1, help="zusätzliche Kacheln je Richtung (Standard 1)")
+    parser.add_argument('--threads', type=int, default=2, help="parallele Abrufe (Standard 2)")
+    parser.add_argument('--rate', type=float, default=2,
+                        help="höchstens so viele Kacheln pro Sekunde (Standard 2, 0 = unbegrenzt)")
+    parser.add_argument('--check', action='store_true', help="nur zählen, nichts holen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [prewarm] %(message)s")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    conn = db.connect(DB_PATH)
+    try:
+        points = conn.execute("""
+            SELECT DISTINCT ROUND(latitude, 4), ROUND(longitude, 4) FROM images
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND status = 'ready'
+        """).fetchall()
+    finally:
+        conn.close()
+    tiles = tiles_around([tuple(p) for p in points], args.zooms, args.radius)
+    logger.info("%d Spots, %d Kacheln (%s, Zoom %d-%d)", len(points), len(tiles), args.layer,
+                args.zooms[0], args.zooms[-1])
+    if args.check:
+        logger.info("Cache: %s", tile_cache.stats())
+        return
+
+    min_interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    last_submit = 0.0
+    last_log = time.monotonic()
+    done = failed = 0
+    todo = iter(tiles)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        while True:
+            while not stopping and len(in_flight) < args.threads:
+                wait_for = last_submit + min_interval - time.monotonic()
+                if wait_for > 0:
+                    if in_flight:
+                        break
+                    time.sleep(wait_for)
+                item = next(todo, None)
+                if item is None:
+                    break
+                in_flight[pool.submit(tile_cache.get, args.layer, *item)] = item
+                last_submit = time.monotonic()
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, timeout=min_interval or None, return_when=FIRST_COMPLETED)
+            for future in finished:
+                z, x, y = in_flight.pop(future)
+                try:
+                    future.result()
+                except TileUnavailable as e:
+                    logger.warning("%s", e)
+                    failed += 1
+                done += 1
+            if time.monotonic() - last_log >= 10:
+                last_log = time.monotonic()
+                logger.info("%d/%d Kacheln (%d Fehler)", done, len(tiles), failed)
+
+    if stopping:
+        logger.info("Abgebrochen nach %d von %d Kacheln", done, len(tiles))
+    logger.info("%d Kacheln geprüft, %d Fehler; Cache: %s", done, failed, tile_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Größenbeschränkter Festplatten-Cache für On-Demand-Renditionen (/img/<id>/<breite>.<fmt>).
+
+Die Dateien liegen in einem eigenen Verzeichnis, der Index (Größe, letzter
+Zugriff) in einer kleinen SQLite-Datei daneben, damit alle gunicorn-Worker
+denselben Cache teilen. Überschreitet der Cache max_bytes, werden die am
+längsten nicht benutzten Einträge gelöscht, bis er wieder unter 90 % liegt.
+Die Gesamtgröße führt der Index als laufende Summe (stats 'bytes') in
+derselben Transaktion wie jede Änderung an `entries` mit.
+"""
+import os
+import time
+
+import db
+from db import transaction
+
+TOUCH_INTERVAL = 60.0       # last_access höchstens so oft (s) pro Eintrag aktualisieren
+STATS_FLUSH_INTERVAL = 5.0  # Hit/Miss-Zähler so oft (s) in den Index schreiben
+EVICT_TO_RATIO = 0.9
+EVICT_BATCH = 100           # Einträge pro Lösch-Transaktion
+
+
+class ResizeCache:
+
+    def __init__(self, folder, max_bytes):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, 'index.db')
+        self._pending = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._last_flush = time.monotonic()
+        self._schema_ready = False
+
+    # --- Verbindung zum Index ---
+    def _conn(self):
+        if not self._schema_ready:
+            os.makedirs(self.folder, exist_ok=True)
+        conn = db.get_pool(self.index_path).acquire()
+        if not self._schema_ready:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+              key TEXT PRIMARY KEY,
+              image_id INTEGER NOT NULL,
+              path TEXT NOT NULL,
+              bytes INTEGER NOT NULL,
+              last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries(last_access);
+            CREATE INDEX IF NOT EXISTS idx_entries_image ON entries(image_id);
+            CREATE TABLE IF NOT EXISTS stats (
+              name TEXT PRIMARY KEY,
+              value INTEGER NOT NULL
+            );
+            -- Laufende Summe einmalig aus dem Bestand übernehmen (ältere Index-Dateien)
+            INSERT INTO stats (name, value)
+            SELECT 'bytes', (SELECT COALESCE(SUM(bytes), 0) FROM entries)
+            WHERE NOT EXISTS (SELECT 1 FROM stats WHERE name = 'bytes');
+            """)
+            self._schema_ready = True
+        return conn
+
+    def _release(self, conn):
+        db.get_pool(self.index_path).release(conn)
+
+    def path_for(self, key):
+        return os.path.join(self.folder, key)
+
+    # --- Zugriff ---
+    def lookup(self, key):
+        """Pfad der gecachten Datei oder None (zählt Hit bzw. Miss)."""
+        conn = self._conn()
+        try:
+            row = conn.execute("SELECT path, last_access FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(row['path']):
+                self._count(conn, 'misses')
+                return None
+            now = time.time()
+            if now - row['last_access'] > TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._count(conn, 'hits')
+            return row['path']
+        finally:
+            self._release(conn)
+
+    def store(self, key, image_id, tmp_path):
+        """Übernimmt eine fertig gerenderte Datei atomar in den Cache und räumt ggf. auf."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        conn = self._conn()
+        try:
+            with transaction(conn):
+                old = conn.execute("SELECT bytes FROM entries WHERE key = ?", (key,)).fetchone()
+                conn.execute("""
+                    INSERT OR REPLACE INTO entries (key, image_id, path, bytes, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, image_id, path, size, time.time()))
+                _add_bytes(conn, size - (old['bytes'] if old else 0))
+            self._evict(conn, keep=key)
+        finally:
+            self._release(conn)
+        return path
+
+    def purge_image(self, image_id):
+        """Entfernt alle Renditionen eines Bildes (z.B. beim Löschen)."""
+        conn = self._conn()
+        try:
+            with transaction(conn):
+                rows = conn.execute("SELECT path, bytes FROM entries WHERE image_id = ?", (image_id,)).fetchall()
+                conn.execute("DELETE FROM entries WHERE image_id = ?", (image_id,))
+                _add_bytes(conn, -sum(row['bytes'] for row in rows))
+            for row in rows:
+                _remove_quietly(row['path'])
+        finally:
+            self._release(conn)
+
+    def stats(self):
+        """dict mit hits, misses, evictions, entries und bytes."""
+        conn = self._conn()
+        try:
+            self._flush(conn)
+            result = {name: 0 for name in self._pending}
+            result.update({row['name']: row['value'] for row in conn.execute("SELECT name, value FROM stats")})
+            result['entries'] = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            result['max_bytes'] = self.max_bytes
+            return result
+        finally:
+            self._release(conn)
+
+    # --- Intern ---
+    def _evict(self, conn, keep=None):
+        total = _total_bytes(conn)
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO_RATIO
+        while total > target:
+            # Kleine Stapel über den LRU-Index statt eines Scans über alle Einträge
+            with transaction(conn):
+                rows = conn.execute("SELECT key, path, bytes FROM entries WHERE key != ? "
+                                    "ORDER BY last_access LIMIT ?", (keep or '', EVICT_BATCH)).fetchall()
+                if not rows:
+                    break
+                victims = _until_target(rows, total, target)
+                conn.executemany("DELETE FROM entries WHERE key = ?", [(v['key'],) for v in victims])
+                freed = sum(v['bytes'] for v in victims)
+                _add_bytes(conn, -freed)
+            for victim in victims:
+                _remove_quietly(victim['path'])
+            self._pending['evictions'] += len(victims)
+            total -= freed
+
+    def _count(self, conn, name):
+        # Zähler werden im Prozess gesammelt und nur alle paar Sekunden geschrieben,
+        # damit nicht jeder Treffer eine Schreibtransaktion kostet
+        self._pending[name] += 1
+        if time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL:
+            self._flush(conn)
+
+    def _flush(self, conn):
+        pending = {name: n for name, n in self._pending.items() if n}
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+        with transaction(conn):
+            conn.executemany("""
+                INSERT INTO stats (name, value) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+            """, list(pending.items()))
+        for name in pending:
+            self._pending[name] = 0
+
+
+def _until_target(rows, total, target):
+    """Die ersten Zeilen (LRU-Reihenfolge), deren Löschen total auf target bringt."""
+    victims = []
+    for row in rows:
+        if total <= target:
+            break
+        victims.append(row)
+        total -= row['bytes']
+    return victims
+
+
+def _total_bytes(conn):
+    row = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()
+    return row['value'] if row else 0
+
+
+def _add_bytes(conn, delta):
+    conn.execute("""
+        INSERT INTO stats (name, value) VALUES ('bytes', ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+    """, (delta,))
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,87 @@
+"""
+Versionierter Antwort-Cache für Marker-JSON und Galerie-Fragmente.
+
+Jeder Eintrag ist an die Datenversion (Tabelle `meta`, siehe init_db)
+gebunden, die bei jeder Änderung an images/derivatives hochgezählt wird.
+Ein Eintrag mit älterer Version gilt als verfallen; invalidiert werden
+muss also nie explizit. Der Cache liegt in einer eigenen SQLite-Datei,
+damit alle gunicorn-Worker ihn teilen, ohne die Haupt-DB zu belasten.
+"""
+import json
+import os
+import time
+
+import db
+from db import transaction
+
+MAX_ENTRIES = 5000        # danach werden die ältesten Einträge verworfen
+PRUNE_INTERVAL = 60.0     # veraltete Versionen höchstens so oft (s) löschen
+
+
+class ResponseCache:
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._schema_ready = False
+        self._last_prune = 0.0
+
+    def _conn(self):
+        conn = db.get_pool(self.path).acquire()
+        if not self._schema_ready:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+              key TEXT PRIMARY KEY,
+              version INTEGER NOT NULL,
+              body BLOB NOT NULL,
+              extra TEXT,
+              created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created);
+            """)
+            self._schema_ready = True
+        return conn
+
+    def _release(self, conn):
+        db.get_pool(self.path).release(conn)
+
+    def get(self, key, version):
+        """
+        Returns:
+            tuple: (body als bytes, extra-dict) oder None, wenn nichts für diese Version da ist
+        """
+        conn = self._conn()
+        try:
+            row = conn.execute(
+                "SELECT body, extra FROM responses WHERE key = ? AND version = ?", (key, version)
+            ).fetchone()
+        finally:
+            self._release(conn)
+        if row is None:
+            return None
+        return bytes(row['body']), json.loads(row['extra']) if row['extra'] else {}
+
+    def put(self, key, version, body, extra=None):
+        """Legt eine Antwort für `version` ab und räumt gelegentlich alte Versionen weg."""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        conn = self._conn()
+        try:
+            with transaction(conn):
+                conn.execute("""
+                    INSERT OR REPLACE INTO responses (key, version, body, extra, created)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, version, body, json.dumps(extra) if extra else None, time.time()))
+            if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                self._prune(conn, version)
+        finally:
+            self._release(conn)
+
+    def _prune(self, conn, version):
+        self._last_prune = time.monotonic()
+        with transaction(conn):
+            conn.execute("DELETE FROM responses WHERE version < ?", (version,))
+            conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?
+                )
+            """, (MAX_ENTRIES,))
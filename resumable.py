@@ -0,0 +1,161 @@
+"""
+Wiederaufnehmbare Uploads in Teilstücken (angelehnt an das tus-Protokoll).
+
+Ablauf: Sitzung anlegen (Dateiname, Größe, Formulardaten) → Teilstücke per
+PATCH mit Upload-Offset anhängen → abschließen. Die Sitzungen liegen in der
+Tabelle `upload_sessions` (angelegt von init_db), die Bytes in einer
+Spool-Datei pro Sitzung. Ein Request belegt einen Worker damit nur für ein
+Teilstück, und der Body wird blockweise auf die Platte geschrieben statt im
+Speicher gesammelt.
+
+Bricht die Verbindung mitten in einem Teilstück ab, bleiben die bis dahin
+empfangenen Bytes erhalten; der Client fragt den Offset ab (HEAD) und macht
+dort weiter. Sitzungen, die länger als MAX_AGE_SECONDS nicht angefasst
+wurden, räumt collect_garbage() samt Spool-Datei weg.
+"""
+import logging
+import os
+import time
+import uuid
+
+from db import transaction
+
+logger = logging.getLogger("resumable")
+
+BLOCK_SIZE = 1024 * 1024
+MAX_AGE_SECONDS = 24 * 3600
+
+
+class OffsetMismatch(Exception):
+    """Der Client sendet ab einem anderen Offset, als der Server kennt."""
+
+    def __init__(self, expected):
+        super().__init__(f"Erwarteter Offset: {expected}")
+        self.expected = expected
+
+
+def spool_path(spool_dir, session_id):
+    return os.path.join(spool_dir, f"{session_id}.part")
+
+
+def create(conn, spool_dir, user_id, filename, size, fields):
+    """
+    Legt eine Sitzung und ihre leere Spool-Datei an.
+
+    Args:
+        fields: dict mit name, description, category (werden beim Abschluss übernommen)
+
+    Returns:
+        str: Sitzungs-ID
+    """
+    session_id = uuid.uuid4().hex
+    os.makedirs(spool_dir, exist_ok=True)
+    open(spool_path(spool_dir, session_id), 'wb').close()
+    now = time.time()
+    with transaction(conn):
+        conn.execute("""
+            INSERT INTO upload_sessions
+            (id, user_id, filename, size, received, name, description, category, created, updated)
+            VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?)
+        """, (session_id, user_id, filename, size, fields['name'], fields.get('description') or '',
+              fields['category'], now, now))
+    return session_id
+
+
+def get(conn, session_id, user_id):
+    """Sitzung des Benutzers oder None."""
+    return conn.execute("SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?",
+                        (session_id, user_id)).fetchone()
+
+
+def append(conn, spool_dir, upload, offset, stream, length=None):
+    """
+    Schreibt den Body eines Teilstücks ab `offset` in die Spool-Datei.
+
+    Der Stream wird blockweise gelesen; bricht er ab, zählen die bis dahin
+    geschriebenen Bytes trotzdem. Mehr als bis zur angemeldeten Größe wird
+    nicht angenommen.
+
+    Returns:
+        int: neuer Offset
+
+    Raises:
+        OffsetMismatch: offset passt nicht zum Stand der Sitzung
+    """
+    if offset != upload['received']:
+        raise OffsetMismatch(upload['received'])
+    remaining = upload['size'] - offset
+    if length is not None:
+        remaining = min(remaining, length)
+
+    written = 0
+    interrupted = None
+    with open(spool_path(spool_dir, upload['id']), 'r+b') as f:
+        f.seek(offset)
+        while written < remaining:
+            try:
+                block = stream.read(min(BLOCK_SIZE, remaining - written))
+            except Exception as e:
+                interrupted = e
+                break
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+        # Alles hinter dem neuen Offset stammt aus einem abgebrochenen Versuch
+        f.truncate(offset + written)
+        f.flush()
+        os.fsync(f.fileno())
+
+    with transaction(conn):
+        cur = conn.execute(
+            "UPDATE upload_sessions SET received = ?, updated = ? WHERE id = ? AND received = ?",
+            (offset + written, time.time(), upload['id'], offset),
+        )
+    if cur.rowcount == 0:
+        # Paralleles Teilstück auf denselben Offset war schneller
+        current = conn.execute("SELECT received FROM upload_sessions WHERE id = ?", (upload['id'],)).fetchone()
+        raise OffsetMismatch(current['received'] if current else 0)
+    if interrupted is not None:
+        logger.info(f"Teilstück für {upload['id']} abgebrochen nach {written} Bytes: {interrupted}")
+    return offset + written
+
+
+def delete(conn, spool_dir, session_id):
+    """Entfernt Sitzung und Spool-Datei (nach Abschluss oder Abbruch)."""
+    with transaction(conn):
+        conn.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,))
+    try:
+        os.remove(spool_path(spool_dir, session_id))
+    except FileNotFoundError:
+        pass
+
+
+def collect_garbage(conn, spool_dir, max_age=MAX_AGE_SECONDS):
+    """
+    Löscht verlassene Sitzungen und Spool-Dateien ohne Sitzung.
+
+    Returns:
+        int: Anzahl entfernter Sitzungen
+    """
+    cutoff = time.time() - max_age
+    with transaction(conn):
+        stale = [row['id'] for row in conn.execute(
+            "SELECT id FROM upload_sessions WHERE updated < ?", (cutoff,))]
+        conn.executemany("DELETE FROM upload_sessions WHERE id = ?", [(s,) for s in stale])
+    for session_id in stale:
+        try:
+            os.remove(spool_path(spool_dir, session_id))
+        except FileNotFoundError:
+            pass
+
+    # Waisen (z.B. Absturz zwischen Anlegen der Datei und der Zeile)
+    if os.path.isdir(spool_dir):
+        known = {row['id'] for row in conn.execute("SELECT id FROM upload_sessions")}
+        for entry in os.scandir(spool_dir):
+            session_id = entry.name[:-len('.part')] if entry.name.endswith('.part') else None
+            if session_id and session_id not in known and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    if stale:
+        logger.info(f"{len(stale)} verlassene Upload-Sitzungen entfernt")
+    return len(stale)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Lokaler S3-Ersatz zum Ausprobieren und Testen von ORIGINALS_STORAGE=s3.
+
+Versteht genau das, was storage.S3Storage braucht: PUT/GET/HEAD/DELETE
+einzelner Objekte und ListObjectsV2, Pfad-Adressierung
+(http://host:port/<bucket>/<schlüssel>). Objekte liegen als Dateien unter
+--data-dir/<bucket>/. Signaturen werden nicht geprüft, nur der Access-Key
+(falls --access-key gesetzt ist) – für Produktion MinIO oder echtes S3 nehmen.
+
+Start:  python s3_standin.py [--port 9000] [--data-dir s3-data]
+        ORIGINALS_STORAGE=s3 S3_ENDPOINT=http://127.0.0.1:9000 S3_BUCKET=photos python app.py
+"""
+import argparse
+import email.utils
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger("s3_standin")
+
+BLOCK_SIZE = 1024 * 1024
+LIST_MAX_KEYS = 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    data_dir = 's3-data'
+    access_key = None
+
+    # --- Hilfen ---
+    def _target(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def _object_path(self, bucket, key):
+        root = os.path.abspath(os.path.join(self.data_dir, bucket))
+        path = os.path.abspath(os.path.join(root, key))
+        if not path.startswith(root + os.sep):
+            return None
+        return path
+
+    def _error(self, status, code):
+        body = f"<?xml version=\"1.0\"?><Error><Code>{code}</Code></Error>".encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _authorized(self):
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('AWS4-HMAC-SHA256 '):
+            self._error(403, 'AccessDenied')
+            return False
+        if self.access_key is not None:
+            match = re.search(r'Credential=([^/]+)/', auth)
+            if not match or match.group(1) != self.access_key:
+                self._error(403, 'InvalidAccessKeyId')
+                return False
+        return True
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt, *args)
+
+    # --- Methoden ---
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        bucket, key, _query = self._target()
+        path = self._object_path(bucket, key) if key else None
+        if path is None:
+            return self._error(400, 'InvalidRequest')
+        length = int(self.headers.get('Content-Length', 0))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.md5()
+        with open(path + '.part', 'wb') as f:
+            remaining = length
+            while remaining:
+                block = self.rfile.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                remaining -= len(block)
+        if remaining:
+            os.remove(path + '.part')
+            return self._error(400, 'IncompleteBody')
+        os.replace(path + '.part', path)
+        self.send_response(200)
+        self.send_header('ETag', f'"{digest.hexdigest()}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        bucket, key, query = self._target()
+        if not key:
+            return self._list(bucket, query)
+        self._send_object(bucket, key, body=True)
+
+    def do_HEAD(self):
+        if not self._authorized():
+            return
+        bucket, key, _query = self._target()
+        self._send_object(bucket, key, body=False)
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        bucket, key, _query = self._target()
+        path = self._object_path(bucket, key) if key else None
+        if path is None:
+            return self._error(400, 'InvalidRequest')
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.send_response(204)
+        self.end_headers()
+
+    def _send_object(self, bucket, key, body):
+        path = self._object_path(bucket, key) if key else None
+        if path is None or not os.path.isfile(path):
+            return self._error(404, 'NoSuchKey')
+        stat = os.stat(path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+        if body:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                    self.wfile.write(block)
+
+    def _list(self, bucket, query):
+        root = os.path.join(self.data_dir, bucket)
+        prefix = query.get('prefix', '')
+        after = query.get('continuation-token', '')
+        keys = []
+        for folder, _dirs, files in os.walk(root):
+            for name in files:
+                if name.endswith('.part'):
+                    continue
+                key = os.path.relpath(os.path.join(folder, name), root).replace(os.sep, '/')
+                if key.startswith(prefix) and key > after:
+                    keys.append(key)
+        keys.sort()
+        page, truncated = keys[:LIST_MAX_KEYS], len(keys) > LIST_MAX_KEYS
+
+        items = []
+        for key in page:
+            stat = os.stat(os.path.join(root, key))
+            modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            items.append(f"<Contents><Key>{escape(key)}</Key><LastModified>{modified}</LastModified>"
+                         f"<Size>{stat.st_size}</Size></Contents>")
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            + (f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else '')
+            + ''.join(items) + '</ListBucketResult>'
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--data-dir', default='s3-data', help="Verzeichnis für Buckets und Objekte")
+    parser.add_argument('--access-key', default=os.environ.get('S3_ACCESS_KEY') or None,
+                        help="nur Anfragen mit diesem Access-Key annehmen")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [s3_standin] %(message)s")
+    Handler.data_dir = os.path.abspath(args.data_dir)
+    Handler.access_key = args.access_key
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logger.info("S3-Ersatz auf http://%s:%d, Daten in %s", args.host, args.port, Handler.data_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
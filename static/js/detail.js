@@ -5,7 +5,7 @@
   const lon = parseFloat(el.getAttribute('data-lon'));
   const map = L.map('detailMap').setView([lat, lon], 15);
 
-  L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', { maxZoom: 19 }).addTo(map);
+  L.tileLayer(el.dataset.tileUrl, { maxZoom: 19 }).addTo(map);
 
   const menInDreckIcon = L.icon({
     iconUrl: "/static/icons/men-in-dreck-helmet.svg",
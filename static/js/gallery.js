@@ -0,0 +1,72 @@
+(function(){
+  // --- Platzhalter für Bilder in Verarbeitung ---
+  // Fragt den Status ab, bis der Worker fertig ist, und ersetzt dann den Platzhalter durch das Thumbnail.
+  const POLL_INTERVAL_MS = 3000;
+
+  function pollPending() {
+    const pending = document.querySelectorAll('.preview-pending[data-status="processing"]');
+    if (pending.length === 0) return;
+
+    Promise.all(Array.from(pending).map((el) =>
+      fetch(el.getAttribute('data-status-url'), { headers: { Accept: 'application/json' } })
+        .then((resp) => (resp.ok ? resp.json() : null))
+        .then((data) => {
+          if (!data) return;
+          if (data.status === 'ready') {
+            const img = document.createElement('img');
+            img.src = data.thumbnail;
+            img.alt = el.closest('tr')?.querySelector('.name-truncate')?.textContent.trim() || '';
+            img.className = 'rounded shadow-sm preview-img';
+            el.replaceWith(img);
+          } else if (data.status === 'failed') {
+            el.setAttribute('data-status', 'failed');
+            el.classList.add('is-failed');
+            el.title = 'Verarbeitung fehlgeschlagen';
+            el.textContent = '⚠';
+          }
+        })
+        .catch(() => {})
+    )).finally(() => setTimeout(pollPending, POLL_INTERVAL_MS));
+  }
+
+  setTimeout(pollPending, POLL_INTERVAL_MS);
+
+  // --- Nachladen beim Scrollen ---
+  // Die Galerie liefert nur die erste Seite aus; weitere Zeilen kommen von /gallery/rows,
+  // die URL der nächsten Seite steht im Header X-Next-Url.
+  const sentinel = document.getElementById('gallery-sentinel');
+  const tbody = document.getElementById('gallery-rows');
+  if (!sentinel || !tbody || !sentinel.dataset.nextUrl) return;
+
+  let loading = false;
+
+  function loadMore() {
+    const url = sentinel.dataset.nextUrl;
+    if (loading || !url) return;
+    loading = true;
+    fetch(url, { headers: { Accept: 'text/html' } })
+      .then((resp) => {
+        if (!resp.ok) throw new Error(resp.status);
+        const next = resp.headers.get('X-Next-Url');
+        return resp.text().then((html) => ({ html, next }));
+      })
+      .then(({ html, next }) => {
+        tbody.insertAdjacentHTML('beforeend', html);
+        if (window.applyLqip) window.applyLqip(tbody);
+        if (next) {
+          sentinel.dataset.nextUrl = next;
+        } else {
+          delete sentinel.dataset.nextUrl;
+          sentinel.hidden = true;
+          observer.disconnect();
+        }
+      })
+      .catch(() => {})
+      .finally(() => { loading = false; });
+  }
+
+  const observer = new IntersectionObserver((entries) => {
+    if (entries.some((e) => e.isIntersecting)) loadMore();
+  }, { rootMargin: '600px 0px' });
+  observer.observe(sentinel);
+})();
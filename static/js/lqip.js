@@ -0,0 +1,23 @@
+// Unscharfe Vorschau (LQIP) als Hintergrund, bis das eigentliche Bild geladen ist.
+// Per JS statt style-Attribut, weil die CSP keine Inline-Styles erlaubt.
+(function() {
+  function clear(img) {
+    img.classList.remove('lqip');
+    img.style.backgroundImage = '';
+  }
+
+  function applyLqip(root) {
+    (root || document).querySelectorAll('img[data-lqip]').forEach(function(img) {
+      const src = img.dataset.lqip;
+      img.removeAttribute('data-lqip');
+      if (img.complete && img.naturalWidth) return;
+      img.style.backgroundImage = 'url("' + src + '")';
+      img.classList.add('lqip');
+      img.addEventListener('load', function() { clear(img); }, { once: true });
+      img.addEventListener('error', function() { clear(img); }, { once: true });
+    });
+  }
+
+  window.applyLqip = applyLqip;
+  applyLqip(document);
+})();
@@ -1,6 +1,6 @@
 (function(){
-  const dataEl = document.getElementById('images-data');
-  const images = dataEl ? JSON.parse(dataEl.getAttribute('data-images') || '[]') : [];
+  const dataEl = document.getElementById('map-data');
+  const markersUrl = (dataEl && dataEl.getAttribute('data-markers-url')) || '/api/markers';
 
   const menInDreckHelmetBadge = L.icon({
     iconUrl: "/static/icons/men-in-dreck-helmet.svg",
@@ -19,22 +19,22 @@
   const defaultIcon = L.icon({ iconUrl: "/static/icons/default.svg", iconSize: [48, 48], iconAnchor: [24, 48], popupAnchor: [0, -48] });
 
   const map = L.map("map").setView([51.1657, 10.4515], 6);
-  const markerCluster = L.markerClusterGroup();
+  const markerLayer = L.layerGroup().addTo(map);
 
-  // --- Verschiedene Kartenlagen (Basemaps) ---
-  const osmLayer = L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+  // --- Verschiedene Kartenlagen (Basemaps), URLs kommen vom Server (Kachel-Proxy) ---
+  const osmLayer = L.tileLayer(dataEl.dataset.tileOsm, {
     maxZoom: 19,
     attribution: '© OpenStreetMap contributors',
     errorTileUrl: ''
   });
   
-  const topoLayer = L.tileLayer("https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png", {
+  const topoLayer = L.tileLayer(dataEl.dataset.tileTopo, {
     maxZoom: 17,
     attribution: '© OpenTopoMap contributors',
     errorTileUrl: ''
   });
   
-  const satelliteLayer = L.tileLayer("https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}", {
+  const satelliteLayer = L.tileLayer(dataEl.dataset.tileSatellite, {
     maxZoom: 19,
     attribution: '© Esri',
     errorTileUrl: ''
@@ -60,56 +60,193 @@
     console.log('Layer gewechselt zu: ' + e.name);
   });
 
-  const markers = [];
+  // --- Marker viewport-abhängig vom Server laden ---
+  // Der Server liefert bei kleinen Zoomstufen fertige Cluster, ab CLUSTER_MAX_ZOOM Einzelpunkte.
+  // Bestehende Marker bleiben erhalten, solange sie im Ergebnis enthalten sind,
+  // damit offene Popups beim Verschieben der Karte nicht geschlossen werden;
+  // geänderte Inhalte (Anzahl, Name, Bild …) werden am vorhandenen Marker nachgezogen.
+  const selectEl = document.getElementById('category-select');
+  const markersByKey = new Map();
   const markersById = {};
   let allImages = [];
+  let pendingRequest = null;
+  let pendingFocus = null;
 
-  images.forEach((img) => {
-    const name = img[1] || "";
-    const description = img[2] || "";
-    const category = img[3] || "";
-    const filepath = img[4] || "";
-    const thumbnail_path = img[5] || "";
-    let lat = img[6];
-    let lon = img[7];
-
-    if (!lat || isNaN(lat)) lat = 51.1657;
-    if (!lon || isNaN(lon)) lon = 10.4515;
-
-    const icon = categoryIcons[category] || defaultIcon;
-
-    const marker = L.marker([lat, lon], { icon });
-    marker.category = category;
-    marker.name = name;
-    marker.imageId = img[0];
-    markerCluster.addLayer(marker);
-    markers.push(marker);
-    markersById[String(img[0])] = marker;
-
-    // Speichere Bildinfo für Sidebar (korrekte Thumbnail-URL oder Fallback)
-    const sidebarThumbUrl = thumbnail_path ? `/thumbnails/${thumbnail_path}` : `/uploads/${filepath}`;
-    allImages.push({
-      id: img[0],
-      name: name,
-      category: category,
-      thumbnailUrl: sidebarThumbUrl
-    });
+  const escapeHtml = (value) => String(value ?? "").replace(/[&<>"']/g, (ch) => ({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"
+  })[ch]);
 
-    // Nutze Thumbnail wenn vorhanden, sonst Vollbild
-    const image_src = thumbnail_path ? `/thumbnails/${thumbnail_path}` : `/uploads/${filepath}`;
+  // <picture> mit srcset aus den Derivaten, damit das Popup nur so viele Pixel lädt, wie es zeigt
+  function pictureHtml(pic, alt, sizes, className) {
+    const sources = (pic.sources || []).map((src) =>
+      `<source type="${escapeHtml(src.type)}" srcset="${escapeHtml(src.srcset)}" sizes="${sizes}">`
+    ).join("");
+    const srcset = pic.srcset ? ` srcset="${escapeHtml(pic.srcset)}" sizes="${sizes}"` : "";
+    const dims = pic.width ? ` width="${pic.width}" height="${pic.height}"` : "";
+    const lqip = pic.lqip ? ` data-lqip="${escapeHtml(pic.lqip)}"` : "";
+    return `<picture>${sources}<img src="${escapeHtml(pic.src)}"${srcset}${dims}${lqip} class="${className}" loading="lazy" alt="${escapeHtml(alt)}"></picture>`;
+  }
 
-    marker.bindPopup(`
+  function pointPopupHtml(img) {
+    return `
       <div style="max-width:200px">
-          <h5 class="fw-bold mb-1">${name}</h5>
-          <span class="badge bg-warning text-dark mb-2">${category}</span>
-          <p>${description}</p>
-          <img src="${image_src}" class="img-fluid rounded mb-2" loading="lazy" alt="${name}">
-          <a href="/detail/${img[0]}" class="btn btn-warning btn-sm w-100">Details ansehen</a>
+          <h5 class="fw-bold mb-1">${escapeHtml(img.name)}</h5>
+          <span class="badge bg-warning text-dark mb-2">${escapeHtml(img.category)}</span>
+          <p>${escapeHtml(img.description)}</p>
+          ${pictureHtml(img.picture, img.name, "200px", "img-fluid rounded mb-2")}
+          <a href="/detail/${img.id}" class="btn btn-warning btn-sm w-100">Details ansehen</a>
       </div>
-    `);
-  });
+    `;
+  }
+
+  function createPointMarker(img) {
+    const marker = L.marker([img.lat, img.lon], { icon: categoryIcons[img.category] || defaultIcon });
+    marker.imageId = img.id;
+    marker.bindPopup(pointPopupHtml(img));
+    updatePointMarker(marker, img);
+    return marker;
+  }
+
+  // Gleicher Schlüssel, geänderter Inhalt (z.B. nach "markers-updated"): Marker an Ort und Stelle
+  // aktualisieren, damit ein offenes Popup offen bleibt
+  function updatePointMarker(marker, img) {
+    const signature = JSON.stringify([img.name, img.description, img.category, img.picture, img.lat, img.lon]);
+    if (marker.signature === signature) return;
+    if (marker.signature !== undefined) {
+      marker.setLatLng([img.lat, img.lon]);
+      marker.setIcon(categoryIcons[img.category] || defaultIcon);
+      marker.setPopupContent(pointPopupHtml(img));
+      if (marker.isPopupOpen() && window.applyLqip) window.applyLqip(marker.getPopup().getElement());
+    }
+    marker.signature = signature;
+    marker.category = img.category;
+    marker.name = img.name;
+  }
+
+  function clusterIcon(cluster) {
+    return L.divIcon({
+      className: "server-cluster",
+      html: `<img src="${escapeHtml(cluster.thumbnail)}" alt="" loading="lazy"><span>${cluster.count}</span>`,
+      iconSize: [52, 52],
+      iconAnchor: [26, 26],
+    });
+  }
+
+  function createClusterMarker(cluster) {
+    const marker = L.marker([cluster.lat, cluster.lon], { icon: clusterIcon(cluster) });
+    marker.on("click", () => zoomToCluster(marker.cluster));
+    updateClusterMarker(marker, cluster);
+    return marker;
+  }
+
+  function updateClusterMarker(marker, cluster) {
+    const signature = JSON.stringify([cluster.count, cluster.thumbnail, cluster.lat, cluster.lon]);
+    if (marker.signature === signature) return;
+    if (marker.signature !== undefined) {
+      marker.setLatLng([cluster.lat, cluster.lon]);
+      marker.setIcon(clusterIcon(cluster));
+    }
+    marker.signature = signature;
+    marker.cluster = cluster;
+  }
+
+  function zoomToCluster(cluster) {
+    map.setView([cluster.lat, cluster.lon], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+  }
+
+  // bbox auf das Zellraster des Servers (api_markers) runden: kleine Verschiebungen ergeben
+  // dieselbe URL, damit Browser- und Service-Worker-Cache (auch offline) greifen.
+  // Die Viertelzelle Abstand sorgt dafür, dass der Server beim erneuten Runden dieselbe Zelle trifft.
+  const clusterCellPx = parseInt((dataEl && dataEl.dataset.clusterCellPx) || "80", 10);
+
+  function snappedBbox(zoom) {
+    const b = map.getBounds();
+    const cell = 360 / (256 * 2 ** zoom) * clusterCellPx;
+    const west = Math.max(-180, Math.floor((b.getWest() + 180) / cell) * cell - 180 + cell / 4);
+    const east = Math.min(180, Math.ceil((b.getEast() + 180) / cell) * cell - 180 - cell / 4);
+    const south = Math.max(-90, Math.floor((b.getSouth() + 90) / cell) * cell - 90 + cell / 4);
+    const north = Math.min(90, Math.ceil((b.getNorth() + 90) / cell) * cell - 90 - cell / 4);
+    return [west, south, east, north].map((v) => v.toFixed(6)).join(",");
+  }
+
+  function markerQuery() {
+    const zoom = map.getZoom();
+    const params = new URLSearchParams({
+      bbox: snappedBbox(zoom),
+      zoom: String(zoom),
+    });
+    const category = selectEl ? selectEl.value : "Alle";
+    if (category && category !== "Alle") params.set("category", category);
+    return params;
+  }
+
+  function applyMarkers(data) {
+    const nextKeys = new Set();
+    const items = [];
+
+    data.points.forEach((img) => {
+      const key = `p${img.id}`;
+      nextKeys.add(key);
+      let marker = markersByKey.get(key);
+      if (!marker) {
+        marker = createPointMarker(img);
+        markersByKey.set(key, marker);
+        markerLayer.addLayer(marker);
+      } else {
+        updatePointMarker(marker, img);
+      }
+      markersById[String(img.id)] = marker;
+      items.push({ id: img.id, name: img.name, category: img.category, thumbnailUrl: img.thumbnail, lat: img.lat, lon: img.lon });
+    });
 
-  map.addLayer(markerCluster);
+    data.clusters.forEach((cluster) => {
+      const key = `c${cluster.key}`;
+      nextKeys.add(key);
+      const marker = markersByKey.get(key);
+      if (!marker) {
+        const created = createClusterMarker(cluster);
+        markersByKey.set(key, created);
+        markerLayer.addLayer(created);
+      } else {
+        updateClusterMarker(marker, cluster);
+      }
+      items.push({ cluster, name: `${cluster.count} Bilder`, category: "Gruppe", thumbnailUrl: cluster.thumbnail });
+    });
+
+    markersByKey.forEach((marker, key) => {
+      if (!nextKeys.has(key)) {
+        markerLayer.removeLayer(marker);
+        markersByKey.delete(key);
+        if (marker.imageId !== undefined) delete markersById[String(marker.imageId)];
+      }
+    });
+
+    allImages = items;
+    if (!searchActive()) renderImageList();
+
+    if (pendingFocus && markersById[pendingFocus]) {
+      markersById[pendingFocus].openPopup();
+      pendingFocus = null;
+    }
+  }
+
+  function loadMarkers() {
+    if (pendingRequest) pendingRequest.abort();
+    const controller = new AbortController();
+    pendingRequest = controller;
+    fetch(`${markersUrl}?${markerQuery()}`, { signal: controller.signal, headers: { Accept: "application/json" } })
+      .then((resp) => {
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        return resp.json();
+      })
+      .then(applyMarkers)
+      .catch((err) => {
+        if (err.name !== "AbortError") console.error("Marker konnten nicht geladen werden:", err);
+      })
+      .finally(() => {
+        if (pendingRequest === controller) pendingRequest = null;
+      });
+  }
 
   // --- SIDEBAR FUNKTIONALITÄT ---
   const sidebar = document.getElementById("sidebar");
@@ -166,11 +303,11 @@
   // Bilderliste populieren
   function renderImageList(imagesToShow = allImages) {
     imageList.innerHTML = imagesToShow.map(img => `
-      <div class="image-item" data-image-id="${img.id}">
-        <img src="${img.thumbnailUrl}" class="image-item-thumb" alt="${img.name}" loading="lazy">
+      <div class="image-item" ${img.cluster ? `data-cluster-index="${imagesToShow.indexOf(img)}"` : `data-image-id="${img.id}" data-lat="${img.lat}" data-lon="${img.lon}"`}>
+        <img src="${escapeHtml(img.thumbnailUrl)}" class="image-item-thumb" alt="${escapeHtml(img.name)}" loading="lazy">
         <div class="image-item-info">
-          <div class="image-item-name">${img.name}</div>
-          <span class="badge bg-warning text-dark">${img.category}</span>
+          <div class="image-item-name">${escapeHtml(img.name)}</div>
+          <span class="badge bg-warning text-dark">${escapeHtml(img.category)}</span>
         </div>
       </div>
     `).join("");
@@ -178,9 +315,18 @@
     // Click-Handler für Bilderliste
     document.querySelectorAll(".image-item").forEach(item => {
       item.addEventListener("click", () => {
+        const clusterIndex = item.getAttribute("data-cluster-index");
+        if (clusterIndex !== null) {
+          zoomToCluster(imagesToShow[Number(clusterIndex)].cluster);
+          return;
+        }
         const imageId = item.getAttribute("data-image-id");
         const marker = markersById[imageId];
-        if (marker) {
+        // Suchtreffer außerhalb des Ausschnitts haben noch keinen Marker: dann zur Position springen
+        const targetLatLng = marker
+          ? marker.getLatLng()
+          : L.latLng(parseFloat(item.getAttribute("data-lat")), parseFloat(item.getAttribute("data-lon")));
+        if (!isNaN(targetLatLng.lat) && !isNaN(targetLatLng.lng)) {
           // Sidebar erst schließen
           if (sidebar) {
             sidebar.classList.add("closed");
@@ -193,63 +339,113 @@
           // Kurz warten bis Sidebar-Animation abgeschlossen ist
           setTimeout(() => {
             map.invalidateSize();
-            markerCluster.zoomToShowLayer(marker, () => {
-              // Auf Mobile: Marker leicht nach links versetzen für bessere Sichtbarkeit
-              const isMobile = window.innerWidth <= 768;
-              if (isMobile) {
-                const targetLatLng = marker.getLatLng();
-                const point = map.project(targetLatLng, 15);
-                // Verschiebe den Punkt um 80px nach rechts, damit der Marker mittig im sichtbaren Bereich ist
-                point.x += 80;
-                const newCenter = map.unproject(point, 15);
-                map.setView(newCenter, 15);
-              } else {
-                map.setView(marker.getLatLng(), 15);
-              }
-              marker.openPopup();
-            });
+            // Auf Mobile: Marker leicht nach links versetzen für bessere Sichtbarkeit
+            const isMobile = window.innerWidth <= 768;
+            if (isMobile) {
+              const point = map.project(targetLatLng, 15);
+              // Verschiebe den Punkt um 80px nach rechts, damit der Marker mittig im sichtbaren Bereich ist
+              point.x += 80;
+              const newCenter = map.unproject(point, 15);
+              map.setView(newCenter, 15);
+            } else {
+              map.setView(targetLatLng, 15);
+            }
+            pendingFocus = imageId;
+            if (marker) marker.openPopup();
           }, 350); // Warte auf CSS-Transition (300ms) + Buffer
         }
       });
     });
   }
 
-  // Suche in Bilderliste
+  // Suche: serverseitige Volltextsuche (/api/search) über den ganzen Bestand,
+  // ohne Eingabe zeigt die Liste die Bilder des aktuellen Kartenausschnitts
+  const searchUrl = (dataEl && dataEl.getAttribute('data-search-url')) || '/api/search';
+  const SEARCH_DEBOUNCE_MS = 250;
+  let searchTimer = null;
+  let searchRequest = null;
+
+  function searchActive() {
+    return Boolean(sidebarSearch && sidebarSearch.value.trim());
+  }
+
+  function runSearch() {
+    const query = sidebarSearch.value.trim();
+    if (searchRequest) searchRequest.abort();
+    if (!query) {
+      renderImageList();
+      return;
+    }
+    const controller = new AbortController();
+    searchRequest = controller;
+    const params = new URLSearchParams({ q: query });
+    const category = selectEl ? selectEl.value : "Alle";
+    if (category && category !== "Alle") params.set("category", category);
+    fetch(`${searchUrl}?${params}`, { signal: controller.signal, headers: { Accept: "application/json" } })
+      .then((resp) => {
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        return resp.json();
+      })
+      .then((data) => {
+        renderImageList(data.results.map((r) => ({
+          id: r.id, name: r.name, category: r.category, thumbnailUrl: r.thumbnail, lat: r.lat, lon: r.lon,
+        })));
+      })
+      .catch((err) => {
+        if (err.name !== "AbortError") console.error("Suche fehlgeschlagen:", err);
+      })
+      .finally(() => {
+        if (searchRequest === controller) searchRequest = null;
+      });
+  }
+
   if (sidebarSearch) {
-    sidebarSearch.addEventListener("input", (e) => {
-      const query = e.target.value.toLowerCase();
-      const filtered = query
-        ? allImages.filter(img => img.name.toLowerCase().includes(query))
-        : allImages;
-      renderImageList(filtered);
+    sidebarSearch.addEventListener("input", () => {
+      clearTimeout(searchTimer);
+      searchTimer = setTimeout(runSearch, SEARCH_DEBOUNCE_MS);
     });
   }
 
-  // Initial render
-  renderImageList();
-  
-  // Kategorie-Filter
-  const selectEl = document.getElementById('category-select');
+  // Kategorie-Filter: Marker für die gewählte Kategorie neu laden
   if (selectEl) {
-    selectEl.addEventListener("change", function () {
-      const selected = this.value;
-      markers.forEach((marker) => {
-        if (selected === "Alle" || marker.category === selected) {
-          markerCluster.addLayer(marker);
-        } else {
-          markerCluster.removeLayer(marker);
-        }
-      });
+    selectEl.addEventListener("change", () => {
+      loadMarkers();
+      if (searchActive()) runSearch();
     });
   }
 
-  const params = new URLSearchParams(window.location.search);
-  const focus = params.get('focus');
-  if (focus && markersById[focus]) {
-    const m = markersById[focus];
-    markerCluster.zoomToShowLayer(m, function () {
-      map.setView(m.getLatLng(), 15);
-      m.openPopup();
+  // Export-Links auf den aktuellen Ausschnitt und die gewählte Kategorie setzen
+  const exportLinks = document.querySelectorAll(".export-link");
+  exportLinks.forEach((a) => { a.dataset.base = a.getAttribute("href"); });
+
+  function updateExportLinks() {
+    const b = map.getBounds();
+    const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map((v) => v.toFixed(4)).join(",");
+    const params = new URLSearchParams({ bbox });
+    if (selectEl && selectEl.value !== "Alle") params.set("category", selectEl.value);
+    exportLinks.forEach((a) => { a.href = `${a.dataset.base}?${params}`; });
+  }
+
+  map.on("moveend", loadMarkers);
+  map.on("moveend", updateExportLinks);
+
+  // Der Service Worker liefert Marker aus seinem Cache und meldet, wenn der Server neuere hat
+  if ("serviceWorker" in navigator) {
+    navigator.serviceWorker.addEventListener("message", (e) => {
+      if (e.data && e.data.type === "markers-updated") loadMarkers();
     });
   }
+  if (selectEl) selectEl.addEventListener("change", updateExportLinks);
+  map.on("popupopen", (e) => {
+    if (window.applyLqip) window.applyLqip(e.popup.getElement());
+  });
+
+  // Fokus aus ?focus=<id>: Position liefert der Server, Popup öffnet nach dem Laden
+  const focusId = dataEl && dataEl.getAttribute('data-focus-id');
+  if (focusId) {
+    pendingFocus = focusId;
+    map.setView([parseFloat(dataEl.getAttribute('data-focus-lat')), parseFloat(dataEl.getAttribute('data-focus-lon'))], 15);
+  } else {
+    loadMarkers();
+  }
 })();
@@ -0,0 +1,10 @@
+// Registriert den Service Worker der Offline-Karte (/sw.js, siehe templates/sw.js).
+(function() {
+  const script = document.currentScript;
+  if (!('serviceWorker' in navigator) || !script) return;
+
+  window.addEventListener('load', function() {
+    navigator.serviceWorker.register(script.dataset.swUrl, { scope: script.dataset.scope })
+      .catch(function(err) { console.warn('Service Worker nicht registriert:', err); });
+  });
+})();
@@ -20,3 +20,164 @@ document.addEventListener("DOMContentLoaded", function () {
   nameInput.addEventListener("input", validateName);
   validateName();
 });
+
+// Wiederaufnehmbarer Upload in Teilstücken (/upload/sessions). Fällt auf das
+// normale Formular zurück, wenn der Server keine Sitzungen anbietet.
+document.addEventListener("DOMContentLoaded", function () {
+  const form = document.getElementById("upload-form");
+  if (!form || !window.fetch || !window.Blob || !Blob.prototype.slice) return;
+
+  const MAX_RETRIES = 8;
+  const progress = document.getElementById("upload-progress");
+  const bar = progress ? progress.querySelector(".progress-bar") : null;
+  const statusText = document.getElementById("upload-status");
+  const csrfToken = form.querySelector("input[name='csrf_token']").value;
+  let busy = false;
+
+  function show(offset, size, text) {
+    if (!progress) return;
+    progress.hidden = false;
+    const pct = size ? Math.floor((offset / size) * 100) : 0;
+    bar.style.width = pct + "%";
+    statusText.textContent = text || pct + " %";
+  }
+
+  function sleep(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+  }
+
+  // Sitzungen überleben ein Neuladen der Seite (gleiche Datei → gleicher Schlüssel)
+  function storageKey(file) {
+    return "upload-session:" + [file.name, file.size, file.lastModified].join(":");
+  }
+
+  async function resumeSession(file) {
+    let saved;
+    try {
+      saved = JSON.parse(localStorage.getItem(storageKey(file)));
+    } catch (e) {
+      saved = null;
+    }
+    if (!saved) return null;
+    try {
+      const resp = await fetch(saved.url, { credentials: "same-origin", cache: "no-store" });
+      if (resp.ok) return resp.json();
+    } catch (e) {
+      return null;
+    }
+    localStorage.removeItem(storageKey(file));
+    return null;
+  }
+
+  async function createSession(file) {
+    const resp = await fetch(form.dataset.sessionsUrl, {
+      method: "POST",
+      credentials: "same-origin",
+      headers: { "Content-Type": "application/json", "X-CSRFToken": csrfToken },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        name: form.elements.name.value.trim(),
+        description: form.elements.description.value,
+        category: form.elements.category.value,
+      }),
+    });
+    const isJson = (resp.headers.get("Content-Type") || "").indexOf("application/json") === 0;
+    if (!isJson) return null; // kein Sitzungs-Endpunkt → normales Formular
+    const data = await resp.json();
+    if (!resp.ok) throw new Error(data.error || "Upload nicht möglich");
+    try {
+      localStorage.setItem(storageKey(file), JSON.stringify({ url: data.url }));
+    } catch (e) {
+      // ohne localStorage nur kein Fortsetzen nach Neuladen
+    }
+    return data;
+  }
+
+  async function currentOffset(url) {
+    const resp = await fetch(url, { method: "HEAD", credentials: "same-origin", cache: "no-store" });
+    if (!resp.ok) throw new Error("Upload-Sitzung nicht mehr vorhanden");
+    return parseInt(resp.headers.get("Upload-Offset"), 10);
+  }
+
+  async function sendChunks(file, upload) {
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+      show(offset, file.size);
+      const chunk = file.slice(offset, offset + upload.chunk_size);
+      try {
+        const resp = await fetch(upload.url, {
+          method: "PATCH",
+          credentials: "same-origin",
+          headers: {
+            "Content-Type": "application/offset+octet-stream",
+            "Upload-Offset": String(offset),
+            "X-CSRFToken": csrfToken,
+          },
+          body: chunk,
+        });
+        if (resp.status === 204 || resp.status === 409) {
+          // 409: Server kennt einen anderen Stand (z.B. Antwort ging verloren) → dort weiter
+          offset = parseInt(resp.headers.get("Upload-Offset"), 10);
+          failures = 0;
+          continue;
+        }
+        if (resp.status < 500) {
+          const data = await resp.json().catch(() => ({}));
+          throw Object.assign(new Error(data.error || "Upload abgelehnt"), { fatal: true });
+        }
+      } catch (e) {
+        if (e.fatal) throw e;
+      }
+      // Netzwerkfehler oder 5xx: nur dieses Teilstück wiederholen, mit wachsender Pause
+      failures += 1;
+      if (failures > MAX_RETRIES) throw new Error("Verbindung verloren – später erneut hochladen, der Upload wird fortgesetzt.");
+      show(offset, file.size, "Verbindung unterbrochen, neuer Versuch …");
+      await sleep(Math.min(30000, 1000 * 2 ** (failures - 1)));
+      try {
+        offset = await currentOffset(upload.url);
+      } catch (e) {
+        // Offset beim nächsten Versuch erneut abfragen
+      }
+    }
+    show(file.size, file.size, "Wird übernommen …");
+  }
+
+  async function finalize(file, upload) {
+    const resp = await fetch(upload.finalize_url, {
+      method: "POST",
+      credentials: "same-origin",
+      headers: { "X-CSRFToken": csrfToken },
+    });
+    const data = await resp.json().catch(() => ({}));
+    if (!resp.ok) throw new Error(data.error || "Upload konnte nicht abgeschlossen werden");
+    localStorage.removeItem(storageKey(file));
+    return data;
+  }
+
+  form.addEventListener("submit", async function (e) {
+    const file = form.elements.image.files[0];
+    if (!file || !form.checkValidity()) return;
+    e.preventDefault();
+    if (busy) return;
+    busy = true;
+    const submitBtn = form.querySelector("button[type='submit']");
+    submitBtn.disabled = true;
+    try {
+      const upload = (await resumeSession(file)) || (await createSession(file));
+      if (!upload) {
+        form.submit();
+        return;
+      }
+      await sendChunks(file, upload);
+      const result = await finalize(file, upload);
+      window.location.href = result.status === "duplicate" ? result.url : form.dataset.doneUrl;
+    } catch (err) {
+      show(0, 0, err.message);
+      submitBtn.disabled = false;
+    } finally {
+      busy = false;
+    }
+  });
+});
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Fingerprinting und vorkomprimierte Varianten für /static.
+
+url_for('static', ...) hängt automatisch ?v=<Inhalts-Hash> an. Trägt eine
+Anfrage den aktuellen Hash, darf der Browser die Datei ein Jahr lang ohne
+Rückfrage verwenden (immutable); ändert sich die Datei, ändert sich die URL.
+
+Liegt neben einer Datei eine .br- bzw. .gz-Variante (erzeugt mit
+`python static_assets.py`, beim gunicorn-Start automatisch), wird sie
+ausgeliefert, wenn der Browser die Kodierung akzeptiert. Brotli ist
+optional (Paket `brotli`); ohne es gibt es nur gzip.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 12
+
+# Nur Textformate lohnen die Kompression; PNG/JPEG sind bereits komprimiert
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.webmanifest'}
+MIN_COMPRESS_BYTES = 512
+
+# (Kodierung, Dateiendung) in Präferenzreihenfolge
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_fingerprints = {}   # Pfad -> (mtime_ns, Hash)
+
+
+def fingerprint(path):
+    """Kurzer Inhalts-Hash einer Datei (pro Prozess nach mtime gecacht) oder None."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+    _fingerprints[path] = (mtime, value)
+    return value
+
+
+def _static_path(app, filename):
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+def init_app(app):
+    """Ersetzt die Static-Route und hängt Fingerprints an url_for('static', ...)."""
+
+    @app.url_defaults
+    def _add_fingerprint(endpoint, values):
+        if endpoint != 'static' or 'v' in values or 'filename' not in values:
+            return
+        path = _static_path(app, values['filename'])
+        if path:
+            values['v'] = fingerprint(path)
+
+    def static(filename):
+        path = _static_path(app, filename)
+        if path is None:
+            abort(404)
+
+        served, encoding = path, None
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            mtime = os.path.getmtime(path)
+            for name, ext in ENCODINGS:
+                variant = path + ext
+                if name in request.accept_encodings and os.path.exists(variant) \
+                        and os.path.getmtime(variant) >= mtime:
+                    served, encoding = variant, name
+                    break
+
+        # Mit aktuellem Fingerprint ein Jahr unveränderlich, sonst cachen, aber immer per ETag revalidieren
+        fresh = request.args.get('v') == fingerprint(path)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        resp = send_file(served, mimetype=mimetype, conditional=True, etag=True,
+                         max_age=IMMUTABLE_MAX_AGE if fresh else None)
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        resp.vary.add('Accept-Encoding')
+        resp.cache_control.public = True
+        if fresh:
+            resp.cache_control.immutable = True
+        return resp
+
+    app.view_functions['static'] = static
+
+
+def build(static_folder):
+    """
+    Schreibt .gz- (und mit brotli .br-)Varianten neben alle komprimierbaren
+    Dateien. Bereits aktuelle Varianten werden übersprungen.
+
+    Returns:
+        int: Anzahl geschriebener Dateien
+    """
+    written = 0
+    for root, _dirs, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            if os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for encoding, ext in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                variant = path + ext
+                if os.path.exists(variant) and os.path.getmtime(variant) >= mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) >= len(data):
+                    continue
+                tmp = variant + '.part'
+                with open(tmp, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp, variant)
+                written += 1
+    return written
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    count = build(folder)
+    print(f"{count} vorkomprimierte Dateien geschrieben ({'gzip + brotli' if brotli else 'nur gzip'})")
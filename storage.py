@@ -0,0 +1,498 @@
+"""
+Ablage für Originale und Derivate.
+
+Die Anwendung spricht Bilddateien nur über ihren Schlüssel an (den
+Dateinamen aus images.filepath bzw. derivatives.path); wo die Bytes liegen,
+entscheidet das Backend:
+
+- LocalStorage: Verzeichnisbaum mit Hash-Verteilung, <root>/ab/cd/<schlüssel>
+  (ab/cd = die ersten Stellen des SHA-1 des Schlüssels), damit kein
+  Verzeichnis mehr als ein paar Dutzend Einträge bekommt. Mit sharded=False
+  das alte flache Verzeichnis.
+- S3Storage: S3-kompatibler Objektspeicher (AWS, MinIO oder s3_standin.py
+  für lokale Tests), nur Standardbibliothek, Signatur V4.
+- FallbackStorage: schreibt in die neue Ablage und liest zusätzlich aus der
+  alten, bis migrate_storage.py alles umgezogen hat. Dadurch geht die
+  Umstellung ohne Downtime.
+
+Gelesen und geschrieben wird in Blöcken; eine ganze Datei liegt nie im Speicher.
+Das Modul importiert Flask nicht und ist in Pool-Prozessen verwendbar.
+"""
+import errno
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+BLOCK_SIZE = 1024 * 1024
+SHARD_LEVELS = 2
+
+
+class StorageError(OSError):
+    """Das Backend hat eine Anfrage abgelehnt (nicht: Datei fehlt)."""
+
+
+def check_key(key):
+    """Schlüssel sind einfache Dateinamen; alles andere wäre ein Pfad aus der Ablage heraus."""
+    if not key or '/' in key or '\\' in key or '\0' in key or key.startswith('.'):
+        raise ValueError(f"Ungültiger Schlüssel: {key!r}")
+    return key
+
+
+def _copy_stream(source, target):
+    for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+        target.write(block)
+
+
+class LocalStorage:
+    """Dateien unter `root`, hash-verteilt oder (sharded=False) flach."""
+
+    def __init__(self, root, sharded=True):
+        self.root = os.path.abspath(root)
+        self.sharded = sharded
+
+    def describe(self):
+        return f"{self.root} ({'Hash-Verzeichnisse' if self.sharded else 'flach'})"
+
+    def path(self, key):
+        check_key(key)
+        if not self.sharded:
+            return os.path.join(self.root, key)
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root, *(digest[2 * i:2 * i + 2] for i in range(SHARD_LEVELS)), key)
+
+    def local_file(self, key):
+        """Pfad der Datei auf dieser Platte oder None."""
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+    def exists(self, key):
+        return self.local_file(key) is not None
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def save(self, key, fileobj):
+        """Schreibt einen Stream unter `key` (über .part + rename, nie halb sichtbar)."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as f:
+            _copy_stream(fileobj, f)
+        os.replace(path + '.part', path)
+
+    def put_file(self, key, source_path, move=False):
+        """Übernimmt eine lokale Datei; mit move auf demselben Dateisystem per rename."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            try:
+                os.replace(source_path, path)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        shutil.copyfile(source_path, path + '.part')
+        os.replace(path + '.part', path)
+        if move:
+            os.remove(source_path)
+
+    def fetch(self, key, target_path):
+        """Stellt die Datei unter `target_path` bereit (Hardlink, sonst Kopie)."""
+        source = self.path(key)
+        try:
+            os.link(source, target_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise FileNotFoundError(errno.ENOENT, "Datei fehlt", key) from None
+            shutil.copyfile(source, target_path)
+
+    def copy(self, source_key, target_key):
+        """Dateien ändern sich nie, eine Kopie darf deshalb ein Hardlink sein."""
+        target = self.path(target_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self.fetch(source_key, target)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_path(self, key):
+        path = self.local_file(key)
+        if path is None:
+            raise FileNotFoundError(errno.ENOENT, "Datei fehlt", key)
+        yield path
+
+    @contextmanager
+    def tempdir(self):
+        """Arbeitsverzeichnis auf demselben Dateisystem (Übernahme per rename)."""
+        base = os.path.join(self.root, '.tmp')
+        os.makedirs(base, exist_ok=True)
+        work = tempfile.mkdtemp(dir=base)
+        try:
+            yield work
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    def keys(self):
+        """Alle Dateien als (schlüssel, bytes, mtime)."""
+        if not os.path.isdir(self.root):
+            return
+        if not self.sharded:
+            yield from self._files(self.root)
+            return
+        dirs = [self.root]
+        for _ in range(SHARD_LEVELS):
+            dirs = [entry.path for d in dirs for entry in os.scandir(d)
+                    if entry.is_dir() and len(entry.name) == 2 and _is_hex(entry.name)]
+        for d in dirs:
+            yield from self._files(d)
+
+    @staticmethod
+    def _files(folder):
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.part'):
+                    stat = entry.stat()
+                    yield entry.name, stat.st_size, stat.st_mtime
+
+
+def _is_hex(name):
+    return all(c in '0123456789abcdef' for c in name)
+
+
+class _Response:
+    """Lesbarer Body einer S3-Antwort; schließt beim close() auch die Verbindung."""
+
+    def __init__(self, conn, resp):
+        self._conn = conn
+        self._resp = resp
+
+    def read(self, size=-1):
+        return self._resp.read(size)
+
+    def readinto(self, buffer):
+        return self._resp.readinto(buffer)
+
+    def close(self):
+        self._resp.close()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class S3Storage:
+    """
+    Objekte `<prefix><schlüssel>` in einem Bucket eines S3-kompatiblen Dienstes.
+
+    Pfad-Adressierung (endpoint/bucket/key), Payload unsigniert
+    (UNSIGNED-PAYLOAD), damit Uploads gestreamt werden können. Objektspeicher
+    kennen keine Verzeichnisse, der Schlüssel bleibt daher unverteilt.
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, endpoint, bucket, prefix='', region='us-east-1', access_key='', secret_key=''):
+        parts = urlsplit(endpoint)
+        self.scheme = parts.scheme or 'https'
+        self.host = parts.netloc
+        self.bucket = bucket
+        self.prefix = prefix
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    @classmethod
+    def from_env(cls, prefix):
+        return cls(os.environ['S3_ENDPOINT'], os.environ['S3_BUCKET'], prefix,
+                   os.environ.get('S3_REGION', 'us-east-1'),
+                   os.environ.get('S3_ACCESS_KEY', ''), os.environ.get('S3_SECRET_KEY', ''))
+
+    def describe(self):
+        return f"{self.scheme}://{self.host}/{self.bucket}/{self.prefix}"
+
+    # --- HTTP ---
+    def _sign(self, method, path, query, headers):
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        headers.update({'host': self.host, 'x-amz-date': amz_date, 'x-amz-content-sha256': 'UNSIGNED-PAYLOAD'})
+        signed = sorted(k for k in headers if k == 'host' or k.startswith('x-amz-'))
+        canonical = '\n'.join([
+            method, path,
+            '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())),
+            ''.join(f"{k}:{headers[k].strip()}\n" for k in signed),
+            ';'.join(signed),
+            'UNSIGNED-PAYLOAD',
+        ])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest(),
+        ])
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (amz_date[:8], self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+
+    def _request(self, method, key=None, query=None, body=None, length=None):
+        """Schickt eine signierte Anfrage; Rückgabe (Verbindung, Antwort)."""
+        import http.client
+        query = query or {}
+        path = '/' + quote(self.bucket)
+        if key is not None:
+            path += '/' + quote(self.prefix + check_key(key), safe='/~')
+        headers = {}
+        self._sign(method, path, query, headers)
+        if length is not None:
+            headers['Content-Length'] = str(length)
+        conn_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        conn = conn_class(self.host, timeout=self.TIMEOUT, blocksize=BLOCK_SIZE)
+        target = path + ('?' + '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                                        for k, v in sorted(query.items())) if query else '')
+        try:
+            conn.request(method, target, body=body, headers=headers)
+            resp = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+        if resp.status == 404:
+            conn.close()
+            raise FileNotFoundError(errno.ENOENT, "Objekt fehlt", key)
+        if resp.status >= 300:
+            detail = resp.read(500).decode('utf-8', 'replace')
+            conn.close()
+            raise StorageError(f"S3 {method} {target}: HTTP {resp.status} {detail}")
+        return conn, resp
+
+    def _simple(self, method, key, **kwargs):
+        conn, resp = self._request(method, key, **kwargs)
+        try:
+            resp.read()
+            return resp
+        finally:
+            conn.close()
+
+    # --- Backend-Schnittstelle ---
+    def local_file(self, key):
+        return None
+
+    def exists(self, key):
+        return self.size(key) is not None
+
+    def size(self, key):
+        try:
+            return int(self._simple('HEAD', key).getheader('Content-Length'))
+        except FileNotFoundError:
+            return None
+
+    def open(self, key):
+        return _Response(*self._request('GET', key))
+
+    def save(self, key, fileobj):
+        try:
+            start = fileobj.tell()
+            length = fileobj.seek(0, os.SEEK_END) - start
+            fileobj.seek(start)
+        except (AttributeError, OSError):
+            # Nicht spulbarer Stream: erst auf die Platte, S3 braucht die Länge vorab
+            with tempfile.TemporaryFile() as spool:
+                _copy_stream(fileobj, spool)
+                spool.seek(0)
+                return self.save(key, spool)
+        self._simple('PUT', key, body=fileobj, length=length)
+
+    def put_file(self, key, source_path, move=False):
+        """Lädt hoch; mit move wird die lokale Datei erst nach geprüfter Größe gelöscht."""
+        length = os.path.getsize(source_path)
+        with open(source_path, 'rb') as f:
+            self._simple('PUT', key, body=f, length=length)
+        if move:
+            stored = self.size(key)
+            if stored != length:
+                raise StorageError(f"{key}: {stored} statt {length} Bytes in S3, lokale Datei bleibt")
+            os.remove(source_path)
+
+    def fetch(self, key, target_path):
+        with self.open(key) as source, open(target_path + '.part', 'wb') as f:
+            _copy_stream(source, f)
+        os.replace(target_path + '.part', target_path)
+
+    def copy(self, source_key, target_key):
+        with self.open(source_key) as source, tempfile.TemporaryFile() as spool:
+            _copy_stream(source, spool)
+            spool.seek(0)
+            self.save(target_key, spool)
+
+    def delete(self, key):
+        try:
+            self._simple('DELETE', key)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_path(self, key):
+        with self.tempdir() as work:
+            path = os.path.join(work, key)
+            self.fetch(key, path)
+            yield path
+
+    @contextmanager
+    def tempdir(self):
+        work = tempfile.mkdtemp(prefix='storage-')
+        try:
+            yield work
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    def keys(self):
+        import xml.etree.ElementTree as ET
+        ns = {'s3': 'http://s3.amazonaws.com/doc/2006-03-01/'}
+        query = {'list-type': '2', 'prefix': self.prefix}
+        while True:
+            conn, resp = self._request('GET', query=query)
+            try:
+                root = ET.fromstring(resp.read())
+            finally:
+                conn.close()
+            for item in root.findall('s3:Contents', ns):
+                name = item.findtext('s3:Key', namespaces=ns)[len(self.prefix):]
+                if '/' in name or not name:
+                    continue
+                modified = datetime.fromisoformat(item.findtext('s3:LastModified', namespaces=ns).replace('Z', '+00:00'))
+                yield name, int(item.findtext('s3:Size', namespaces=ns)), modified.timestamp()
+            token = root.findtext('s3:NextContinuationToken', namespaces=ns)
+            if root.findtext('s3:IsTruncated', namespaces=ns) != 'true' or not token:
+                return
+            query = {**query, 'continuation-token': token}
+
+
+class FallbackStorage:
+    """
+    Neue Ablage (primary) mit Lesezugriff auf die alte (legacy) während der Migration.
+
+    Geschrieben wird nur in primary, gelöscht in beiden. Beim Lesen wird nach
+    legacy noch einmal in primary gesucht: migrate_storage.py kann eine Datei
+    genau zwischen den beiden Blicken umbenannt haben.
+    """
+
+    def __init__(self, primary, legacy):
+        self.primary = primary
+        self.legacy = legacy
+
+    def describe(self):
+        return f"{self.primary.describe()} (liest auch {self.legacy.describe()})"
+
+    def _holder(self, key):
+        for store in (self.primary, self.legacy, self.primary):
+            if store.exists(key):
+                return store
+        return self.primary
+
+    def local_file(self, key):
+        for store in (self.primary, self.legacy, self.primary):
+            path = store.local_file(key)
+            if path is not None:
+                return path
+        return None
+
+    def exists(self, key):
+        return any(store.exists(key) for store in (self.primary, self.legacy, self.primary))
+
+    def size(self, key):
+        return self._holder(key).size(key)
+
+    def open(self, key):
+        for store in (self.primary, self.legacy):
+            try:
+                return store.open(key)
+            except FileNotFoundError:
+                pass
+        return self.primary.open(key)
+
+    def save(self, key, fileobj):
+        self.primary.save(key, fileobj)
+
+    def put_file(self, key, source_path, move=False):
+        self.primary.put_file(key, source_path, move)
+
+    def fetch(self, key, target_path):
+        self._holder(key).fetch(key, target_path)
+
+    def copy(self, source_key, target_key):
+        holder = self._holder(source_key)
+        if holder is self.primary:
+            self.primary.copy(source_key, target_key)
+        else:
+            with holder.open(source_key) as source:
+                self.primary.save(target_key, source)
+
+    def delete(self, key):
+        self.primary.delete(key)
+        self.legacy.delete(key)
+
+    def local_path(self, key):
+        return self._holder(key).local_path(key)
+
+    def tempdir(self):
+        return self.primary.tempdir()
+
+    def keys(self):
+        seen = set()
+        for name, size, mtime in self.primary.keys():
+            seen.add(name)
+            yield name, size, mtime
+        for name, size, mtime in self.legacy.keys():
+            if name not in seen:
+                yield name, size, mtime
+
+    def pending(self):
+        """Dateien, die noch in der alten Ablage liegen: (schlüssel, bytes)."""
+        for name, size, _mtime in self.legacy.keys():
+            yield name, size
+
+    def migrate(self, key):
+        """Zieht eine Datei aus der alten in die neue Ablage um."""
+        path = self.legacy.local_file(key)
+        if path is not None:
+            self.primary.put_file(key, path, move=True)
+        else:
+            with self.legacy.open(key) as source:
+                self.primary.save(key, source)
+        self.legacy.delete(key)
+
+
+def from_env(kind, local_root):
+    """
+    Ablage für `kind` ('ORIGINALS' oder 'DERIVATIVES') nach Umgebung.
+
+    <kind>_STORAGE=local (Standard): Hash-Verzeichnisse unter local_root,
+    liest noch aus dem alten flachen Verzeichnis. <kind>_STORAGE=s3: Bucket
+    aus S3_ENDPOINT/S3_BUCKET/S3_REGION/S3_ACCESS_KEY/S3_SECRET_KEY mit Präfix
+    <kind>_S3_PREFIX (Standard 'originals/' bzw. 'derivatives/'), liest noch
+    von der lokalen Platte.
+    """
+    local = FallbackStorage(LocalStorage(local_root), LocalStorage(local_root, sharded=False))
+    backend = os.environ.get(f'{kind}_STORAGE', 'local')
+    if backend == 'local':
+        return local
+    if backend == 's3':
+        prefix = os.environ.get(f'{kind}_S3_PREFIX', kind.lower() + '/')
+        return FallbackStorage(S3Storage.from_env(prefix), local)
+    raise ValueError(f"{kind}_STORAGE: unbekanntes Backend {backend!r}")
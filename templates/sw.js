@@ -0,0 +1,197 @@
+// Service Worker der Offline-Karte, ausgeliefert von app.service_worker().
+//
+// - App-Hülle (Karte, static/ mit Fingerprint, Leaflet/Bootstrap vom CDN): beim Installieren abgelegt
+// - /api/markers: stale-while-revalidate; ändert sich X-Data-Version, bekommt die Seite Bescheid
+// - Thumbnails und Kacheln: cache-first in größenbeschränkten Caches (älteste Einträge fliegen zuerst)
+const CONFIG = {{ config|tojson }};
+
+const SHELL_CACHE = `shell-${CONFIG.version}`;
+const MARKER_CACHE = "markers";
+const THUMBNAIL_CACHE = "thumbnails";
+const TILE_CACHE = "tiles";
+const NAVIGATION_TIMEOUT_MS = 2500;
+const OPAQUE_SIZE_ESTIMATE = 20 * 1024;   // Antworten ohne lesbare Größe (fremde Kacheln)
+
+const tilePatterns = CONFIG.tileTemplates.map((template) => {
+  const absolute = template.startsWith("/") ? self.location.origin + template : template;
+  const escaped = absolute.replace(/[.*+?^$()|[\]\\]/g, "\\$&");
+  return new RegExp("^" + escaped.replace(/\{s\}/g, "[a-z0-9-]+").replace(/\{[zxy]\}/g, "\\d+") + "$");
+});
+
+// --- Installation: App-Hülle ablegen ---
+self.addEventListener("install", (event) => {
+  event.waitUntil(
+    caches.open(SHELL_CACHE)
+      .then((cache) => Promise.all(CONFIG.precache.map((url) =>
+        // Einzeln, damit ein nicht erreichbares CDN die Installation nicht scheitern lässt
+        fetch(url, { credentials: "same-origin" })
+          .then((resp) => (resp.ok ? cache.put(url, resp) : null))
+          .catch(() => null)
+      )))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener("activate", (event) => {
+  event.waitUntil(
+    caches.keys()
+      .then((names) => Promise.all(names
+        .filter((name) => name.startsWith("shell-") && name !== SHELL_CACHE)
+        .map((name) => caches.delete(name))))
+      .then(() => self.clients.claim())
+  );
+});
+
+// --- Begrenzung der Laufzeit-Caches ---
+const cacheBytes = {};   // Cache-Name → geschätzte Bytes (nach Neustart des Workers neu ermittelt)
+
+function responseSize(resp) {
+  const length = parseInt(resp.headers.get("Content-Length") || "", 10);
+  return Number.isFinite(length) ? length : OPAQUE_SIZE_ESTIMATE;
+}
+
+async function measure(cache, name) {
+  if (cacheBytes[name] === undefined) {
+    let total = 0;
+    for (const request of await cache.keys()) {
+      const resp = await cache.match(request);
+      total += resp ? responseSize(resp) : 0;
+    }
+    cacheBytes[name] = total;
+  }
+  return cacheBytes[name];
+}
+
+async function putBounded(name, request, resp, maxBytes) {
+  const cache = await caches.open(name);
+  await measure(cache, name);
+  await cache.put(request, resp);
+  cacheBytes[name] += responseSize(resp);
+  if (cacheBytes[name] <= maxBytes) return;
+  // cache.keys() liefert in Einfügereihenfolge: von vorn löschen, bis wieder Platz ist
+  for (const old of await cache.keys()) {
+    if (cacheBytes[name] <= maxBytes * 0.9) break;
+    const stale = await cache.match(old);
+    await cache.delete(old);
+    cacheBytes[name] -= stale ? responseSize(stale) : 0;
+  }
+}
+
+async function trimEntries(name, maxEntries) {
+  const cache = await caches.open(name);
+  const keys = await cache.keys();
+  for (const old of keys.slice(0, Math.max(0, keys.length - maxEntries))) {
+    await cache.delete(old);
+  }
+}
+
+// --- Strategien ---
+async function cacheFirst(request, name, maxBytes) {
+  const cached = await caches.match(request);
+  if (cached) return cached;
+  const resp = await fetch(request);
+  if (resp.ok || resp.type === "opaque") {
+    await putBounded(name, request, resp.clone(), maxBytes);
+  }
+  return resp;
+}
+
+async function staleWhileRevalidate(request, name, event) {
+  const cache = await caches.open(name);
+  const cached = await cache.match(request);
+  const network = fetch(request).then(async (resp) => {
+    if (resp.ok) {
+      await cache.put(request, resp.clone());
+      if (!cached) event.waitUntil(trimEntries(name, CONFIG.markerCacheEntries));
+    }
+    return resp;
+  });
+  if (!cached) {
+    return network.catch(() => closestMarkers(cache, request));
+  }
+  event.waitUntil(network.then((resp) => {
+    const before = cached.headers.get("X-Data-Version");
+    const after = resp.headers.get("X-Data-Version");
+    if (resp.ok && before !== after) return notifyClients({ type: "markers-updated", version: after });
+    return null;
+  }).catch(() => null));
+  return cached;
+}
+
+// Offline und genau dieser Ausschnitt nie geladen: bestpassenden gespeicherten Ausschnitt
+// gleicher Zoomstufe und Kategorie nehmen (größte Überlappung)
+async function closestMarkers(cache, request) {
+  const wanted = new URL(request.url).searchParams;
+  const box = (params) => (params.get("bbox") || "").split(",").map(Number);
+  const [w, s, e, n] = box(wanted);
+  let best = null;
+  let bestArea = 0;
+  for (const candidate of await cache.keys()) {
+    const params = new URL(candidate.url).searchParams;
+    if (params.get("zoom") !== wanted.get("zoom") || params.get("category") !== wanted.get("category")) continue;
+    const [cw, cs, ce, cn] = box(params);
+    const area = Math.max(0, Math.min(e, ce) - Math.max(w, cw)) * Math.max(0, Math.min(n, cn) - Math.max(s, cs));
+    if (area > bestArea) {
+      best = candidate;
+      bestArea = area;
+    }
+  }
+  if (best) return cache.match(best);
+  return new Response(JSON.stringify({ clusters: [], points: [], offline: true }), {
+    status: 503,
+    headers: { "Content-Type": "application/json" },
+  });
+}
+
+async function networkFirstPage(request) {
+  const cache = await caches.open(SHELL_CACHE);
+  try {
+    const resp = await Promise.race([
+      fetch(request),
+      new Promise((_, reject) => setTimeout(() => reject(new Error("timeout")), NAVIGATION_TIMEOUT_MS)),
+    ]);
+    // Nur eine Kopie pro Pfad, nicht pro ?focus=…
+    if (resp.ok) await cache.put(new URL(request.url).pathname, resp.clone());
+    return resp;
+  } catch (err) {
+    // z.B. /map?focus=12 oder / → die abgelegte Karte
+    const cached = await cache.match(request, { ignoreSearch: true }) || await cache.match(CONFIG.shellPages[0]);
+    if (cached) return cached;
+    throw err;
+  }
+}
+
+async function notifyClients(message) {
+  const clients = await self.clients.matchAll({ type: "window" });
+  clients.forEach((client) => client.postMessage(message));
+}
+
+// --- Routing ---
+self.addEventListener("fetch", (event) => {
+  const request = event.request;
+  if (request.method !== "GET") return;
+  const url = new URL(request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (request.mode === "navigate") {
+    if (sameOrigin && CONFIG.shellPages.includes(url.pathname)) {
+      event.respondWith(networkFirstPage(request));
+    }
+    return;
+  }
+  if (sameOrigin && url.pathname === CONFIG.markersUrl) {
+    event.respondWith(staleWhileRevalidate(request, MARKER_CACHE, event));
+    return;
+  }
+  if (sameOrigin && CONFIG.thumbnailPrefixes.some((prefix) => url.pathname.startsWith(prefix))) {
+    event.respondWith(cacheFirst(request, THUMBNAIL_CACHE, CONFIG.thumbnailCacheBytes));
+    return;
+  }
+  if (tilePatterns.some((pattern) => pattern.test(request.url))) {
+    event.respondWith(cacheFirst(request, TILE_CACHE, CONFIG.tileCacheBytes));
+    return;
+  }
+  if (CONFIG.precache.includes(sameOrigin ? url.pathname + url.search : request.url)) {
+    event.respondWith(caches.match(request).then((cached) => cached || fetch(request)));
+  }
+});
@@ -0,0 +1,288 @@
+"""
+Caching-Proxy für Kartenkacheln (/tiles/<layer>/<z>/<x>/<y>).
+
+Kacheln werden vom konfigurierten Upstream geholt und als BLOBs in einer
+SQLite-Datei (ähnlich MBTiles) abgelegt, die alle gunicorn-Worker teilen.
+Nach TILE_TTL gilt eine Kachel als veraltet und wird beim nächsten Zugriff
+neu geholt; ist der Upstream dann nicht erreichbar, wird die alte Kachel
+weiter ausgeliefert. Überschreitet der Cache max_bytes, fliegen die am
+längsten nicht benutzten Kacheln raus (LRU, bis 90 %). Die Gesamtgröße
+steht als laufende Summe in `stats` und wird in derselben Transaktion wie
+jede Änderung an `tiles` nachgeführt, damit kein Schreibzugriff die ganze
+Tabelle summieren muss.
+
+Gleichzeitige Anfragen nach derselben Kachel lösen nur einen Upstream-Abruf
+aus: innerhalb eines Prozesses warten die anderen Threads auf das Ergebnis,
+zwischen Prozessen verhindert eine kurze Reservierung (Tabelle `fetching`)
+den doppelten Abruf. Ein Prozess, der keine Reservierung bekommt, wartet
+höchstens FOLLOWER_WAIT Sekunden und holt die Kachel danach selbst.
+"""
+import hashlib
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import db
+from db import transaction
+
+TOUCH_INTERVAL = 300.0      # last_access höchstens so oft (s) pro Kachel aktualisieren
+EVICT_TO_RATIO = 0.9
+EVICT_BATCH = 200           # Kacheln pro Lösch-Transaktion
+FETCH_TIMEOUT = 10.0        # Sekunden für einen Upstream-Abruf
+FETCH_LEASE = 15.0          # so lange (s) gilt die Reservierung eines anderen Prozesses
+FOLLOWER_WAIT = 1.5         # höchstens so lange (s) auf den Abruf eines anderen Prozesses warten
+FOLLOWER_POLL = 0.1         # Sekunden zwischen zwei Blicken in den Cache beim Warten
+USER_AGENT = 'MTBUploadPicToMap-TileProxy/1.0'
+
+
+class TileUnavailable(Exception):
+    """Kachel weder im Cache noch vom Upstream zu bekommen."""
+
+
+class TileCache:
+
+    def __init__(self, path, upstreams, max_bytes, ttl):
+        """
+        Args:
+            path: SQLite-Datei des Caches
+            upstreams: dict layer → URL-Vorlage mit {z}, {x}, {y} und optional {s}
+            max_bytes: Obergrenze für die Summe aller Kacheln
+            ttl: Sekunden, nach denen eine Kachel neu geholt wird
+        """
+        self.path = os.path.abspath(path)
+        self.upstreams = upstreams
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._schema_ready = False
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    # --- Verbindung ---
+    def _conn(self):
+        conn = db.get_pool(self.path).acquire()
+        if not self._schema_ready:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tiles (
+              layer TEXT NOT NULL,
+              z INTEGER NOT NULL,
+              x INTEGER NOT NULL,
+              y INTEGER NOT NULL,
+              data BLOB NOT NULL,
+              content_type TEXT NOT NULL,
+              etag TEXT NOT NULL,
+              bytes INTEGER NOT NULL,
+              fetched REAL NOT NULL,
+              last_access REAL NOT NULL,
+              PRIMARY KEY (layer, z, x, y)
+            );
+            CREATE INDEX IF NOT EXISTS idx_tiles_lru ON tiles(last_access);
+            CREATE TABLE IF NOT EXISTS fetching (
+              key TEXT PRIMARY KEY,
+              started REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+              name TEXT PRIMARY KEY,
+              value INTEGER NOT NULL
+            );
+            -- Laufende Summe einmalig aus dem Bestand übernehmen (ältere Cache-Dateien)
+            INSERT INTO stats (name, value)
+            SELECT 'bytes', (SELECT COALESCE(SUM(bytes), 0) FROM tiles)
+            WHERE NOT EXISTS (SELECT 1 FROM stats WHERE name = 'bytes');
+            """)
+            self._schema_ready = True
+        return conn
+
+    def _release(self, conn):
+        db.get_pool(self.path).release(conn)
+
+    # --- Zugriff ---
+    def get(self, layer, z, x, y):
+        """
+        Liefert eine Kachel aus dem Cache oder holt sie vom Upstream.
+
+        Returns:
+            dict mit data, content_type, etag, fetched
+
+        Raises:
+            KeyError: unbekannter Layer
+            TileUnavailable: weder Cache noch Upstream liefern die Kachel
+        """
+        if layer not in self.upstreams:
+            raise KeyError(layer)
+        cached = self._lookup(layer, z, x, y)
+        if cached and time.time() - cached['fetched'] < self.ttl:
+            return cached
+
+        key = f"{layer}/{z}/{x}/{y}"
+        with self._inflight_lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            # Ein anderer Thread dieses Prozesses holt die Kachel gerade
+            event.wait(FETCH_TIMEOUT + 1)
+            result = self._lookup(layer, z, x, y)
+            if result:
+                return result
+            raise TileUnavailable(key)
+
+        try:
+            return self._fetch_coordinated(key, layer, z, x, y, cached)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _fetch_coordinated(self, key, layer, z, x, y, cached):
+        leased = self._acquire_lease(key)
+        if not leased:
+            # Ein anderer Prozess holt die Kachel: kurz auf sein Ergebnis warten. Länger
+            # hieße, einen synchronen gunicorn-Worker zu blockieren; dann lieber selbst holen.
+            deadline = time.monotonic() + FOLLOWER_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(FOLLOWER_POLL)
+                result = self._lookup(layer, z, x, y)
+                if result and (cached is None or result['fetched'] > cached['fetched']):
+                    return result
+        try:
+            data, content_type = self._fetch_upstream(layer, z, x, y)
+        except (urllib.error.URLError, OSError) as e:
+            if cached:
+                return cached   # veraltete Kachel ist besser als keine
+            raise TileUnavailable(f"{key}: {e}") from e
+        finally:
+            if leased:
+                self._drop_lease(key)
+        return self._store(layer, z, x, y, data, content_type)
+
+    def _lookup(self, layer, z, x, y):
+        conn = self._conn()
+        try:
+            row = conn.execute("""
+                SELECT data, content_type, etag, fetched, last_access FROM tiles
+                WHERE layer = ? AND z = ? AND x = ? AND y = ?
+            """, (layer, z, x, y)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row['last_access'] > TOUCH_INTERVAL:
+                conn.execute("UPDATE tiles SET last_access = ? WHERE layer = ? AND z = ? AND x = ? AND y = ?",
+                             (now, layer, z, x, y))
+            return {'data': bytes(row['data']), 'content_type': row['content_type'],
+                    'etag': row['etag'], 'fetched': row['fetched']}
+        finally:
+            self._release(conn)
+
+    def _fetch_upstream(self, layer, z, x, y):
+        url = self.upstreams[layer].format(s='abc'[(x + y) % 3], z=z, x=x, y=y)
+        req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+            content_type = resp.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise OSError(f"Upstream lieferte {content_type}")
+            return resp.read(), content_type
+
+    def _store(self, layer, z, x, y, data, content_type):
+        now = time.time()
+        etag = hashlib.sha1(data).hexdigest()[:20]
+        conn = self._conn()
+        try:
+            with transaction(conn):
+                old = conn.execute("SELECT bytes FROM tiles WHERE layer = ? AND z = ? AND x = ? AND y = ?",
+                                   (layer, z, x, y)).fetchone()
+                conn.execute("""
+                    INSERT OR REPLACE INTO tiles
+                    (layer, z, x, y, data, content_type, etag, bytes, fetched, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (layer, z, x, y, data, content_type, etag, len(data), now, now))
+                _add_bytes(conn, len(data) - (old['bytes'] if old else 0))
+            self._evict(conn)
+        finally:
+            self._release(conn)
+        return {'data': data, 'content_type': content_type, 'etag': etag, 'fetched': now}
+
+    # --- Koordination zwischen Prozessen ---
+    def _acquire_lease(self, key):
+        conn = self._conn()
+        try:
+            with transaction(conn):
+                row = conn.execute("SELECT started FROM fetching WHERE key = ?", (key,)).fetchone()
+                if row and time.time() - row['started'] < FETCH_LEASE:
+                    return False
+                conn.execute("INSERT OR REPLACE INTO fetching (key, started) VALUES (?, ?)", (key, time.time()))
+            return True
+        finally:
+            self._release(conn)
+
+    def _drop_lease(self, key):
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM fetching WHERE key = ?", (key,))
+        finally:
+            self._release(conn)
+
+    # --- Aufräumen ---
+    def _evict(self, conn):
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            total = _total_bytes(conn)
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * EVICT_TO_RATIO
+            while total > target:
+                # Kleine Stapel über den LRU-Index, damit Schreiber nie lange warten
+                with transaction(conn):
+                    rows = _until_target(conn.execute(
+                        "SELECT layer, z, x, y, bytes FROM tiles ORDER BY last_access LIMIT ?", (EVICT_BATCH,)
+                    ).fetchall(), total, target)
+                    if not rows:
+                        break
+                    conn.executemany("DELETE FROM tiles WHERE layer = ? AND z = ? AND x = ? AND y = ?",
+                                     [(row['layer'], row['z'], row['x'], row['y']) for row in rows])
+                    freed = sum(row['bytes'] for row in rows)
+                    _add_bytes(conn, -freed)
+                total -= freed
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        """dict mit tiles, bytes, max_bytes und der Anzahl veralteter Kacheln."""
+        conn = self._conn()
+        try:
+            row = conn.execute("""
+                SELECT COUNT(*) AS n, COALESCE(SUM(bytes), 0) AS total,
+                       COALESCE(SUM(fetched < ?), 0) AS expired
+                FROM tiles
+            """, (time.time() - self.ttl,)).fetchone()
+            return {'tiles': row['n'], 'bytes': row['total'], 'expired': row['expired'],
+                    'max_bytes': self.max_bytes}
+        finally:
+            self._release(conn)
+
+
+def _until_target(rows, total, target):
+    """Die ersten Zeilen (LRU-Reihenfolge), deren Löschen total auf target bringt."""
+    victims = []
+    for row in rows:
+        if total <= target:
+            break
+        victims.append(row)
+        total -= row['bytes']
+    return victims
+
+
+def _total_bytes(conn):
+    row = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()
+    return row['value'] if row else 0
+
+
+def _add_bytes(conn, delta):
+    conn.execute("""
+        INSERT INTO stats (name, value) VALUES ('bytes', ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+    """, (delta,))
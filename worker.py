@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Hintergrund-Worker für die Bildverarbeitung.
+
+Arbeitet die SQLite-Job-Queue (jobs.py) ab: die eigentliche Arbeit (HEIC
+dekodieren, EXIF lesen, Thumbnails rechnen) läuft in einem Prozess-Pool,
+die Ergebnisse schreibt nur der Hauptprozess in die Datenbank.
+
+Start:  python worker.py [--processes N]
+Unter gunicorn startet gunicorn.conf.py den Worker automatisch mit.
+"""
+import argparse
+import logging
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import db
+import jobs
+import metrics
+from app import DB_PATH, METRICS_PATH, derivative_store, original_store
+from db import transaction
+from dedupe import closest_older
+from PIL import UnidentifiedImageError
+
+from imaging import ImageTooLargeError, limit_memory, process_stored
+
+logger = logging.getLogger("worker")
+
+# Fehler, bei denen ein erneuter Versuch nichts ändert
+PERMANENT_ERRORS = (ImageTooLargeError, UnidentifiedImageError, FileNotFoundError)
+
+POLL_INTERVAL = 1.0   # Sekunden zwischen zwei Blicken in eine leere Queue
+
+# Parallelität und Speicherdeckel pro Pool-Prozess. Ein 50-MP-Bild braucht
+# dekodiert ~200 MB; mit zwei Prozessen bleibt die kleine Instanz unter 1 GB.
+DEFAULT_PROCESSES = int(os.environ.get('INGEST_PROCESSES', min(2, os.cpu_count() or 1)))
+MEMORY_LIMIT_MB = int(os.environ.get('INGEST_MEMORY_LIMIT_MB', '768'))
+
+
+def run_job(kind, payload):
+    """Läuft im Pool-Prozess; darf die Datenbank nicht anfassen."""
+    if kind == 'process_image':
+        return process_stored(payload['filepath'], original_store, derivative_store)
+    raise ValueError(f"Unbekannter Job-Typ: {kind}")
+
+
+def finish_job(conn, job, result):
+    """Übernimmt das Ergebnis eines erfolgreichen Jobs in die Datenbank."""
+    for stage, seconds in result.get('timings', {}).items():
+        metrics.record_stage(stage, seconds)
+    with metrics.stage('db_write'), transaction(conn):
+        if job['kind'] == 'process_image':
+            cur = conn.execute("""
+                UPDATE images
+                SET filepath = ?, thumbnail_path = ?, latitude = ?, longitude = ?,
+                    exif_date = ?, exif_time = ?, phash = ?, width = ?, height = ?, orientation = ?,
+                    altitude = ?, camera = ?, lens = ?, lqip = ?, status = 'ready'
+                WHERE id = ?
+            """, (result['filepath'], result['thumbnail_path'], result['latitude'], result['longitude'],
+                  result['exif_date'], result['exif_time'], result['phash'], result['width'], result['height'],
+                  result['orientation'], result['altitude'], result['camera'], result['lens'], result['lqip'],
+                  job['payload']['image_id']))
+            logger.info("Bild %s verarbeitet (Peak-RSS %.0f MB)",
+                        job['payload']['image_id'], result['peak_rss_kb'] / 1024)
+            if cur.rowcount == 0:
+                # Bild wurde während der Verarbeitung gelöscht: Ergebnisdateien aufräumen
+                original_store.delete(result['filepath'])
+                for d in result['derivatives']:
+                    derivative_store.delete(d['path'])
+            else:
+                if result['phash'] is not None:
+                    # Ähnliches älteres Bild nur markieren; entscheiden muss ein Mensch
+                    image_id = job['payload']['image_id']
+                    conn.execute("UPDATE images SET near_duplicate_of = ? WHERE id = ?",
+                                 (closest_older(conn, image_id, result['phash']), image_id))
+                conn.executemany("""
+                    INSERT OR REPLACE INTO derivatives (image_id, format, width, height, path, bytes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, [(job['payload']['image_id'], d['format'], d['width'], d['height'], d['path'], d['bytes'])
+                      for d in result['derivatives']])
+        jobs.complete(conn, job['id'])
+    metrics.inc('ingest_jobs_total', result='done')
+
+
+def fail_job(conn, job, error):
+    with transaction(conn):
+        final = jobs.fail(conn, job['id'], error, retry=not isinstance(error, PERMANENT_ERRORS))
+        if final and job['kind'] == 'process_image':
+            conn.execute("UPDATE images SET status = 'failed' WHERE id = ?", (job['payload']['image_id'],))
+    metrics.inc('ingest_jobs_total', result='failed' if final else 'retry')
+    logger.warning("Job %s (%s) fehlgeschlagen%s: %s",
+                   job['id'], job['kind'], " endgültig" if final else "", error)
+
+
+def _new_pool(args):
+    return ProcessPoolExecutor(max_workers=args.processes, initializer=limit_memory,
+                               initargs=(args.memory_limit_mb,))
+
+
+def _rebuild_pool(conn, pool, in_flight, error, args):
+    """
+    Ein Pool-Prozess ist hart gestorben (OOM-Killer, Segfault in einem Codec):
+    der Pool ist dann unbrauchbar. Alle Jobs darin zählen als Fehlversuch und
+    gehen zurück in die Queue (ein Bild, das jedes Mal abstürzt, landet nach
+    MAX_ATTEMPTS auf 'failed'); danach geht es mit einem neuen Pool weiter.
+    """
+    logger.error("Verarbeitungsprozess abgestürzt, Pool wird neu aufgebaut (%d weitere Jobs betroffen)",
+                 len(in_flight))
+    for job in in_flight.values():
+        fail_job(conn, job, error)
+    in_flight.clear()
+    pool.shutdown(wait=False, cancel_futures=True)
+    metrics.inc('ingest_pool_restarts_total')
+    return _new_pool(args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES,
+                        help="Anzahl paralleler Verarbeitungsprozesse")
+    parser.add_argument('--memory-limit-mb', type=int, default=MEMORY_LIMIT_MB,
+                        help="Adressraum-Limit pro Verarbeitungsprozess (0 = aus)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [worker] %(message)s")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    metrics.install(METRICS_PATH, 'worker')
+    conn = db.connect(DB_PATH)
+    in_flight = {}
+    last_heartbeat = 0.0
+    pool = _new_pool(args)
+    logger.info("Worker gestartet (%d Prozesse)", args.processes)
+    try:
+        while not stopping or in_flight:
+            metrics.maybe_flush()
+            if time.monotonic() - last_heartbeat >= jobs.HEARTBEAT_SECONDS:
+                # Eigene Jobs als lebendig melden, Jobs abgestürzter Worker übernehmen
+                jobs.heartbeat(conn, [job['id'] for job in in_flight.values()])
+                requeued = jobs.requeue_stale(conn)
+                if requeued:
+                    logger.info("%d verwaiste Jobs wieder eingereiht", requeued)
+                last_heartbeat = time.monotonic()
+            while not stopping and len(in_flight) < args.processes:
+                job = jobs.claim(conn)
+                if job is None:
+                    break
+                try:
+                    in_flight[pool.submit(run_job, job['kind'], job['payload'])] = job
+                except BrokenProcessPool as e:
+                    fail_job(conn, job, e)
+                    pool = _rebuild_pool(conn, pool, in_flight, e, args)
+
+            if not in_flight:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            done, _ = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            broken = None
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    broken = e
+                    fail_job(conn, job, e)
+                except Exception as e:
+                    fail_job(conn, job, e)
+                else:
+                    finish_job(conn, job, result)
+            if broken is not None:
+                pool = _rebuild_pool(conn, pool, in_flight, broken, args)
+    finally:
+        pool.shutdown()
+
+    metrics.flush()
+    conn.close()
+    logger.info("Worker beendet")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,22 @@
-from app import app
+"""
+WSGI-Einstieg (gunicorn wsgi:app).
+
+Misst, wie lange der Import der App dauert, und warnt, wenn er das Budget
+IMPORT_BUDGET_MS überschreitet: Worker sollen nach dem Start sofort
+Requests bedienen können (Schema und Admin: migrate.py).
+"""
+import os
+import time
+
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '300'))
+
+_started = time.perf_counter()
+from app import app  # noqa: E402
+import_ms = (time.perf_counter() - _started) * 1000
+if import_ms > IMPORT_BUDGET_MS:
+    app.logger.warning(f"Import der App dauerte {import_ms:.0f} ms (Budget {IMPORT_BUDGET_MS:.0f} ms)")
 
 if __name__ == '__main__':
+    import migrate
+    migrate.migrate()
     app.run()